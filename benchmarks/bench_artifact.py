@@ -0,0 +1,32 @@
+'''Cold start of a scoring process: refitting PreprocessingSeattleHousing on the raw CSV
+against loading a persisted artifact (data_pipeline/artifact.py).
+
+    python benchmarks/bench_artifact.py
+'''
+import tempfile
+
+from common import RAW_DATASET, best_of  # isort: skip (puts data_pipeline on sys.path)
+from artifact import load_artifact, save_artifact
+from preprocessing import DROP_COLUMNS, PreprocessingSeattleHousing, load_data
+from sklearn.linear_model import LinearRegression
+
+
+def refit():
+    preprocessor = PreprocessingSeattleHousing()
+    return preprocessor, preprocessor.preprocess_fit_transform(load_data(RAW_DATASET))
+
+
+def main():
+    preprocessor, dataset = refit()
+    features = [x for x in dataset.columns if x not in DROP_COLUMNS + ['id']]
+    model = LinearRegression().fit(dataset[features], dataset['price'])
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = save_artifact(tmp_dir, preprocessor, model, features)
+        print(f"refit from CSV     {best_of(refit) * 1000:8.1f} ms")
+        print(f"load (mmap)        {best_of(lambda: load_artifact(path)) * 1000:8.1f} ms")
+        print(f"load (in memory)   {best_of(lambda: load_artifact(path, mmap_mode=None)) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
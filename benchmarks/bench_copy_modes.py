@@ -0,0 +1,52 @@
+'''Peak RSS of PreprocessingSeattleHousing in its copy modes.
+
+Every mode runs in a fresh interpreter and reports the peak RSS growth over the loaded dataset:
+- defensive: the caller copies the whole frame and the pipeline runs in place (the previous practice)
+- copy:      copy=True (default), the input is left untouched and only written columns are allocated
+- inplace:   copy=False, the input frame is modified in place
+
+    python benchmarks/bench_copy_modes.py --rows 2000000
+'''
+import argparse
+import gc
+import subprocess
+import sys
+
+from common import current_rss, load_king_county, peak_rss, reset_peak_rss  # isort: skip (puts data_pipeline on sys.path)
+
+MODES = ("defensive", "copy", "inplace")
+
+
+def run_mode(mode, rows):
+    from preprocessing import PreprocessingSeattleHousing
+
+    df_dataset = load_king_county(rows)
+    gc.collect()
+    baseline = current_rss()
+    reset_peak_rss()
+
+    if mode == "defensive":
+        result = PreprocessingSeattleHousing(copy=False).preprocess_fit_transform(df_dataset.copy())
+    else:
+        result = PreprocessingSeattleHousing(copy=mode == "copy").preprocess_fit_transform(df_dataset)
+    print(peak_rss() - baseline)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=None, help="resample the dataset to this many rows")
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        return run_mode(args.mode, args.rows)
+
+    rows = ["--rows", str(args.rows)] if args.rows else []
+    for mode in MODES:
+        output = subprocess.run([sys.executable, __file__, "--mode", mode, *rows],
+                                check=True, capture_output=True, text=True).stdout
+        print(f"{mode:<10} peak RSS growth {int(output) / 2 ** 20:10.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
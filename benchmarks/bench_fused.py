@@ -0,0 +1,67 @@
+'''Time and peak RSS of the row-local arithmetic steps, one after the other and fused.
+
+Every mode runs in a fresh interpreter and reports the best time of --repeat runs and the peak RSS
+growth over the loaded dataset of:
+- unfused: SqftColumnTransformer, SqFtPriceColumnTransformer and CentreOfWealthColumnsTransformer
+- fused:   FusedArithmeticTransformer, which computes the same columns in one chunked pass
+
+    python benchmarks/bench_fused.py --rows 4000000
+'''
+import argparse
+import gc
+import json
+import subprocess
+import sys
+import time
+
+from common import current_rss, load_king_county, peak_rss, reset_peak_rss  # isort: skip (puts data_pipeline on sys.path)
+
+MODES = ("unfused", "fused")
+
+
+def run_mode(mode, rows, repeat):
+    from data_cleaning_transformers import SqftColumnTransformer
+    from feature_enginneering_tranformers import (CentreOfWealthColumnsTransformer,
+                                                  FusedArithmeticTransformer,
+                                                  SqFtPriceColumnTransformer)
+
+    if mode == "unfused":
+        steps = [SqftColumnTransformer(), SqFtPriceColumnTransformer(), CentreOfWealthColumnsTransformer()]
+    else:
+        steps = [FusedArithmeticTransformer()]
+    df_dataset = load_king_county(rows)
+    gc.collect()
+    baseline = current_rss()
+    reset_peak_rss()
+
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = df_dataset
+        for step in steps:
+            result = step.fit_transform(result)
+        seconds.append(time.perf_counter() - start)
+        del result
+    print(json.dumps({"peak_rss": peak_rss() - baseline, "seconds": min(seconds), "rows": len(df_dataset)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=4_000_000, help="resample the dataset to this many rows")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        return run_mode(args.mode, args.rows, args.repeat)
+
+    for mode in MODES:
+        output = subprocess.run([sys.executable, __file__, "--mode", mode, "--rows", str(args.rows),
+                                 "--repeat", str(args.repeat)], check=True, capture_output=True, text=True).stdout
+        result = json.loads(output)
+        print(f"{mode:<8} {result['seconds']:7.3f} s  {result['rows'] / result['seconds'] / 1e6:6.1f} M rows/s  "
+              f"peak RSS growth {result['peak_rss'] / 2 ** 20:8.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
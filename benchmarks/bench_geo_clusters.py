@@ -0,0 +1,63 @@
+'''Time and peak RSS of fitting and applying GeoClusterColumnsTransformer.
+
+Every mode runs in a fresh interpreter and reports the best time of --repeat runs and the peak RSS
+growth over the loaded dataset of:
+- fit:       GeoClusterColumnsTransformer.fit, mini-batch k-means on at most max_fit_rows rows
+- transform: GeoClusterColumnsTransformer.transform, chunked cluster assignment of every row
+
+    python benchmarks/bench_geo_clusters.py --rows 4000000
+'''
+import argparse
+import gc
+import json
+import subprocess
+import sys
+import time
+
+from common import current_rss, load_king_county, peak_rss, reset_peak_rss  # isort: skip (puts data_pipeline on sys.path)
+
+MODES = ("fit", "transform")
+
+
+def run_mode(mode, rows, repeat, n_clusters):
+    from feature_enginneering_tranformers import GeoClusterColumnsTransformer
+
+    df_dataset = load_king_county(rows)
+    transformer = GeoClusterColumnsTransformer(n_clusters=n_clusters)
+    if mode == "transform":
+        transformer.fit(df_dataset)
+    gc.collect()
+    baseline = current_rss()
+    reset_peak_rss()
+
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = transformer.fit(df_dataset) if mode == "fit" else transformer.transform(df_dataset)
+        seconds.append(time.perf_counter() - start)
+        del result
+    print(json.dumps({"peak_rss": peak_rss() - baseline, "seconds": min(seconds), "rows": len(df_dataset)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=4_000_000, help="resample the dataset to this many rows")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--n-clusters", type=int, default=16)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        return run_mode(args.mode, args.rows, args.repeat, args.n_clusters)
+
+    for mode in MODES:
+        output = subprocess.run([sys.executable, __file__, "--mode", mode, "--rows", str(args.rows),
+                                 "--repeat", str(args.repeat), "--n-clusters", str(args.n_clusters)],
+                                check=True, capture_output=True, text=True).stdout
+        result = json.loads(output)
+        print(f"{mode:<9} {result['seconds']:7.3f} s  {result['rows'] / result['seconds'] / 1e6:6.1f} M rows/s  "
+              f"peak RSS growth {result['peak_rss'] / 2 ** 20:8.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+'''Memory footprint and load time of the raw dataset: pd.read_csv with inferred dtypes
+(preprocessing.load_data) against the compact dtypes of ingestion.read_houses, parsed from CSV
+and read from its columnar (Parquet) cache.
+
+    python benchmarks/bench_ingestion.py --rows 1000000
+'''
+import argparse
+import tempfile
+from pathlib import Path
+
+from common import RAW_DATASET, best_of, load_king_county  # isort: skip (puts data_pipeline on sys.path)
+from ingestion import cache_path, memory_footprint, read_houses
+from preprocessing import load_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=None, help="resample the dataset to this many rows")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = RAW_DATASET
+        if args.rows:
+            file_path = Path(tmp_dir) / "houses.csv"
+            load_king_county(args.rows).to_csv(file_path, index=False)
+        # Fills the cache
+        read_houses(file_path, cache_dir=tmp_dir)
+
+        runs = {
+            "read_csv (inferred)": lambda: load_data(file_path),
+            "read_houses (CSV)": lambda: read_houses(file_path),
+            "read_houses (cached)": lambda: read_houses(file_path, cache_dir=tmp_dir),
+        }
+        print(f"{'':<22}{'load':>10}{'memory':>12}")
+        for name, run in runs.items():
+            print(f"{name:<22}{best_of(run, args.repeat) * 1000:8.1f}ms{memory_footprint(run()) / 2 ** 20:8.1f} MiB")
+        print(f"cache file {cache_path(file_path, tmp_dir).stat().st_size / 2 ** 20:.1f} MiB, "
+              f"CSV {Path(file_path).stat().st_size / 2 ** 20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
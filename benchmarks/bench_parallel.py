@@ -0,0 +1,32 @@
+'''Speedup of PreprocessingSeattleHousing with n_jobs > 1 against n_jobs=1.
+
+    python benchmarks/bench_parallel.py --rows 2000000 --n-jobs 1 2 4 8 16 32
+'''
+import argparse
+import os
+
+from common import best_of, load_king_county  # isort: skip (puts data_pipeline on sys.path)
+from preprocessing import PreprocessingSeattleHousing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=None, help="resample the dataset to this many rows")
+    parser.add_argument("--n-jobs", type=int, nargs="+", default=[1, 2, 4, os.cpu_count()])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    df_dataset = load_king_county(args.rows)
+    print(f"{len(df_dataset)} rows, {os.cpu_count()} cores")
+
+    baseline = None
+    for n_jobs in sorted(set(args.n_jobs)):
+        preprocessor = PreprocessingSeattleHousing(n_jobs=n_jobs)
+        seconds = best_of(lambda: preprocessor.preprocess_fit_transform(df_dataset.copy()), args.repeat)
+        baseline = baseline or seconds
+        print(f"n_jobs={n_jobs:<3} {seconds:8.3f}s  {len(df_dataset) / seconds:12,.0f} rows/s  "
+              f"speedup x{baseline / seconds:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+'''Peak RSS and fit time of the degree 2 ElasticNet model of the notebook on the preprocessed dataset.
+
+Every mode runs in a fresh interpreter and reports the peak RSS growth over the preprocessed
+dataset, the fit time and the R^2 on a held-out 30%:
+- notebook:    PolynomialFeatures materialises the float64 expansion, StandardScaler, ElasticNet
+- float32:     PolynomialExpansion materialises a float32, column-major expansion block by block,
+               scaled in place and fitted without a copy
+- out-of-core: OutOfCoreElasticNet accumulates the normal equations block by block
+
+    python benchmarks/bench_polynomial.py --rows 1000000
+'''
+import argparse
+import gc
+import json
+import subprocess
+import sys
+import time
+
+from common import current_rss, load_king_county, peak_rss, reset_peak_rss  # isort: skip (puts data_pipeline on sys.path)
+
+MODES = ("notebook", "float32", "out-of-core")
+
+
+def run_mode(mode, rows, alpha, l1_ratio):
+    from polynomial import OutOfCoreElasticNet, PolynomialExpansion
+    from preprocessing import PreprocessingSeattleHousing
+    from sklearn.linear_model import ElasticNet
+    from sklearn.metrics import r2_score
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    from train import feature_columns, model_pipeline
+
+    dataset = PreprocessingSeattleHousing().preprocess_fit_transform(load_king_county(rows))
+    features = feature_columns(dataset)
+    split = int(len(dataset) * 0.7)
+    X, y = dataset[features].to_numpy(dtype='float64'), dataset['price'].to_numpy(dtype='float64')
+    del dataset
+    gc.collect()
+    baseline = current_rss()
+    reset_peak_rss()
+
+    start = time.perf_counter()
+    if mode == "notebook":
+        model = model_pipeline(2, alpha=alpha, l1_ratio=l1_ratio).fit(X[:split], y[:split])
+    elif mode == "float32":
+        expansion = PolynomialExpansion(order='F').fit(X[:split])
+        X_train = expansion.transform(X[:split])
+        # Fitted by blocks, StandardScaler.fit would allocate float64 temporaries of the whole matrix
+        scaler = StandardScaler(copy=False)
+        for block_start in range(0, split, expansion.block_size):
+            scaler.partial_fit(X_train[block_start:block_start + expansion.block_size])
+        X_train = scaler.transform(X_train)
+        elastic = ElasticNet(alpha=alpha, l1_ratio=l1_ratio, max_iter=50000, tol=0.2, copy_X=False).fit(
+            X_train, y[:split].astype('float32'))
+        del X_train
+        model = make_pipeline(expansion, scaler, elastic)
+    else:
+        model = OutOfCoreElasticNet(alpha=alpha, l1_ratio=l1_ratio).fit(X[:split], y[:split])
+    fit_time = time.perf_counter() - start
+    r2 = r2_score(y[split:], model.predict(X[split:]))
+    print(json.dumps({"peak_rss": peak_rss() - baseline, "fit_time": fit_time, "r2": r2}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=None, help="resample the dataset to this many rows")
+    parser.add_argument("--alpha", type=float, default=0.5)
+    parser.add_argument("--l1-ratio", type=float, default=0.5)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        return run_mode(args.mode, args.rows, args.alpha, args.l1_ratio)
+
+    rows = ["--rows", str(args.rows)] if args.rows else []
+    for mode in MODES:
+        output = subprocess.run([sys.executable, __file__, "--mode", mode, "--alpha", str(args.alpha),
+                                 "--l1-ratio", str(args.l1_ratio), *rows],
+                                check=True, capture_output=True, text=True).stdout
+        result = json.loads(output)
+        print(f"{mode:<12} peak RSS growth {result['peak_rss'] / 2 ** 20:8.1f} MiB  "
+              f"fit {result['fit_time']:7.2f} s  R^2 {result['r2']:.4f}")
+
+
+if __name__ == "__main__":
+    main()
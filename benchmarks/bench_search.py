@@ -0,0 +1,61 @@
+'''Latency of /houses/search queries on SQLite, with and without the secondary indexes of
+models.House.
+
+    python benchmarks/bench_search.py --rows 1000000
+'''
+import argparse
+import tempfile
+from pathlib import Path
+
+from common import best_of, king_county_houses, use_service  # isort: skip (puts data_pipeline on sys.path)
+
+QUERIES = {
+    "zipcode": dict(zipcode=98178),
+    "zipcode + price range": dict(zipcode=98004, min_price=1_000_000, max_price=2_000_000),
+    "price range": dict(min_price=2_000_000, max_price=2_100_000),
+    "bedrooms + grade": dict(bedrooms=6, min_grade=11),
+    "waterfront": dict(waterfront=True),
+    "bounding box": dict(min_lat=47.60, max_lat=47.62, min_long=-122.35, max_long=-122.32),
+    "radius 1 km": dict(lat=47.6101, long=-122.3421, radius_km=1),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=None, help="resample the dataset to this many rows")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        use_service(f"sqlite:///{Path(tmp_dir) / 'houses.db'}")
+        import models
+        import schemas
+        from database import SessionLocal, engine
+        from search import house_filters
+        from sqlalchemy import insert
+
+        models.Base.metadata.create_all(bind=engine)
+        with SessionLocal() as session:
+            session.execute(insert(models.House), king_county_houses(args.rows))
+            session.commit()
+
+        def run(search):
+            with SessionLocal() as session:
+                return session.query(models.House).filter(*house_filters(search)).limit(100).all()
+
+        timings = {}
+        for indexed in (True, False):
+            if not indexed:
+                for index in models.House.__table__.indexes:
+                    index.drop(bind=engine)
+            for name, params in QUERIES.items():
+                search = schemas.HouseSearch(**params)
+                timings.setdefault(name, []).append(best_of(lambda: run(search), args.repeat))
+
+        print(f"{'query':<24}{'indexed':>12}{'no index':>12}")
+        for name, (indexed, plain) in timings.items():
+            print(f"{name:<24}{indexed * 1000:10.2f}ms{plain * 1000:10.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
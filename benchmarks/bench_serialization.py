@@ -0,0 +1,104 @@
+'''Requests per second and CPU time per response of the house read endpoints, with the default
+serialization (House instances validated by schemas.HouseModel, stdlib json) and with the fast
+path of serialization.py (HOUSES_FAST_JSON: row tuples encoded by orjson).
+
+Every mode runs in a fresh interpreter against the same temporary SQLite file loaded with the
+King County dataset, with the house cache disabled. The CPU time includes the in-process test
+client, which costs the same in both modes. The decoded responses of both modes are compared.
+
+    python benchmarks/bench_serialization.py --requests 200
+'''
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from common import king_county_houses, use_service, wait_for_warm_up  # isort: skip (puts data_pipeline on sys.path)
+
+MODES = ("default", "fast")
+
+
+def seed_database(db_conn):
+    use_service(db_conn)
+    import models
+    from database import SessionLocal, engine
+    from sqlalchemy import insert
+
+    models.Base.metadata.create_all(bind=engine)
+    with SessionLocal() as session:
+        session.execute(insert(models.House), king_county_houses())
+        session.commit()
+
+
+def digest(content: bytes) -> str:
+    # Both modes encode the same values, possibly with different separators
+    return hashlib.sha1(json.dumps(json.loads(content)).encode()).hexdigest()
+
+
+def run_mode(n_requests):
+    use_service()
+    import main
+    from fastapi.testclient import TestClient
+
+    rng = np.random.default_rng(42)
+    ids = rng.integers(1, 21_000, n_requests)
+    requests = {
+        "GET /houses?limit=1000": [f"/houses?limit=1000&after_id={house_id}" for house_id in ids],
+        "GET /houses?limit=100": [f"/houses?limit=100&after_id={house_id}" for house_id in ids],
+        "GET /houses/search": [f"/houses/search?zipcode={zipcode}&limit=100"
+                               for zipcode in rng.choice([98004, 98038, 98103, 98115], n_requests)],
+        "GET /houses/{house_id}": [f"/houses/{house_id}" for house_id in ids],
+    }
+    results = {}
+    with TestClient(main.app) as client:
+        wait_for_warm_up(client)
+        for name, urls in requests.items():
+            digests = set()
+            wall, cpu = time.perf_counter(), time.process_time()
+            for url in urls:
+                response = client.get(url)
+                response.raise_for_status()
+                if len(digests) < 3:
+                    digests.add(digest(response.content))
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            results[name] = dict(throughput=len(urls) / wall, cpu_ms=cpu / len(urls) * 1000, digests=sorted(digests))
+    print(json.dumps(results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        return run_mode(args.requests)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = dict(os.environ, DB_CONN=f"sqlite:///{Path(tmp_dir) / 'houses.db'}", HOUSE_CACHE_SIZE="0")
+        seed_database(env["DB_CONN"])
+        results = {}
+        for mode in MODES:
+            env["HOUSES_FAST_JSON"] = str(mode == "fast")
+            output = subprocess.run([sys.executable, __file__, "--mode", mode, "--requests", str(args.requests)],
+                                    env=env, check=True, capture_output=True, text=True).stdout
+            results[mode] = json.loads(output.splitlines()[-1])
+
+    print(f"{'endpoint':<26}{'default':>22}{'fast':>22}")
+    for name, default in results["default"].items():
+        fast = results["fast"][name]
+        print(f"{name:<26}{default['throughput']:9.1f} req/s {default['cpu_ms']:6.2f} ms"
+              f"{fast['throughput']:9.1f} req/s {fast['cpu_ms']:6.2f} ms")
+        if default["digests"] != fast["digests"]:
+            print(f"{name}: the responses of both modes differ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+'''Cold start of the service: time to import main.py, to the first response, to ready (/ready
+returns 200) and to the end of the background warm-up, and the heavy modules loaded by the import.
+
+Every run is a fresh interpreter against a temporary SQLite file loaded with the King County
+dataset. The import and ready times are checked against the "startup" budget of thresholds.json,
+and the import must not load any of its lazy_modules:
+
+    python benchmarks/bench_startup.py --repeat 3
+
+The exit status is 1 when the budget is not met.
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+THRESHOLDS_FILE = Path(__file__).with_name("thresholds.json")
+HEAVY_MODULES = ("pandas", "sklearn", "scipy", "numpy")
+POLL_SECONDS = 0.005
+
+
+def seed_database(db_conn):
+    # common imports pandas, the measured interpreters must not import it
+    from common import king_county_houses, use_service
+
+    use_service(db_conn)
+    import models
+    from database import SessionLocal
+    from migrate import create_schema
+    from sqlalchemy import insert
+
+    create_schema()
+    with SessionLocal() as session:
+        session.execute(insert(models.House), king_county_houses())
+        session.commit()
+
+
+def wait_for(client, finished, timeout=60):
+    while True:
+        response = client.get("/ready")
+        if finished(response):
+            return response
+        if timeout < 0:
+            raise RuntimeError(f"Still warming up: {response.text}")
+        time.sleep(POLL_SECONDS)
+        timeout -= POLL_SECONDS
+
+
+def run_once():
+    start = time.perf_counter()
+    import main
+    import_seconds = time.perf_counter() - start
+    heavy_modules = [module for module in HEAVY_MODULES if module in sys.modules]
+    from fastapi.testclient import TestClient
+
+    with TestClient(main.app) as client:
+        wait_for(client, lambda response: True)
+        first_response_seconds = time.perf_counter() - start
+        wait_for(client, lambda response: response.status_code == 200)
+        ready_seconds = time.perf_counter() - start
+        report = wait_for(client, lambda response: all(
+            step["state"] not in ("pending", "running") for step in response.json()["steps"])).json()
+        warm_seconds = time.perf_counter() - start
+    print(json.dumps(dict(import_seconds=import_seconds, first_response_seconds=first_response_seconds,
+                          ready_seconds=ready_seconds, warm_seconds=warm_seconds, heavy_modules=heavy_modules,
+                          steps=report["steps"])))
+
+
+def check_budget(results, budget):
+    '''check_budget returns the failures of the fastest runs to meet the startup budget'''
+    failures = []
+    import_seconds = min(result["import_seconds"] for result in results)
+    ready_seconds = min(result["ready_seconds"] for result in results)
+    if "max_import_seconds" in budget and import_seconds > budget["max_import_seconds"]:
+        failures.append(f"import {import_seconds:.3f} s above {budget['max_import_seconds']} s")
+    if "max_ready_seconds" in budget and ready_seconds > budget["max_ready_seconds"]:
+        failures.append(f"ready {ready_seconds:.3f} s above {budget['max_ready_seconds']} s")
+    loaded = sorted({module for result in results for module in result["heavy_modules"]}
+                    & set(budget.get("lazy_modules", [])))
+    if loaded:
+        failures.append(f"importing main loads {', '.join(loaded)}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--model-path", help="artifact loaded by the warm-up, none by default")
+    parser.add_argument("--run", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        return run_once()
+
+    root = Path(__file__).resolve().parents[1]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = dict(os.environ, DB_CONN=f"sqlite:///{Path(tmp_dir) / 'houses.db'}",
+                   MODEL_PATH=args.model_path or str(Path(tmp_dir) / "missing-artifact"),
+                   PYTHONPATH=os.pathsep.join([str(root / "service"), str(root / "data_pipeline")]))
+        seed_database(env["DB_CONN"])
+        results = []
+        for _ in range(args.repeat):
+            output = subprocess.run([sys.executable, __file__, "--run"], env=env, check=True, capture_output=True,
+                                    text=True).stdout
+            results.append(json.loads(output.splitlines()[-1]))
+
+    for name in ("import_seconds", "first_response_seconds", "ready_seconds", "warm_seconds"):
+        print(f"{name:<24}{min(result[name] for result in results) * 1000:9.1f} ms")
+    print(f"{'loaded by the import':<24}{', '.join(results[0]['heavy_modules']) or '-'}")
+    for step in results[-1]["steps"]:
+        print(f"  {step['name']:<20}{step['state']:<13}{(step['seconds'] or 0) * 1000:9.1f} ms")
+
+    failures = check_budget(results, json.loads(THRESHOLDS_FILE.read_text()).get("startup", {}))
+    for failure in failures:
+        print(f"FAILED {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import os
+import resource
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+RAW_DATASET = ROOT / "data" / "King_County_House_prices_dataset.csv"
+
+# The data pipeline modules are imported flat, like in the tests (see pytest.ini)
+sys.path.insert(0, str(ROOT / "data_pipeline"))
+
+
+def load_king_county(rows=None, seed=42) -> pd.DataFrame:
+    '''load_king_county loads the King County dataset, resampled with replacement to "rows" rows
+    (with slightly jittered coordinates) when a larger benchmark dataset is needed'''
+    df_dataset = pd.read_csv(RAW_DATASET)
+    if rows is None:
+        return df_dataset
+    rng = np.random.default_rng(seed)
+    df_dataset = df_dataset.iloc[rng.integers(0, len(df_dataset), rows)].reset_index(drop=True)
+    df_dataset['lat'] += rng.normal(0, 5e-3, rows)
+    df_dataset['long'] += rng.normal(0, 5e-3, rows)
+    return df_dataset
+
+
+def use_service(db_conn="sqlite://"):
+    '''use_service makes the service modules importable, connected to db_conn (by default an
+    in-memory SQLite database) unless DB_CONN is already set'''
+    os.environ.setdefault("DB_CONN", db_conn)
+    sys.path.insert(0, str(ROOT / "service"))
+
+
+def wait_for_warm_up(client, timeout=300):
+    '''wait_for_warm_up waits until the background warm-up of the service (see /ready) is over, so
+    that it does not compete with the requests that are measured'''
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        steps = client.get("/ready").json()["steps"]
+        if all(step["state"] not in ("pending", "running") for step in steps):
+            return steps
+        time.sleep(0.01)
+    raise RuntimeError("The warm-up of the service did not finish")
+
+
+def synthetic_king_county(rows, seed=42, chunk_size=1_000_000):
+    '''synthetic_king_county yields a King County shaped dataset of "rows" rows in chunks of up to
+    chunk_size rows: houses resampled from the dataset with unique ids, jittered coordinates and
+    prices, so that datasets far larger than the original (10M rows) can be generated and written
+    without holding them in memory'''
+    df_source = pd.read_csv(RAW_DATASET)
+    rng = np.random.default_rng(seed)
+    for start in range(0, rows, chunk_size):
+        size = min(chunk_size, rows - start)
+        df_chunk = df_source.iloc[rng.integers(0, len(df_source), size)].reset_index(drop=True)
+        df_chunk['id'] = np.arange(start + 1, start + size + 1)
+        df_chunk['lat'] += rng.normal(0, 5e-3, size)
+        df_chunk['long'] += rng.normal(0, 5e-3, size)
+        df_chunk['price'] = (df_chunk['price'] * rng.lognormal(0, 0.05, size)).round()
+        yield df_chunk
+
+
+def write_synthetic_csv(file_path, rows, seed=42):
+    '''write_synthetic_csv writes synthetic_king_county(rows) as a CSV file like the raw dataset'''
+    for i, df_chunk in enumerate(synthetic_king_county(rows, seed)):
+        df_chunk.to_csv(file_path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+    return file_path
+
+
+def king_county_houses(rows=None):
+    '''king_county_houses returns the King County dataset as records that validate against
+    schemas.HouseModel (ids made unique, the '?' placeholders and missing values filled)'''
+    return house_records(load_king_county(rows))
+
+
+def house_records(df_dataset, first_id=1):
+    '''house_records returns the houses of df_dataset as records that validate against schemas.HouseModel'''
+    df_dataset = df_dataset.copy()
+    df_dataset['id'] = np.arange(first_id, first_id + len(df_dataset))
+    df_dataset['bedrooms'] = df_dataset['bedrooms'].clip(upper=32)
+    df_dataset['sqft_basement'] = df_dataset['sqft_living'] - df_dataset['sqft_above']
+    df_dataset[['view', 'yr_renovated']] = df_dataset[['view', 'yr_renovated']].fillna(0)
+    df_dataset['waterfront'] = df_dataset['waterfront'].astype(object).where(df_dataset['waterfront'].notna(), None)
+    return df_dataset.to_dict(orient="records")
+
+
+def best_of(func, repeat=3):
+    '''best_of returns the fastest wall time in seconds of "repeat" calls of func'''
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def _proc_status(field):
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(field):
+                return int(line.split()[1]) * 1024
+
+
+def current_rss():
+    '''current_rss returns the resident set size of this process in bytes (Linux only)'''
+    return _proc_status("VmRSS:")
+
+
+def reset_peak_rss():
+    '''reset_peak_rss resets the peak resident set size of this process (Linux only), so that
+    peak_rss measures the code that runs afterwards'''
+    with open("/proc/self/clear_refs", "w") as clear_refs:
+        clear_refs.write("5")
+
+
+def peak_rss():
+    '''peak_rss returns the peak resident set size of this process in bytes'''
+    try:
+        return _proc_status("VmHWM:")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
@@ -0,0 +1,103 @@
+'''Latency and throughput of the database endpoints in the sync and async (DB_ASYNC) modes.
+
+The requests mix single house lookups and zipcode searches. Every mode runs in a fresh
+interpreter against the same database: DB_CONN if set (e.g. the docker-compose Postgres),
+otherwise a temporary SQLite file loaded with the King County dataset.
+
+    python benchmarks/load_test_db.py --clients 1 50 500 --requests 5000
+'''
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from common import king_county_houses, use_service  # isort: skip (puts data_pipeline on sys.path)
+
+MODES = ("sync", "async")
+
+
+def seed_database(db_conn):
+    use_service(db_conn)
+    import models
+    from database import SessionLocal, engine
+    from sqlalchemy import insert
+
+    models.Base.metadata.create_all(bind=engine)
+    with SessionLocal() as session:
+        session.execute(insert(models.House), king_county_houses())
+        session.commit()
+
+
+async def run_clients(client, paths, clients, total_requests):
+    latencies = []
+
+    async def run_client(client_id):
+        for i in range(client_id, total_requests, clients):
+            start = time.perf_counter()
+            response = await client.get(paths[i % len(paths)])
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(client_id) for client_id in range(clients)))
+    return np.array(latencies), time.perf_counter() - start
+
+
+async def run_mode(clients_list, total_requests):
+    import httpx
+    use_service()
+    import main
+    from database import SessionLocal
+    from models import House
+
+    with SessionLocal() as session:
+        rows = session.query(House.id, House.zipcode).all()
+    rng = np.random.default_rng(42)
+    paths = [f"/houses/{rows[i].id}" if i % 2 else f"/houses/search?zipcode={rows[i].zipcode}&limit=20"
+             for i in rng.integers(len(rows), size=1000)]
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+        for clients in clients_list:
+            latencies, seconds = await run_clients(client, paths, clients, total_requests)
+            print(json.dumps(dict(clients=clients, p50=np.percentile(latencies, 50),
+                                  p99=np.percentile(latencies, 99), throughput=total_requests / seconds)))
+    await main.dispose_async_engine()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 50, 500])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        return asyncio.run(run_mode(args.clients, args.requests))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = dict(os.environ)
+        if "DB_CONN" not in env:
+            env["DB_CONN"] = f"sqlite:///{Path(tmp_dir) / 'houses.db'}"
+            seed_database(env["DB_CONN"])
+        for mode in MODES:
+            env["DB_ASYNC"] = str(mode == "async")
+            output = subprocess.run(
+                [sys.executable, __file__, "--mode", mode, "--requests", str(args.requests),
+                 "--clients", *map(str, args.clients)], env=env, check=True, capture_output=True, text=True).stdout
+            for line in output.splitlines():
+                result = json.loads(line)
+                print(f"{mode:<6} clients={result['clients']:<4} "
+                      f"p50 {result['p50'] * 1000:7.2f} ms  p99 {result['p99'] * 1000:7.2f} ms  "
+                      f"{result['throughput']:8.1f} req/s")
+
+
+if __name__ == "__main__":
+    main()
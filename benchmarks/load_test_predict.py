@@ -0,0 +1,80 @@
+'''Latency and throughput of the /predict endpoints under concurrent load.
+
+The service runs in-process against an in-memory SQLite database and a model artifact fitted
+on the King County dataset. Single predictions are measured with and without micro-batching.
+
+    python benchmarks/load_test_predict.py --clients 1 16 64 --requests 2000
+'''
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from common import RAW_DATASET, ROOT, use_service  # isort: skip (puts data_pipeline on sys.path)
+from artifact import save_artifact
+from preprocessing import DROP_COLUMNS, PreprocessingSeattleHousing, load_data
+from sklearn.linear_model import LinearRegression
+
+
+def build_artifact(path):
+    preprocessor = PreprocessingSeattleHousing()
+    dataset = preprocessor.preprocess_fit_transform(load_data(RAW_DATASET))
+    features = [x for x in dataset.columns if x not in DROP_COLUMNS + ['id']]
+    model = LinearRegression().fit(dataset[features], dataset['price'])
+    return save_artifact(path, preprocessor, model, features)
+
+
+def load_service(model_path):
+    os.environ["MODEL_PATH"] = str(model_path)
+    use_service()
+    import main
+    return main
+
+
+async def run_clients(client, payloads, clients, total_requests):
+    latencies = []
+
+    async def run_client(client_id):
+        for i in range(client_id, total_requests, clients):
+            start = time.perf_counter()
+            response = await client.post("/predict", json=payloads[i % len(payloads)])
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(client_id) for client_id in range(clients)))
+    return np.array(latencies), time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args()
+
+    import httpx
+
+    with open(ROOT / "data" / "houses.json") as f_in:
+        payloads = json.load(f_in)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        service = load_service(build_artifact(tmp_dir))
+        transport = httpx.ASGITransport(app=service.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            for max_batch_size in (1, service.predict_batcher.max_batch_size):
+                service.predict_batcher.max_batch_size = max_batch_size
+                for clients in args.clients:
+                    latencies, seconds = await run_clients(client, payloads, clients, args.requests)
+                    print(f"max_batch_size={max_batch_size:<3} clients={clients:<4} "
+                          f"p50 {np.percentile(latencies, 50) * 1000:7.2f} ms  "
+                          f"p99 {np.percentile(latencies, 99) * 1000:7.2f} ms  "
+                          f"{args.requests / seconds:8.1f} req/s")
+            await service.predict_batcher.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
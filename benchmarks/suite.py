@@ -0,0 +1,287 @@
+'''Benchmark suite of the data pipeline and the service on synthetic King County shaped datasets.
+
+For every size, a synthetic CSV file is generated (common.synthetic_king_county), then in fresh
+interpreters:
+- pipeline:  load_data, PreprocessingSeattleHousing fit_transform and transform (time, rows/s,
+             peak RSS growth), and every named step on its own (profiling.StepProfiler)
+- endpoints: the main.py endpoints on a local SQLite database filled with up to --max-db-rows of
+             the houses through POST /houses (requests/s, p50/p95 latency)
+
+The results are written as JSON. They are checked against the throughput and peak memory
+thresholds of thresholds.json and, with --baseline, against the results of an earlier commit:
+
+    python benchmarks/suite.py --sizes 10k,100k,1M --output benchmarks/results/$(git rev-parse --short HEAD).json
+    python benchmarks/suite.py --sizes 10k,100k --baseline benchmarks/results/<commit>.json
+
+The exit status is 1 when a threshold is not met or a benchmark regressed.
+'''
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from common import (ROOT, current_rss, house_records, peak_rss,  # isort: skip (puts data_pipeline on sys.path)
+                    reset_peak_rss, synthetic_king_county, use_service, wait_for_warm_up,
+                    write_synthetic_csv)
+
+SIZES = "10k,100k"
+THRESHOLDS_FILE = Path(__file__).with_name("thresholds.json")
+# Larger datasets are only used for the pipeline, the endpoints are measured on this many houses
+MAX_DB_ROWS = 100_000
+REQUESTS = 200
+# Benchmarks shorter than this are too noisy to be compared with a baseline
+MIN_COMPARED_SECONDS = 0.05
+# Peak RSS changes below this are noise of the allocator
+MIN_COMPARED_PEAK_RSS = 16 * 2 ** 20
+
+
+def parse_size(size: str) -> int:
+    '''parse_size parses row counts like 10k, 1M or 2500'''
+    multipliers = {'k': 1_000, 'm': 1_000_000}
+    size = size.strip().lower()
+    if size[-1] in multipliers:
+        return int(float(size[:-1]) * multipliers[size[-1]])
+    return int(size)
+
+
+def measure(func):
+    '''measure returns the result, wall time and peak RSS growth of calling func'''
+    gc.collect()
+    baseline = current_rss()
+    reset_peak_rss()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    return result, seconds, peak_rss() - baseline
+
+
+def result(benchmark, size, rows, seconds, peak=None, **extra):
+    # size is the dataset size the benchmark ran at, rows the rows it processed
+    return dict(benchmark=benchmark, size=size, seconds=seconds, throughput=rows / seconds if seconds > 0 else None,
+                unit='rows/s', peak_rss=peak, **extra)
+
+
+def pipeline_benchmarks(file_path, rows):
+    from preprocessing import PreprocessingSeattleHousing, load_data
+    from profiling import StepProfiler
+
+    df_dataset, seconds, peak = measure(lambda: load_data(file_path))
+    results = [result('load_data', rows, rows, seconds, peak)]
+    preprocessor = PreprocessingSeattleHousing()
+    _, seconds, peak = measure(lambda: preprocessor.preprocess_fit_transform(df_dataset))
+    results.append(result('preprocess_fit_transform', rows, rows, seconds, peak))
+    _, seconds, peak = measure(lambda: preprocessor.preprocess_transform(df_dataset))
+    results.append(result('preprocess_transform', rows, rows, seconds, peak))
+
+    profiler = StepProfiler()
+    PreprocessingSeattleHousing().preprocess_fit_transform(df_dataset, profiler=profiler)
+    preprocessor.preprocess_transform(df_dataset, profiler=profiler)
+    for stats in profiler.report():
+        results.append(result(f"step/{stats['step']}/{stats['phase']}", rows, stats['rows'], stats['seconds'],
+                              memory_delta=stats['memory_delta']))
+    return results
+
+
+def fit_artifact(path, rows=10_000):
+    # A model to score with, fitted on the first synthetic houses
+    from artifact import save_artifact
+    from preprocessing import PreprocessingSeattleHousing
+    from train import feature_columns, model_pipeline
+
+    preprocessor = PreprocessingSeattleHousing()
+    dataset = preprocessor.preprocess_fit_transform(next(synthetic_king_county(rows, chunk_size=rows)))
+    features = feature_columns(dataset)
+    model = model_pipeline(2, alpha=0.5, l1_ratio=0.5).fit(dataset[features], dataset['price'])
+    return save_artifact(path, preprocessor, model, features)
+
+
+def latencies(client, requests):
+    '''latencies sends every (method, url, payload) of requests and returns their latencies in seconds'''
+    timings = []
+    for method, url, payload in requests:
+        start = time.perf_counter()
+        response = client.request(method, url, json=payload)
+        timings.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {url}: {response.status_code} {response.text[:200]}")
+    return np.array(timings)
+
+
+def endpoint_result(benchmark, size, timings, houses_per_request=None):
+    # The throughput of endpoints taking many houses per request is in houses per second
+    seconds = float(timings.sum())
+    items = len(timings) * (houses_per_request or 1)
+    return dict(benchmark=benchmark, size=size, seconds=seconds, throughput=items / seconds,
+                unit='houses/s' if houses_per_request else 'requests/s', peak_rss=None, requests=len(timings),
+                p50_ms=float(np.percentile(timings, 50) * 1000), p95_ms=float(np.percentile(timings, 95) * 1000))
+
+
+def endpoint_benchmarks(tmp_dir, rows, n_requests, batch_size=5000):
+    # Always a fresh local SQLite database, whatever DB_CONN is set to
+    os.environ["DB_CONN"] = f"sqlite:///{Path(tmp_dir) / 'houses.db'}"
+    os.environ["MODEL_PATH"] = str(fit_artifact(Path(tmp_dir) / "artifact"))
+    use_service()
+    import main
+    import models
+    from database import engine
+    from fastapi.testclient import TestClient
+
+    models.Base.metadata.create_all(bind=engine)
+    rng = np.random.default_rng(42)
+    with TestClient(main.app) as client:
+        wait_for_warm_up(client)
+        timings = []
+        for df_chunk in synthetic_king_county(rows, chunk_size=batch_size):
+            houses = house_records(df_chunk, first_id=int(df_chunk['id'].iloc[0]))
+            timings.append(latencies(client, [("POST", "/houses", houses)])[0])
+        results = [endpoint_result('endpoint/POST /houses', rows, np.array(timings), rows / len(timings))]
+
+        houses = house_records(next(synthetic_king_county(100, seed=7, chunk_size=100)))
+        ids = rng.integers(1, rows + 1, n_requests)
+        update = {key: value for key, value in houses[0].items() if key != 'id'}
+        requests = {
+            'GET /houses/{house_id}': [("GET", f"/houses/{house_id}", None) for house_id in ids],
+            'GET /houses/{house_id}/features': [("GET", f"/houses/{house_id}/features", None) for house_id in ids],
+            'GET /houses': [("GET", f"/houses?limit=100&after_id={house_id}", None) for house_id in ids],
+            'GET /houses/search': [("GET", f"/houses/search?zipcode=98004&min_price={price}", None)
+                                   for price in rng.integers(100_000, 2_000_000, n_requests)],
+            'GET /houses/{house_id}/comps': [("GET", f"/houses/{house_id}/comps?k=20", None) for house_id in ids],
+            'POST /houses/comps': [("POST", "/houses/comps?k=20", house)
+                                   for house in houses * (n_requests // len(houses) + 1)][:n_requests],
+            'GET /stats/zipcodes': [("GET", "/stats/zipcodes", None)] * max(n_requests // 20, 1),
+            'GET /stats/zipcodes/{zipcode}': [("GET", f"/stats/zipcodes/{zipcode}", None)
+                                              for zipcode in rng.choice([98004, 98038, 98103, 98115], n_requests)],
+            'PUT /houses/{house_id}': [("PUT", f"/houses/{house_id}", update) for house_id in ids[:n_requests // 4]],
+            'POST /predict': [("POST", "/predict", house) for house in houses * (n_requests // len(houses) + 1)][
+                :n_requests],
+            'POST /predict/batch': [("POST", "/predict/batch", houses)] * max(n_requests // 20, 1),
+        }
+        for name, endpoint_requests in requests.items():
+            houses_per_request = len(houses) if name == 'POST /predict/batch' else None
+            results.append(endpoint_result(f"endpoint/{name}", rows, latencies(client, endpoint_requests),
+                                           houses_per_request))
+    return results
+
+
+def run(kind, rows, file_path, n_requests):
+    '''run runs the benchmarks of one kind and size in a fresh interpreter, so that the peak RSS
+    of one benchmark does not hide the next'''
+    output = subprocess.run([sys.executable, __file__, "--run", kind, "--data", str(file_path), "--rows", str(rows),
+                             "--requests", str(n_requests)], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def check_thresholds(results, thresholds):
+    '''check_thresholds returns the results below the minimum throughput or above the maximum peak
+    RSS per row of their benchmark in thresholds'''
+    failures = []
+    for item in results:
+        limits = thresholds.get('benchmarks', {}).get(item['benchmark'], {})
+        name = f"{item['benchmark']} ({item['size']} rows)"
+        if 'min_throughput' in limits and item['throughput'] < limits['min_throughput']:
+            failures.append(f"{name}: throughput {item['throughput']:,.0f} {item['unit']} "
+                            f"below {limits['min_throughput']:,.0f}")
+        peak = item['peak_rss']
+        if 'max_peak_rss_per_row' in limits and peak is not None and peak > MIN_COMPARED_PEAK_RSS \
+                and peak > limits['max_peak_rss_per_row'] * item['size']:
+            failures.append(f"{name}: peak RSS {peak / item['size']:,.0f} B/row "
+                            f"above {limits['max_peak_rss_per_row']:,.0f} B/row")
+    return failures
+
+
+def compare(results, baseline, thresholds):
+    '''compare returns the results that regressed against the results of baseline by more than
+    the relative tolerances of thresholds'''
+    tolerance = thresholds.get('regression', {})
+    previous = {(item['benchmark'], item['size']): item for item in baseline['results']}
+    regressions = []
+    for item in results:
+        before = previous.get((item['benchmark'], item['size']))
+        if before is None:
+            continue
+        name = f"{item['benchmark']} ({item['size']} rows)"
+        if min(before['seconds'], item['seconds']) >= MIN_COMPARED_SECONDS \
+                and item['throughput'] < before['throughput'] * (1 - tolerance.get('throughput', 0.2)):
+            regressions.append(f"{name}: throughput {before['throughput']:,.0f} -> {item['throughput']:,.0f} "
+                               f"{item['unit']}")
+        peak, peak_before = item['peak_rss'], before['peak_rss']
+        if peak is not None and peak_before is not None and peak - peak_before > MIN_COMPARED_PEAK_RSS \
+                and peak > peak_before * (1 + tolerance.get('peak_rss', 0.2)):
+            regressions.append(f"{name}: peak RSS {peak_before / 2 ** 20:,.1f} MiB -> {peak / 2 ** 20:,.1f} MiB")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, check=True, capture_output=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    print(f"{'benchmark':<44}{'size':>10}{'seconds':>10}{'throughput':>26}{'peak RSS':>13}{'p95':>10}")
+    for item in results:
+        peak = f"{item['peak_rss'] / 2 ** 20:.1f} MiB" if item['peak_rss'] is not None else ""
+        p95 = f"{item['p95_ms']:.2f}ms" if 'p95_ms' in item else ""
+        print(f"{item['benchmark']:<44}{item['size']:>10}{item['seconds']:>10.3f}"
+              f"{item['throughput']:>15,.0f} {item['unit']:<10}{peak:>13}{p95:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=SIZES, help="comma separated dataset sizes, e.g. 10k,100k,1M,10M")
+    parser.add_argument("--max-db-rows", type=int, default=MAX_DB_ROWS, help="houses in the endpoint database")
+    parser.add_argument("--requests", type=int, default=REQUESTS, help="requests per endpoint")
+    parser.add_argument("--no-endpoints", action="store_true")
+    parser.add_argument("--output", help="JSON file the results are written to")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--thresholds", default=THRESHOLDS_FILE)
+    parser.add_argument("--run", choices=("pipeline", "endpoints"), help=argparse.SUPPRESS)
+    parser.add_argument("--data", help=argparse.SUPPRESS)
+    parser.add_argument("--rows", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run == "pipeline":
+        return print(json.dumps(pipeline_benchmarks(args.data, args.rows)))
+    if args.run == "endpoints":
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            return print(json.dumps(endpoint_benchmarks(tmp_dir, args.rows, args.requests)))
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for rows in map(parse_size, args.sizes.split(",")):
+            file_path = write_synthetic_csv(Path(tmp_dir) / f"houses-{rows}.csv", rows)
+            results += run("pipeline", rows, file_path, args.requests)
+            file_path.unlink()
+            if not args.no_endpoints and rows <= args.max_db_rows:
+                results += run("endpoints", rows, file_path, args.requests)
+    print_results(results)
+
+    report = dict(commit=git_commit(), created=time.strftime("%Y-%m-%dT%H:%M:%S%z"), python=platform.python_version(),
+                  platform=platform.platform(), cpu_count=os.cpu_count(), results=results)
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w") as f_out:
+            json.dump(report, f_out, indent=2)
+
+    with open(args.thresholds) as f_in:
+        thresholds = json.load(f_in)
+    failures = check_thresholds(results, thresholds)
+    if args.baseline:
+        with open(args.baseline) as f_in:
+            failures += compare(results, json.load(f_in), thresholds)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import json
+import time
+from pathlib import Path
+
+import joblib
+import pandas as pd
+import sklearn
+
+# Persisted, versioned artifact of a fitted PreprocessingSeattleHousing and the model trained on its output
+
+ARTIFACT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+PIPELINE_FILE = "pipeline.joblib"
+
+
+class HousePriceArtifact:
+    '''HousePriceArtifact bundles the fitted preprocessing pipeline, the model and the features
+    the model was trained on'''
+
+    def __init__(self, preprocessor, model, features, manifest=None):
+        self.preprocessor = preprocessor
+        self.model = model
+        self.features = list(features)
+        self.manifest = manifest or {}
+
+    def predict(self, df: pd.DataFrame, profiler=None):
+        # profiler (profiling.StepProfiler) measures the preprocessing steps and the model
+        if profiler is None:
+            dataset = self.preprocessor.preprocess_transform(df)
+            return self.model.predict(dataset[self.features])
+        dataset = self.preprocessor.preprocess_transform(df, profiler=profiler)
+        with profiler.step('model', 'predict', len(dataset)):
+            return self.model.predict(dataset[self.features])
+
+
+def save_artifact(path, preprocessor, model, features) -> Path:
+    '''save_artifact writes the fitted preprocessor and model to the directory at path. Arrays are
+    stored uncompressed, so that load_artifact can memory-map them'''
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    joblib.dump({"preprocessor": preprocessor, "model": model}, path / PIPELINE_FILE)
+
+    manifest = {
+        "version": ARTIFACT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "sklearn_version": sklearn.__version__,
+        "model": type(model).__name__,
+        "input_columns": list(preprocessor.input_columns_),
+        "features": list(features),
+    }
+    with open(path / MANIFEST_FILE, "w") as f_out:
+        json.dump(manifest, f_out, indent=2)
+    return path
+
+
+def validate_schema(input_columns, schema, ignore=("id",)):
+    '''validate_schema checks that the fields of a pydantic schema (for example the service's
+    schemas.BaseHouseModel) are exactly the raw columns the pipeline was fitted on'''
+    fields = getattr(schema, "model_fields", None) or schema.__fields__
+    expected = set(input_columns) - set(ignore)
+    missing = sorted(expected - set(fields))
+    unexpected = sorted(set(fields) - expected)
+    if missing or unexpected:
+        raise ValueError(f"Schema {schema.__name__} does not match the fitted pipeline: "
+                         f"missing {missing}, unexpected {unexpected}")
+
+
+def load_artifact(path, schema=None, mmap_mode="r") -> HousePriceArtifact:
+    '''load_artifact loads an artifact written by save_artifact. The reference arrays are
+    memory-mapped (mmap_mode="r"), so loading is fast and worker processes share their pages'''
+    path = Path(path)
+    with open(path / MANIFEST_FILE) as f_in:
+        manifest = json.load(f_in)
+    if manifest.get("version") != ARTIFACT_VERSION:
+        raise ValueError(f"Unsupported artifact version {manifest.get('version')}, "
+                         f"expected {ARTIFACT_VERSION}")
+    if schema is not None:
+        validate_schema(manifest["input_columns"], schema)
+
+    objects = joblib.load(path / PIPELINE_FILE, mmap_mode=mmap_mode)
+    return HousePriceArtifact(objects["preprocessor"], objects["model"], manifest["features"], manifest)
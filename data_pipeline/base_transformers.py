@@ -0,0 +1,23 @@
+import pandas as pd
+from sklearn.base import BaseEstimator, TransformerMixin
+
+# Base class of the data cleaning and feature engineering transformers
+
+
+class FrameTransformer(BaseEstimator, TransformerMixin):
+    '''FrameTransformer defines the copy contract of the transformers. With copy=True (the default)
+    transform never modifies the caller's DataFrame: it works on a shallow copy of X, so only the
+    columns the transformer writes are allocated. With copy=False X is modified in place.'''
+
+    def __init__(self, copy: bool = True):
+        self.copy = copy
+
+    def fit(self, X, y=None):
+        return self
+
+    def __sklearn_is_fitted__(self):
+        # Transformers without learned state can transform without being fitted
+        return True
+
+    def _frame(self, X: pd.DataFrame) -> pd.DataFrame:
+        return X.copy(deep=False) if self.copy else X
@@ -1,70 +1,68 @@
 import numpy as np
 import pandas as pd
-from sklearn.base import BaseEstimator, TransformerMixin
+from base_transformers import FrameTransformer
 
-# Data cleaning transformers
+# Columnar helpers shared by the data cleaning transformers
 
 
-class SqftColumnTransformer(BaseEstimator, TransformerMixin):
-    def fit(self, X, y=None):
-        return self
+def fill_missing(X: pd.DataFrame, column: str, value) -> pd.DataFrame:
+    '''fill_missing replaces the missing values of a single column with value. The column is only
+    rewritten when it actually contains missing values, so clean columns are never copied'''
+    if X[column].hasnans:
+        X[column] = X[column].fillna(value)
+    return X
 
-    def transform(self, X: pd.DataFrame, y=None) -> pd.DataFrame:
-        X['sqft_basement'] = X['sqft_basement'].replace('?', np.NaN)
-        # And we change the dtype of the column "sqft_basement" to float
-        X['sqft_basement'] = X['sqft_basement'].astype(float)
-        X.eval('sqft_basement = sqft_living - sqft_above', inplace=True)
-        return X
 
+def column_where(condition: np.ndarray, X: pd.DataFrame, column: str, other: np.ndarray) -> np.ndarray:
+    '''column_where takes the values of column where condition holds and other elsewhere,
+    keeping the integer dtype of column when other can be represented in it'''
+    values = X[column].to_numpy()
+    result = np.where(condition, values, other)
+    if np.issubdtype(values.dtype, np.integer):
+        result = result.astype(np.result_type(values.dtype, np.int64))
+    return result
+
+# Data cleaning transformers
 
-class ViewColumnTransformer(BaseEstimator, TransformerMixin):
-    def fit(self, X, y=None):
-        return self
 
+class SqftColumnTransformer(FrameTransformer):
     def transform(self, X: pd.DataFrame, y=None) -> pd.DataFrame:
-        # We replace Nan values in "view" with the most frequent expression (0)
-        X['view'].fillna(0, inplace=True)
+        X = self._frame(X)
+        # "sqft_basement" (including its '?' placeholders) is fully determined by the living and above areas
+        X['sqft_basement'] = X['sqft_living'] - X['sqft_above']
         return X
 
 
-class WaterFrontColumnTransformer(BaseEstimator, TransformerMixin):
-    def fit(self, X, y=None):
-        return self
+class ViewColumnTransformer(FrameTransformer):
+    def transform(self, X: pd.DataFrame, y=None) -> pd.DataFrame:
+        X = self._frame(X)
+        # We replace Nan values in "view" with the most frequent expression (0)
+        return fill_missing(X, 'view', 0)
+
 
+class WaterFrontColumnTransformer(FrameTransformer):
     def transform(self, X: pd.DataFrame, y=None) -> pd.DataFrame:
+        X = self._frame(X)
         # We replace Nan values in "waterfront" with the most frequent expression (0)
-        X.waterfront.fillna(0, inplace=True)
-        return X
-
+        return fill_missing(X, 'waterfront', 0)
 
-class LastKnownChangeColumnTransformer(BaseEstimator, TransformerMixin):
-    def fit(self, X, y=None):
-        return self
 
+class LastKnownChangeColumnTransformer(FrameTransformer):
     def transform(self, X: pd.DataFrame, y=None) -> pd.DataFrame:
-        # We will create an empty list in which we will store values
-        last_known_change = []
-
-        # For each row in our data frame, we look at what is in the column "yr_renovated".
-        for idx, yr_re in X.yr_renovated.items():
-            # if "yr_renovated" is 0 or contains no value, we store the year of construction of the house in our empty listes ab
-            if str(yr_re) == 'nan' or yr_re == 0.0:
-                last_known_change.append(X.yr_built[idx])
-            # if there is a value other than 0 in the column "yr_renovated", we transfer this value into our new list
-            else:
-                last_known_change.append(int(yr_re))
-        # We create a new column and take over the values of our previously created list
-        X['last_known_change'] = last_known_change
+        X = self._frame(X)
+        yr_renovated = X['yr_renovated'].to_numpy(dtype=np.float64)
+        # if "yr_renovated" is 0 or contains no value, we take the year of construction of the house,
+        # otherwise the (truncated) year of renovation
+        never_renovated = np.isnan(yr_renovated) | (yr_renovated == 0.0)
+        X['last_known_change'] = column_where(
+            never_renovated, X, 'yr_built', np.trunc(yr_renovated))
 
         return X
 
 
-class DropExtraneousColumnsTransformer(BaseEstimator, TransformerMixin):
-    def fit(self, X, y=None):
-        return self
-
+class DropExtraneousColumnsTransformer(FrameTransformer):
     def transform(self, X: pd.DataFrame, y=None) -> pd.DataFrame:
+        X = self._frame(X)
         # We delete the "yr_renovated" and "yr_built" columns
-        X.drop("yr_renovated", axis=1, inplace=True)
-        X.drop("yr_built", axis=1, inplace=True)
+        X.drop(["yr_renovated", "yr_built"], axis=1, inplace=True)
         return X
@@ -1,46 +1,320 @@
 import numpy as np
 import pandas as pd
-from sklearn.base import BaseEstimator, TransformerMixin
+from base_transformers import FrameTransformer
+from scipy.spatial import cKDTree
+from sklearn.base import clone
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.utils.validation import check_is_fitted
 
 # Feature engineering transformers
 
+# Length in km of one degree of latitude, 2 * pi * WaterDistanceColumnTransformer.NORMALISE_EARTH_CIRCUM
+KM_PER_DEGREE: np.float64 = 2 * np.pi * (6378/360)
+_FIXED_LONGITUDE_SCALE: np.float64 = np.cos(np.radians(47.6219))
 
-class SqFtPriceColumnTransformer(BaseEstimator, TransformerMixin):
-    def fit(self, X, y=None):
-        return self
 
+class SqFtPriceColumnTransformer(FrameTransformer):
     def transform(self, X, y=None) -> pd.DataFrame:
+        X = self._frame(X)
         # We create a new variable that gives us the price per square foot of living space
         X['sqft_price'] = (X.price/(X.sqft_living + X.sqft_lot)).round(2)
         return X
 
 
-class CentreOfWealthColumnsTransformer(BaseEstimator, TransformerMixin):
+class CentreOfWealthColumnsTransformer(FrameTransformer):
+
+    CENTRE_LATITUDE: np.float64 = 47.62774
+    CENTRE_LONGITUDE: np.float64 = -122.24194
+    RADIANS: np.float64 = 47.6219
+    CENTRES = ('fixed', 'price_weighted')
+
+    def __init__(self, centre: str = 'fixed', copy: bool = True):
+        super().__init__(copy=copy)
+        self.centre = centre
+
+    def __sklearn_is_fitted__(self):
+        # The fixed centre can be used without fitting
+        return self.centre == 'fixed' or hasattr(self, 'centre_latitude_')
+
     def fit(self, X, y=None):
+        if hasattr(self, 'price_sums_'):
+            del self.price_sums_
+        self.partial_fit(X)
+        if self.centre == 'price_weighted' and not self.price_sums_[0] > 0:
+            raise ValueError("No priced houses found to compute the price weighted centre of")
+        return self
+
+    def partial_fit(self, X, y=None):
+        '''partial_fit adds the houses of X to the price weighted centre, so it can be learned from a
+        dataset that is read chunk by chunk'''
+        if self.centre not in self.CENTRES:
+            raise ValueError(f"centre must be one of {self.CENTRES}, got {self.centre!r}")
+        if self.centre == 'fixed':
+            centre_latitude, centre_longitude, radians = self.CENTRE_LATITUDE, self.CENTRE_LONGITUDE, self.RADIANS
+        else:
+            # The centre of wealth is the price weighted mean location of the houses, kept as the
+            # sums of the prices and of the price weighted latitudes and longitudes
+            location = X[['lat', 'long', 'price']].to_numpy(dtype=np.float64)
+            location = location[np.isfinite(location).all(axis=1)]
+            price_sums = np.concatenate(([location[:, 2].sum()], (location[:, :2] * location[:, 2:]).sum(axis=0)))
+            if hasattr(self, 'price_sums_'):
+                price_sums += self.price_sums_
+            self.price_sums_ = price_sums
+            if not price_sums[0] > 0:
+                return self
+            centre_latitude, centre_longitude = price_sums[1:] / price_sums[0]
+            radians = centre_latitude
+        self.centre_latitude_ = centre_latitude
+        self.centre_longitude_ = centre_longitude
+        self.longitude_scale_ = np.cos(np.radians(radians))
         return self
 
+    def _geometry(self):
+        if hasattr(self, 'centre_latitude_'):
+            return self.centre_latitude_, self.centre_longitude_, self.longitude_scale_
+        check_is_fitted(self)
+        return self.CENTRE_LATITUDE, self.CENTRE_LONGITUDE, _FIXED_LONGITUDE_SCALE
+
     def transform(self, X, y=None) -> pd.DataFrame:
-        CENTRE_LATITUDE: np.float64 = 47.62774
-        CENTRE_LONGITUDE: np.float64 = -122.24194
-        RADIANS: np.float64 = 47.6219
+        X = self._frame(X)
+        centre_latitude, centre_longitude, longitude_scale = self._geometry()
 
         # Absolute difference of latitude between centre and property
-        X['delta_lat'] = np.absolute(CENTRE_LATITUDE - X['lat'])
+        delta_lat = np.absolute(centre_latitude - X['lat'].to_numpy())
         # Absolute difference of longitude between centre and property
-        X['delta_long'] = np.absolute(CENTRE_LONGITUDE - X['long'])
-        # Distance between centre and property
-        X['center_distance'] = pow((pow((X['delta_long'] * np.cos(np.radians(RADIANS))), 2)
-                                    + pow(X['delta_lat'], 2)), 0.5) * 2 * np.pi * WaterDistanceColumnTransformer.NORMALISE_EARTH_CIRCUM
+        delta_long = np.absolute(centre_longitude - X['long'].to_numpy())
+        # Distance between centre and property, computed in a single scratch array
+        center_distance = delta_long * longitude_scale
+        np.square(center_distance, out=center_distance)
+        center_distance += np.square(delta_lat)
+        np.sqrt(center_distance, out=center_distance)
+        center_distance *= KM_PER_DEGREE
+
+        X['delta_lat'] = delta_lat
+        X['delta_long'] = delta_long
+        X['center_distance'] = center_distance
+        return X
+
+
+class GeoClusterColumnsTransformer(FrameTransformer):
+    '''GeoClusterColumnsTransformer learns n_clusters neighbourhoods of the houses with mini-batch
+    k-means on their location in km and their log price, price_weight km per unit of log price. It
+    adds the neighbourhood of every house (geo_cluster) and the distance in km from the house to
+    the centre of its neighbourhood (cluster_distance).
+
+    Unlike the agglomerative clustering of the analysis the memory is bounded: fit clusters a
+    sample of at most max_fit_rows houses, partial_fit learns from a dataset read chunk by chunk
+    (the first chunk needs at least n_clusters houses) and transform works in blocks of chunk_size
+    rows.'''
+
+    def __init__(self, n_clusters: int = 16, price_weight: float = 5.0, max_fit_rows: int = 100_000,
+                 batch_size: int = 4096, chunk_size: int = 65536, random_state: int = 42, copy: bool = True):
+        super().__init__(copy=copy)
+        self.n_clusters = n_clusters
+        self.price_weight = price_weight
+        self.max_fit_rows = max_fit_rows
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.random_state = random_state
+
+    def __sklearn_is_fitted__(self):
+        return hasattr(self, 'kmeans_')
+
+    def fit(self, X, y=None):
+        rows = slice(None)
+        if len(X) > self.max_fit_rows:
+            # The sample is taken from the columns, X.iloc would consolidate the whole frame
+            rows = np.sort(np.random.default_rng(self.random_state).choice(len(X), self.max_fit_rows, replace=False))
+        self.price_fill_ = self._price_fill(X['price'].to_numpy(dtype=np.float64)[rows])
+        self.kmeans_ = self._kmeans().fit(self._points(X, rows))
+        return self
+
+    def partial_fit(self, X, y=None):
+        '''partial_fit updates the neighbourhoods with the houses of X, so they can be learned from
+        a dataset that is read chunk by chunk'''
+        if not hasattr(self, 'kmeans_'):
+            self.price_fill_ = self._price_fill(X['price'].to_numpy(dtype=np.float64))
+            self.kmeans_ = self._kmeans()
+        self.kmeans_.partial_fit(self._points(X))
+        return self
+
+    def _kmeans(self):
+        return MiniBatchKMeans(n_clusters=self.n_clusters, batch_size=self.batch_size, n_init=3,
+                               random_state=self.random_state)
+
+    @staticmethod
+    def _price_fill(price: np.ndarray) -> np.float64:
+        # Houses without a price are clustered at the median price
+        return np.nanmedian(price) if np.isfinite(price).any() else 1.0
+
+    def _points(self, X, rows=slice(None)) -> np.ndarray:
+        price = X['price'].to_numpy(dtype=np.float64)[rows]
+        points = np.empty((len(price), 3))
+        points[:, 0] = X['lat'].to_numpy(dtype=np.float64)[rows] * KM_PER_DEGREE
+        points[:, 1] = X['long'].to_numpy(dtype=np.float64)[rows] * (_FIXED_LONGITUDE_SCALE * KM_PER_DEGREE)
+        np.log(np.maximum(np.where(np.isnan(price), self.price_fill_, price), 1.0), out=points[:, 2])
+        points[:, 2] *= self.price_weight
+        return points
+
+    def transform(self, X, y=None) -> pd.DataFrame:
+        check_is_fitted(self)
+        X = self._frame(X)
+        geo_cluster = np.empty(len(X), dtype=np.int32)
+        cluster_distance = np.empty(len(X))
+        centres = self.kmeans_.cluster_centers_
+        for start in range(0, len(X), self.chunk_size):
+            rows = slice(start, start + self.chunk_size)
+            points = self._points(X, rows)
+            labels = self.kmeans_.predict(points)
+            geo_cluster[rows] = labels
+            # The distance on the map, the price of the house is left out
+            cluster_distance[rows] = np.hypot(points[:, 0] - centres[labels, 0], points[:, 1] - centres[labels, 1])
+        X['geo_cluster'] = geo_cluster
+        X['cluster_distance'] = cluster_distance
+        return X
+
+
+class FusedArithmeticTransformer(FrameTransformer):
+    '''FusedArithmeticTransformer computes the columns of SqftColumnTransformer (sqft_basement),
+    SqFtPriceColumnTransformer (sqft_price) and CentreOfWealthColumnsTransformer (delta_lat,
+    delta_long, center_distance) in a single pass over the input columns, chunk_size rows at a
+    time. Every result is written straight into its output array and the scratch arrays of a chunk
+    are reused, so unlike the three transformers no temporaries of the length of X are allocated.
+    The columns are identical to the ones of the three transformers: the same NumPy operations run
+    in the same order, only on chunks that stay in the CPU cache.'''
+
+    def __init__(self, centre_of_wealth=None, chunk_size: int = 16384, copy: bool = True):
+        super().__init__(copy=copy)
+        # The CentreOfWealthColumnsTransformer the centre is taken from, the fixed centre by default
+        self.centre_of_wealth = centre_of_wealth
+        self.chunk_size = chunk_size
+
+    def _centre_of_wealth(self):
+        if hasattr(self, 'centre_of_wealth_'):
+            return self.centre_of_wealth_
+        return self.centre_of_wealth if self.centre_of_wealth is not None else CentreOfWealthColumnsTransformer()
+
+    def __sklearn_is_fitted__(self):
+        return hasattr(self, 'centre_of_wealth_') or self._centre_of_wealth().__sklearn_is_fitted__()
+
+    def fit(self, X, y=None):
+        self.centre_of_wealth_ = clone(self._centre_of_wealth()).fit(X, y)
+        return self
+
+    def partial_fit(self, X, y=None):
+        if not hasattr(self, 'centre_of_wealth_'):
+            self.centre_of_wealth_ = clone(self._centre_of_wealth())
+        self.centre_of_wealth_.partial_fit(X, y)
+        return self
+
+    def transform(self, X, y=None) -> pd.DataFrame:
+        X = self._frame(X)
+        centre_latitude, centre_longitude, longitude_scale = self._centre_of_wealth()._geometry()
+        living, above, lot, price, lat, long = (X[column].to_numpy() for column in (
+            'sqft_living', 'sqft_above', 'sqft_lot', 'price', 'lat', 'long'))
+
+        # The output and scratch dtypes are the ones the unfused expressions produce
+        n_rows = len(X)
+        sqft_basement = np.empty(n_rows, dtype=(living[:0] - above[:0]).dtype)
+        sqft_area = np.empty(min(n_rows, self.chunk_size), dtype=(living[:0] + lot[:0]).dtype)
+        sqft_price = np.empty(n_rows, dtype=(price[:0] / sqft_area[:0]).dtype)
+        delta_lat = np.empty(n_rows, dtype=(centre_latitude - lat[:0]).dtype)
+        delta_long = np.empty(n_rows, dtype=(centre_longitude - long[:0]).dtype)
+        center_distance = np.empty(n_rows, dtype=(delta_long[:0] * longitude_scale).dtype)
+        square_lat = np.empty(len(sqft_area), dtype=delta_lat.dtype)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for start in range(0, n_rows, self.chunk_size):
+                rows = slice(start, start + self.chunk_size)
+                size = min(self.chunk_size, n_rows - start)
+                np.subtract(living[rows], above[rows], out=sqft_basement[rows])
+
+                np.add(living[rows], lot[rows], out=sqft_area[:size])
+                np.divide(price[rows], sqft_area[:size], out=sqft_price[rows])
+                np.round(sqft_price[rows], 2, out=sqft_price[rows])
+
+                np.absolute(np.subtract(centre_latitude, lat[rows], out=delta_lat[rows]), out=delta_lat[rows])
+                np.absolute(np.subtract(centre_longitude, long[rows], out=delta_long[rows]), out=delta_long[rows])
+                np.multiply(delta_long[rows], longitude_scale, out=center_distance[rows])
+                np.square(center_distance[rows], out=center_distance[rows])
+                center_distance[rows] += np.square(delta_lat[rows], out=square_lat[:size])
+                np.sqrt(center_distance[rows], out=center_distance[rows])
+                center_distance[rows] *= KM_PER_DEGREE
+
+        # Assigning a column copies the array, each one is released as soon as it is copied
+        columns = {'sqft_basement': sqft_basement, 'sqft_price': sqft_price, 'delta_lat': delta_lat,
+                   'delta_long': delta_long, 'center_distance': center_distance}
+        del sqft_basement, sqft_price, delta_lat, delta_long, center_distance
+        for column in list(columns):
+            X[column] = columns.pop(column)
         return X
 
 
-class WaterDistanceColumnTransformer(BaseEstimator, TransformerMixin):
+class WaterDistanceColumnTransformer(FrameTransformer):
 
     NORMALISE_EARTH_CIRCUM: np.float64 = 6378/360
+    ALGORITHMS = ('brute', 'kd_tree', 'chunked')
+    # Number of projected nearest neighbours first checked exactly for every row
+    KD_TREE_CANDIDATES: int = 4
+
+    def __init__(self, algorithm: str = 'kd_tree', chunk_size: int = 4096, copy: bool = True):
+        super().__init__(copy=copy)
+        self.algorithm = algorithm
+        self.chunk_size = chunk_size
+
+    def __sklearn_is_fitted__(self):
+        return hasattr(self, 'reference_cos_')
 
     def fit(self, X, y=None):
+        self._reset()
+        self.partial_fit(X)
+        if len(self.reference_long_) == 0:
+            raise ValueError("No waterfront houses found to compute water_distance against")
         return self
 
+    def _reset(self):
+        if hasattr(self, 'reference_cos_'):
+            del self.reference_long_, self.reference_lat_, self.reference_cos_, self.projection_cos_, self.index_
+
+    def partial_fit(self, X, y=None):
+        '''partial_fit adds the waterfront houses of X to the reference set, so it can be learned
+        from a dataset that is read chunk by chunk'''
+        if self.algorithm not in self.ALGORITHMS:
+            raise ValueError(
+                f"algorithm must be one of {self.ALGORITHMS}, got {self.algorithm!r}")
+        # The waterfront houses are our reference set, de-duplicated on their coordinates
+        water_list = X.loc[X['waterfront'] == 1, ['long', 'lat']].to_numpy(dtype=np.float64)
+        water_list = water_list[np.isfinite(water_list).all(axis=1)]
+        if hasattr(self, 'reference_cos_'):
+            water_list = np.concatenate(
+                (np.column_stack((self.reference_long_, self.reference_lat_)), water_list))
+        reference_long, reference_lat = np.unique(water_list, axis=0).T.copy()
+        return self._set_reference(reference_long, reference_lat)
+
+    def _set_reference(self, reference_long: np.ndarray, reference_lat: np.ndarray, reference_cos: np.ndarray = None):
+        self.reference_long_ = reference_long
+        self.reference_lat_ = reference_lat
+        self.reference_cos_ = np.cos(np.radians(reference_lat)) if reference_cos is None else reference_cos
+        self.projection_cos_ = self.reference_cos_.min() if len(reference_lat) else np.nan
+        self.index_ = None
+        if self.algorithm == 'kd_tree' and len(reference_lat):
+            # Longitudes are projected with the smallest reference cosine, so projected distances
+            # are a lower bound of the distances computed by dist()
+            self.index_ = cKDTree(self._project(self.reference_long_, self.reference_lat_))
+        return self
+
+    def __getstate__(self):
+        # The kd-tree is rebuilt from the reference arrays when loaded, so that a persisted
+        # transformer only holds plain (memory-mappable) arrays
+        state = dict(super().__getstate__())
+        state.pop('index_', None)
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        if 'reference_cos_' in state:
+            self._set_reference(self.reference_long_, self.reference_lat_, self.reference_cos_)
+
     # This function helps us to calculate the distance between the house overlooking the seafront and the other houses.
     def dist(self, long: np.float64, lat: np.float64, ref_long: np.float64, ref_lat: np.float64) -> np.float64:
         '''dist computes the distance in km to a reference location. Input: long and lat of
@@ -52,16 +326,82 @@ class WaterDistanceColumnTransformer(BaseEstimator, TransformerMixin):
             2 * np.pi * WaterDistanceColumnTransformer.NORMALISE_EARTH_CIRCUM
         return result
 
+    def _project(self, long: np.ndarray, lat: np.ndarray) -> np.ndarray:
+        return np.column_stack((long * self.projection_cos_, lat))
+
+    def _squared_dist(self, long: np.ndarray, lat: np.ndarray, ref_idx: np.ndarray) -> np.ndarray:
+        '''Squared (unscaled) dist() between each location and the reference points in ref_idx,
+        which broadcasts against long and lat'''
+        delta_long_corr = (long - self.reference_long_[ref_idx]) * self.reference_cos_[ref_idx]
+        delta_lat = lat - self.reference_lat_[ref_idx]
+        return delta_long_corr ** 2 + delta_lat ** 2
+
+    @staticmethod
+    def _closest(squared_dist: np.ndarray, ref_idx: np.ndarray):
+        # The smallest squared distance of every row and the reference point it belongs to
+        rows = np.arange(len(squared_dist))
+        closest = squared_dist.argmin(axis=1)
+        return squared_dist[rows, closest], ref_idx[rows, closest]
+
+    def _nearest_brute(self, long: np.ndarray, lat: np.ndarray):
+        ref_idx = np.broadcast_to(np.arange(len(self.reference_long_)), (len(long), len(self.reference_long_)))
+        return self._closest(self._squared_dist(long[:, None], lat[:, None], ref_idx), ref_idx)
+
+    def _in_chunks(self, nearest, long: np.ndarray, lat: np.ndarray):
+        result = np.empty(len(long))
+        nearest_idx = np.empty(len(long), dtype=np.intp)
+        for start in range(0, len(long), self.chunk_size):
+            stop = start + self.chunk_size
+            result[start:stop], nearest_idx[start:stop] = nearest(long[start:stop], lat[start:stop])
+        return result, nearest_idx
+
+    def _nearest_chunked(self, long: np.ndarray, lat: np.ndarray):
+        return self._in_chunks(self._nearest_brute, long, lat)
+
+    def _nearest_kd_tree(self, long: np.ndarray, lat: np.ndarray):
+        # Blocks of rows bound the memory of the candidate queries when the reference set is dense
+        return self._in_chunks(self._nearest_kd_tree_block, long, lat)
+
+    def _nearest_kd_tree_block(self, long: np.ndarray, lat: np.ndarray):
+        result = np.empty(len(long))
+        nearest_idx = np.empty(len(long), dtype=np.intp)
+        rows = np.arange(len(long))
+        k = self.KD_TREE_CANDIDATES
+        while len(rows):
+            k = min(k, len(self.reference_long_))
+            bound, ref_idx = self.index_.query(self._project(long[rows], lat[rows]), k=k)
+            bound, ref_idx = bound.reshape(len(rows), k), ref_idx.reshape(len(rows), k)
+            result[rows], nearest_idx[rows] = self._closest(
+                self._squared_dist(long[rows, None], lat[rows, None], ref_idx), ref_idx)
+            if k == len(self.reference_long_):
+                break
+            # Every reference point outside the k candidates is at least as far as the k-th projected
+            # neighbour, so rows where a candidate beats that bound are exact. The others are queried
+            # again with more candidates
+            rows = rows[result[rows] > bound[:, -1] ** 2]
+            k *= 8
+        return result, nearest_idx
+
+    def nearest(self, long: np.ndarray, lat: np.ndarray):
+        '''nearest returns the distance in km of every location to the nearest waterfront house of the
+        reference set, and the index of that house in reference_long_ and reference_lat_. Locations
+        without coordinates get a nan distance and the index -1.'''
+        check_is_fitted(self)
+        if len(self.reference_cos_) == 0:
+            raise ValueError("No waterfront houses found to compute water_distance against")
+        long = np.asarray(long, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+
+        # All rows are answered in one batched nearest-neighbour query against the reference set
+        water_distance = np.full(len(long), np.nan)
+        nearest_idx = np.full(len(long), -1, dtype=np.intp)
+        valid = np.isfinite(long) & np.isfinite(lat)
+        squared_dist, nearest_idx[valid] = getattr(self, f'_nearest_{self.algorithm}')(long[valid], lat[valid])
+        water_distance[valid] = np.sqrt(squared_dist) * KM_PER_DEGREE
+        return water_distance, nearest_idx
+
     def transform(self, X, y=None) -> pd.DataFrame:
-        water_distance = []
-        water_list = X.query('waterfront == 1')
-
-        # For each row in our data frame we now calculate the distance to the seafront
-        for idx, lat in X.lat.items():
-            ref_list = []
-            for x, y in zip(list(water_list.long), list(water_list.lat)):
-                ref_list.append(self.dist(X.long[idx], X.lat[idx], x, y).min())
-            water_distance.append(min(ref_list))
-        # wir erstellen eine neue Spalte und übernehmen die Werte unserer vorher erstellten Liste
-        X['water_distance'] = water_distance
+        check_is_fitted(self)
+        X = self._frame(X)
+        X['water_distance'], _ = self.nearest(X['long'].to_numpy(), X['lat'].to_numpy())
         return X
@@ -0,0 +1,117 @@
+import hashlib
+from pathlib import Path
+
+import pandas as pd
+
+# Typed, compact loading of the house dataset from CSV, Parquet or Arrow (Feather) files
+
+RAW_DTYPES = {
+    'id': 'int64',
+    'price': 'float32',
+    'bedrooms': 'int8',
+    'bathrooms': 'float32',
+    'sqft_living': 'int32',
+    'sqft_lot': 'int32',
+    'floors': 'float32',
+    'waterfront': 'float32',
+    'view': 'float32',
+    'condition': 'int8',
+    'grade': 'int8',
+    'sqft_above': 'int32',
+    'sqft_basement': 'float32',
+    'yr_built': 'int16',
+    'yr_renovated': 'float32',
+    # A categorical zipcode would turn the model's feature matrix into an object array
+    'zipcode': 'int32',
+    # Coordinates stay float64, float32 rounds longitudes around -122 to ~0.6 m
+    'lat': 'float64',
+    'long': 'float64',
+    'sqft_living15': 'int32',
+    'sqft_lot15': 'int32',
+}
+DATE_FORMAT = '%m/%d/%Y'
+# "sqft_basement" uses '?' for unknown areas
+NA_VALUES = {'sqft_basement': ['?']}
+# Bumped when RAW_DTYPES change, so that columnar caches of an older schema are not read
+CACHE_VERSION = 1
+
+
+def to_compact(df: pd.DataFrame) -> pd.DataFrame:
+    '''to_compact casts the known columns of df to RAW_DTYPES and parses "date"'''
+    dtypes = {column: dtype for column, dtype in RAW_DTYPES.items()
+              if column in df.columns and df[column].dtype != dtype}
+    if dtypes:
+        df = df.astype(dtypes)
+    if 'date' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['date']):
+        df = df.assign(date=pd.to_datetime(df['date'], format=DATE_FORMAT))
+    return df
+
+
+def read_csv(file_path, columns=None) -> pd.DataFrame:
+    # Types and missing values are applied while parsing, so no wide intermediate columns are built
+    dtypes = {column: dtype for column, dtype in RAW_DTYPES.items() if columns is None or column in columns}
+    df_dataset = pd.read_csv(file_path, dtype=dtypes, na_values=NA_VALUES, usecols=columns)
+    return to_compact(df_dataset)
+
+
+def cache_path(file_path, cache_dir) -> Path:
+    # Keyed on the resolved path, files of the same name in different directories have their own cache
+    file_path = Path(file_path).resolve()
+    key = hashlib.sha1(str(file_path).encode()).hexdigest()[:16]
+    return Path(cache_dir) / f"{file_path.stem}-{key}.v{CACHE_VERSION}.parquet"
+
+
+def source_stamp(file_path) -> dict:
+    '''source_stamp returns the size and modification time of file_path, as the Parquet schema
+    metadata the cache of the file is stored with'''
+    stat = Path(file_path).stat()
+    return {b'source_size': str(stat.st_size).encode(), b'source_mtime_ns': str(stat.st_mtime_ns).encode()}
+
+
+def is_cache_current(cached: Path, file_path) -> bool:
+    import pyarrow.parquet as pq
+
+    if not cached.exists():
+        return False
+    metadata = pq.read_schema(cached).metadata or {}
+    return all(metadata.get(key) == value for key, value in source_stamp(file_path).items())
+
+
+def write_cache(file_path, cached: Path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Stamped before parsing, a file modified meanwhile is parsed again by the next call
+    stamp = source_stamp(file_path)
+    table = pa.Table.from_pandas(read_csv(file_path), preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), **stamp})
+    cached.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cached.with_suffix('.tmp')
+    pq.write_table(table, tmp_path)
+    tmp_path.replace(cached)
+
+
+def read_houses(file_path, cache_dir=None, columns=None) -> pd.DataFrame:
+    '''read_houses loads the houses at file_path with the compact RAW_DTYPES. Parquet (.parquet) and
+    Arrow (.feather, .arrow) files are read directly. A CSV file is parsed once and, with cache_dir,
+    stored as Parquet there; later calls read the Parquet file as long as the CSV file has the size
+    and modification time it was cached with. Parquet and Arrow need pyarrow.'''
+    file_path = Path(file_path)
+    suffix = file_path.suffix.lower()
+    if suffix == '.parquet':
+        return to_compact(pd.read_parquet(file_path, columns=columns))
+    if suffix in ('.feather', '.arrow'):
+        return to_compact(pd.read_feather(file_path, columns=columns))
+    if cache_dir is None:
+        return read_csv(file_path, columns)
+
+    cached = cache_path(file_path, cache_dir)
+    if not is_cache_current(cached, file_path):
+        # The whole file is cached, any subset of its columns can be read from the cache
+        write_cache(file_path, cached)
+    return to_compact(pd.read_parquet(cached, columns=columns))
+
+
+def memory_footprint(df: pd.DataFrame) -> int:
+    '''memory_footprint returns the bytes held by df, including the Python objects of object columns'''
+    return int(df.memory_usage(deep=True).sum())
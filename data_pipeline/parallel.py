@@ -0,0 +1,63 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+
+# Parallel execution of the fitted, row-local preprocessing steps
+
+# State of a worker process, set once by _init_worker
+_worker_steps = None
+_worker_shared_memory = None
+
+
+def effective_n_jobs(n_jobs: int) -> int:
+    '''effective_n_jobs resolves n_jobs like scikit-learn: -1 means all cores, -2 all but one, ...'''
+    if n_jobs is None or n_jobs == 0:
+        return 1
+    if n_jobs < 0:
+        return max(os.cpu_count() + 1 + n_jobs, 1)
+    return n_jobs
+
+
+def _init_worker(steps, water_distance_name, shared_memory_name, shape):
+    global _worker_steps, _worker_shared_memory
+    # The waterfront reference arrays are read from shared memory instead of being pickled
+    _worker_shared_memory = shared_memory.SharedMemory(name=shared_memory_name)
+    reference = np.ndarray(shape, dtype=np.float64, buffer=_worker_shared_memory.buf)
+    water_distance = dict(steps)[water_distance_name]
+    water_distance._set_reference(reference[0], reference[1], reference[2])
+    _worker_steps = steps
+
+
+def _transform_partition(partition: pd.DataFrame) -> pd.DataFrame:
+    for _, step in _worker_steps:
+        partition = step.transform(partition)
+    return partition
+
+
+def parallel_transform(steps, df: pd.DataFrame, n_jobs: int, water_distance_name: str = 'water_distance') -> pd.DataFrame:
+    '''parallel_transform applies the fitted steps to row partitions of df in a process pool
+    and reassembles the partitions in their original order. The fitted waterfront reference set
+    of the water_distance step is handed to the workers through shared memory'''
+    n_jobs = min(effective_n_jobs(n_jobs), max(len(df), 1))
+    water_distance = dict(steps)[water_distance_name]
+    reference = np.stack((water_distance.reference_long_,
+                          water_distance.reference_lat_,
+                          water_distance.reference_cos_))
+    # Workers get the steps with an unfitted water_distance step, it is fitted from shared memory
+    worker_steps = [(name, clone(step) if name == water_distance_name else step) for name, step in steps]
+
+    shm = shared_memory.SharedMemory(create=True, size=max(reference.nbytes, 1))
+    try:
+        np.ndarray(reference.shape, dtype=np.float64, buffer=shm.buf)[:] = reference
+        bounds = np.linspace(0, len(df), n_jobs + 1, dtype=int)
+        partitions = [df.iloc[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                                 initargs=(worker_steps, water_distance_name, shm.name, reference.shape)) as pool:
+            return pd.concat(pool.map(_transform_partition, partitions))
+    finally:
+        shm.close()
+        shm.unlink()
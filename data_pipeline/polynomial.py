@@ -0,0 +1,150 @@
+import numpy as np
+from sklearn.base import BaseEstimator, RegressorMixin, TransformerMixin
+from sklearn.linear_model import ElasticNet
+from sklearn.preprocessing import PolynomialFeatures
+from sklearn.utils.validation import check_is_fitted
+
+# Polynomial feature expansion in row blocks, and an ElasticNet fitted over the expansion without
+# materialising it
+
+BLOCK_SIZE = 10000
+
+
+class PolynomialExpansion(BaseEstimator, TransformerMixin):
+    '''PolynomialExpansion produces the features of PolynomialFeatures (same columns, same order)
+    block_size rows at a time. transform fills a single output array of dtype (float32 by default,
+    half of the float64 matrix of PolynomialFeatures); blocks yields the expansion block by block
+    without ever holding more than block_size expanded rows. order='F' lays the output out by
+    column, the layout ElasticNet fits on without copying (with copy_X=False).'''
+
+    def __init__(self, degree: int = 2, dtype=np.float32, block_size: int = BLOCK_SIZE, order: str = 'C'):
+        self.degree = degree
+        self.dtype = dtype
+        self.block_size = block_size
+        self.order = order
+
+    def fit(self, X, y=None):
+        X = np.asarray(X)
+        # PolynomialFeatures only learns the number of input features, a single row is enough
+        self.poly_ = PolynomialFeatures(self.degree).fit(X[:1])
+        self.n_features_in_ = self.poly_.n_features_in_
+        self.n_output_features_ = self.poly_.n_output_features_
+        return self
+
+    def blocks(self, X):
+        '''blocks yields (start, expanded rows from start) for every block of block_size rows of X'''
+        check_is_fitted(self)
+        X = np.asarray(X)
+        for start in range(0, len(X), self.block_size):
+            yield start, self.poly_.transform(X[start:start + self.block_size].astype(self.dtype, copy=False))
+
+    def transform(self, X, y=None) -> np.ndarray:
+        X_out = np.empty((len(X), self.n_output_features_), dtype=self.dtype, order=self.order)
+        for start, block in self.blocks(X):
+            X_out[start:start + len(block)] = block
+        return X_out
+
+    def get_feature_names_out(self, input_features=None):
+        return self.poly_.get_feature_names_out(input_features)
+
+
+class OutOfCoreElasticNet(BaseEstimator, RegressorMixin):
+    '''OutOfCoreElasticNet fits the model of the notebook, ElasticNet on the standardised
+    polynomial features of degree "degree", from the raw features. The expansion is only ever
+    computed block_size rows at a time: fit (and every partial_fit call) accumulates the
+    sufficient statistics of the expanded features (their sums and cross products, the chunked
+    normal equations), and ElasticNet is solved from these statistics alone. Memory does not grow
+    with the number of rows.
+
+    The objective is the one of ElasticNet after StandardScaler:
+        1 / (2 * n_samples) * ||y - Xw - b||^2 + alpha * l1_ratio * ||w||_1 + 0.5 * alpha * (1 - l1_ratio) * ||w||^2
+    max_iter and tol are the ones of ElasticNet. The notebook's tol=0.2 stops far from the optimum,
+    the default tol=1e-4 converges.'''
+
+    def __init__(self, degree: int = 2, alpha: float = 1.0, l1_ratio: float = 0.5, max_iter: int = 50000,
+                 tol: float = 1e-4, block_size: int = BLOCK_SIZE):
+        self.degree = degree
+        self.alpha = alpha
+        self.l1_ratio = l1_ratio
+        self.max_iter = max_iter
+        self.tol = tol
+        self.block_size = block_size
+
+    def fit(self, X, y):
+        for attribute in ('expansion_', 'n_samples_seen_', 'model_'):
+            self.__dict__.pop(attribute, None)
+        return self.partial_fit(X, y)
+
+    def partial_fit(self, X, y):
+        '''partial_fit adds the rows of X to the statistics of the rows seen so far and solves the
+        model on all of them, starting from the previous coefficients'''
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if not hasattr(self, 'expansion_'):
+            self.expansion_ = PolynomialExpansion(self.degree, np.float64, self.block_size).fit(X)
+            n_features = self.expansion_.n_output_features_
+            self.n_samples_seen_ = 0
+            self.n_features_in_ = self.expansion_.n_features_in_
+            # The statistics are accumulated around the means of the first block, which keeps the
+            # cross products of large features like sqft_lot^2 from cancelling out
+            first = self.expansion_.poly_.transform(X[:self.block_size])
+            self.shift_ = first.mean(axis=0)
+            self.y_shift_ = y[:self.block_size].mean()
+            self.sum_ = np.zeros(n_features)
+            self.gram_ = np.zeros((n_features, n_features))
+            self.xy_ = np.zeros(n_features)
+            self.y_sum_ = 0.0
+        for start, block in self.expansion_.blocks(X):
+            block -= self.shift_
+            y_block = y[start:start + len(block)] - self.y_shift_
+            self.sum_ += block.sum(axis=0)
+            self.gram_ += block.T @ block
+            self.xy_ += block.T @ y_block
+            self.y_sum_ += y_block.sum()
+        self.n_samples_seen_ += len(X)
+        self._solve()
+        return self
+
+    def _solve(self):
+        n_samples = self.n_samples_seen_
+        mean = self.sum_ / n_samples
+        y_mean = self.y_sum_ / n_samples
+        covariance = self.gram_ / n_samples - np.outer(mean, mean)
+        variance = np.diag(covariance).copy()
+        # Constant columns (like the bias column) get no coefficient, as with StandardScaler
+        active = variance > 1e-12 * np.maximum(np.abs(self.shift_ + mean) ** 2, 1.0)
+        scale = np.where(active, np.sqrt(np.where(active, variance, 1.0)), 1.0)
+        Q = covariance[np.ix_(active, active)] / np.outer(scale[active], scale[active])
+        q = (self.xy_ / n_samples - mean * y_mean)[active] / scale[active]
+
+        # The least squares term only depends on Q and q: with Q = V diag(s) V^T, the rows
+        # X_root = sqrt(k) diag(sqrt(s)) V^T and the targets y_root = sqrt(k) diag(1 / sqrt(s)) V^T q
+        # define the same ElasticNet problem with k rows, at most one per expanded feature
+        eigenvalues, eigenvectors = np.linalg.eigh(Q)
+        keep = eigenvalues > eigenvalues.max(initial=0.0) * 1e-12
+        k = max(int(keep.sum()), 1)
+        root = np.sqrt(eigenvalues[keep])
+        X_root = np.sqrt(k) * (eigenvectors[:, keep] * root).T
+        y_root = np.sqrt(k) * (eigenvectors[:, keep].T @ q) / root
+
+        if not hasattr(self, 'model_'):
+            self.model_ = ElasticNet(fit_intercept=False, warm_start=True)
+        self.model_.set_params(alpha=self.alpha, l1_ratio=self.l1_ratio, max_iter=self.max_iter, tol=self.tol)
+        if len(y_root):
+            self.model_.fit(X_root, y_root)
+        coef = np.zeros(len(scale))
+        coef[active] = self.model_.coef_ if len(y_root) else 0.0
+        self.n_iter_ = self.model_.n_iter_ if len(y_root) else 0
+        self.mean_ = self.shift_ + mean
+        self.scale_ = scale
+        # The standardisation is folded into the coefficients of the expanded features
+        self.coef_ = coef / scale
+        self.intercept_ = self.y_shift_ + y_mean - self.mean_ @ self.coef_
+
+    def predict(self, X) -> np.ndarray:
+        check_is_fitted(self, 'coef_')
+        X = np.asarray(X, dtype=np.float64)
+        y_pred = np.empty(len(X))
+        for start, block in self.expansion_.blocks(X):
+            y_pred[start:start + len(block)] = block @ self.coef_ + self.intercept_
+        return y_pred
@@ -1,34 +1,67 @@
+from contextlib import nullcontext
+
 import pandas as pd
+from base_transformers import FrameTransformer
 from data_cleaning_transformers import (DropExtraneousColumnsTransformer,
                                         LastKnownChangeColumnTransformer,
                                         SqftColumnTransformer,
                                         ViewColumnTransformer,
                                         WaterFrontColumnTransformer)
 from feature_enginneering_tranformers import (CentreOfWealthColumnsTransformer,
+                                              FusedArithmeticTransformer,
+                                              GeoClusterColumnsTransformer,
                                               SqFtPriceColumnTransformer,
                                               WaterDistanceColumnTransformer)
+from parallel import effective_n_jobs, parallel_transform
+from sklearn.base import clone
 from sklearn.compose import ColumnTransformer
 from sklearn.model_selection import train_test_split
 from sklearn.pipeline import Pipeline
 
 
+# Raw columns the stateful steps learn from
+STATEFUL_COLUMNS = ['waterfront', 'lat', 'long', 'price']
+
+
+def learns_state(step) -> bool:
+    # FrameTransformer.fit learns nothing, a step that overrides it learns from the data
+    return type(step).fit is not FrameTransformer.fit
+
+
 class PreprocessingSeattleHousing:
 
-    def __init__(self):
+    def __init__(self, n_jobs=1, copy=True, fused=False, n_clusters=None):
+        # Number of worker processes the row-local steps are run in, -1 uses all cores
+        self.n_jobs = n_jobs
+        # With copy=False the steps modify the input DataFrame in place instead of returning a new one
+        self.copy = copy
+        # With fused=True sqft_basement, sqft_price and center_of_wealth are computed by a single
+        # FusedArithmeticTransformer step, the output is identical
+        self.fused = fused
+        # With n_clusters set the houses are grouped into that many neighbourhoods, adding the
+        # geo_cluster and cluster_distance columns (GeoClusterColumnsTransformer)
+        self.n_clusters = n_clusters
 
         # Data cleaning Pipeline
         self.data_cleaning_pipeline = Pipeline(steps=[
-            ('view', ViewColumnTransformer()),
-            ('sqft_basement', SqftColumnTransformer()),
-            ('waterfront', WaterFrontColumnTransformer()),
-            ('last_known_change', LastKnownChangeColumnTransformer()),
-            ('drop_extraneous_columns', DropExtraneousColumnsTransformer())
+            ('view', ViewColumnTransformer(copy=copy)),
+            *([] if fused else [('sqft_basement', SqftColumnTransformer(copy=copy))]),
+            ('waterfront', WaterFrontColumnTransformer(copy=copy)),
+            ('last_known_change', LastKnownChangeColumnTransformer(copy=copy)),
+            ('drop_extraneous_columns', DropExtraneousColumnsTransformer(copy=copy))
         ])
         # Feature Engineering
+        if fused:
+            arithmetic_steps = [('fused_arithmetic', FusedArithmeticTransformer(
+                centre_of_wealth=CentreOfWealthColumnsTransformer(), copy=copy))]
+        else:
+            arithmetic_steps = [('sqft_price', SqFtPriceColumnTransformer(copy=copy)),
+                                ('center_of_wealth', CentreOfWealthColumnsTransformer(copy=copy))]
         self.feature_enginneering = Pipeline(steps=[
-            ('sqft_price', SqFtPriceColumnTransformer()),
-            ('center_of_wealth', CentreOfWealthColumnsTransformer()),
-            ('water_distance', WaterDistanceColumnTransformer())
+            *arithmetic_steps,
+            ('water_distance', WaterDistanceColumnTransformer(copy=copy)),
+            *([] if n_clusters is None else [
+                ('geo_clusters', GeoClusterColumnsTransformer(n_clusters=n_clusters, copy=copy))])
         ])
 
         self.preprocessor_pipe = Pipeline(steps=[
@@ -36,15 +69,91 @@ class PreprocessingSeattleHousing:
             ('feature_enginneering', self.feature_enginneering)
         ])
 
-    def preprocess_fit_transform(self, df):
-        return self.preprocessor_pipe.fit_transform(df)
-
-    def preprocess_transform(self, df):
-        return self.preprocessor_pipe.transform(df)
+    def preprocess_fit_transform(self, df, profiler=None):
+        # The raw columns the pipeline is fitted on, checked against the service schema when loaded
+        self.input_columns_ = list(df.columns)
+        if effective_n_jobs(self.n_jobs) == 1:
+            if profiler is None:
+                return self.preprocessor_pipe.fit_transform(df)
+            return self._profile_steps(df, profiler, fit=True)
+        # Only the stateful steps learn from the whole dataset, every step is row-local once they are fitted
+        for name, step in self._stateful_steps():
+            with profiler.step(name, 'fit', len(df)) if profiler is not None else nullcontext():
+                step.fit(df)
+            self._set_step(name, step)
+        return self._parallel_transform(df, profiler)
+
+    def preprocess_transform(self, df, profiler=None):
+        if effective_n_jobs(self.n_jobs) == 1:
+            if profiler is None:
+                return self.preprocessor_pipe.transform(df)
+            return self._profile_steps(df, profiler)
+        return self._parallel_transform(df, profiler)
+
+    def preprocess_stream(self, file_path, chunksize=10000, profiler=None):
+        '''preprocess_stream fits the pipeline on the dataset at file_path and yields it preprocessed,
+        chunk by chunk. A first pass only reads the columns the stateful steps learn from (the
+        waterfront reference set of water_distance, the price weighted centre of center_of_wealth,
+        the neighbourhoods of geo_clusters) with their partial_fit, so at most one chunk of the
+        dataset is in memory at a time'''
+        self.input_columns_ = list(load_data(file_path, nrows=0).columns)
+        stateful_steps = dict(self._stateful_steps())
+        first_pass_chunksize = chunksize
+        if 'geo_clusters' in stateful_steps:
+            # Mini-batch k-means learns from batches of batch_size houses, of only a few columns
+            first_pass_chunksize = max(chunksize, stateful_steps['geo_clusters'].batch_size)
+        for chunk in load_data(file_path, chunksize=first_pass_chunksize, usecols=STATEFUL_COLUMNS):
+            for step in stateful_steps.values():
+                step.partial_fit(chunk)
+        if len(stateful_steps['water_distance'].reference_cos_) == 0:
+            raise ValueError("No waterfront houses found to compute water_distance against")
+        for name, step in stateful_steps.items():
+            self._set_step(name, step)
+
+        for chunk in load_data(file_path, chunksize=chunksize):
+            if profiler is not None:
+                yield self._profile_steps(chunk, profiler)
+                continue
+            for _, step in self._steps():
+                chunk = step.transform(chunk)
+            yield chunk
+
+    def _stateful_steps(self):
+        # Unfitted copies of the steps that learn from the data, the others are row-local. They all
+        # learn from raw columns (STATEFUL_COLUMNS) that the steps before them leave as they are.
+        return [(name, clone(step)) for name, step in self._steps() if learns_state(step)]
+
+    def _set_step(self, name, step):
+        for pipeline in (self.data_cleaning_pipeline, self.feature_enginneering):
+            if name in pipeline.named_steps:
+                pipeline.set_params(**{name: step})
+
+    def _steps(self):
+        for pipeline in (self.data_cleaning_pipeline, self.feature_enginneering):
+            yield from pipeline.steps
+
+    def _profile_steps(self, df, profiler, fit=False):
+        # The steps of preprocessor_pipe one by one, each measured by the profiler (profiling.StepProfiler)
+        phase = 'fit_transform' if fit else 'transform'
+        for name, step in self._steps():
+            with profiler.step(name, phase, len(df)):
+                df = step.fit_transform(df) if fit else step.transform(df)
+        return df
+
+    def _parallel_transform(self, df, profiler=None):
+        # The steps run in worker processes, the profiler only measures them as a whole
+        if profiler is None:
+            return parallel_transform(list(self._steps()), df, self.n_jobs)
+        with profiler.step('parallel_transform', 'transform', len(df)):
+            return parallel_transform(list(self._steps()), df, self.n_jobs)
+
+
+# Columns of the preprocessed dataset that are not used as model features
+DROP_COLUMNS = ['price', 'sqft_price', 'date', 'delta_lat', 'delta_long',]
 
 
 def train(dataset):
-    drop_lst = ['price', 'sqft_price', 'date', 'delta_lat', 'delta_long',]
+    drop_lst = DROP_COLUMNS
     # we would like to consider all variables except the ones mentioned above
     all_features = [x for x in dataset.columns if x not in drop_lst]
     # X contains all descriptive variables defined above
@@ -68,9 +177,9 @@ def drop_row(row_num, df_dataset):
     df_dataset.drop(row_num, axis=0, inplace=True)
 
 
-def load_data(file_path):
-    # Loading of the dataset via pandas
-    df_dataset = pd.read_csv(file_path)
+def load_data(file_path, **kwargs):
+    # Loading of the dataset via pandas, optionally in chunks of "chunksize" rows
+    df_dataset = pd.read_csv(file_path, **kwargs)
     return df_dataset
 
 
@@ -0,0 +1,176 @@
+'''Per-step profiling of PreprocessingSeattleHousing: wall time, rows per second and memory delta
+of every named step, optionally with a cProfile or tracemalloc capture per step.
+
+    python data_pipeline/profiling.py --mode cprofile --rows 20
+'''
+import argparse
+import cProfile
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+PAGE_SIZE = 4096
+
+
+def current_rss():
+    '''current_rss returns the resident set size of this process in bytes, None where /proc is missing'''
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return None
+
+
+class StepProfiler:
+    '''StepProfiler accumulates the calls, rows, wall time and memory delta of every (step, phase)
+    it measures. The memory delta is the change in resident set size in mode 'time', the change
+    in traced Python allocations in mode 'tracemalloc' (which also records the peak allocation of
+    a step). Mode 'cprofile' additionally keeps the cProfile statistics of every step, see pstats.
+
+    PreprocessingSeattleHousing only measures its steps when it is given a profiler, without one
+    the pipeline runs exactly as before. The profiler can be shared by threads, but the memory
+    delta of concurrent steps includes the allocations of each other.'''
+
+    MODES = ('time', 'cprofile', 'tracemalloc')
+
+    def __init__(self, mode: str = 'time'):
+        if mode not in self.MODES:
+            raise ValueError(f"mode must be one of {self.MODES}, got {mode!r}")
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._steps = {}
+        self._pstats = {}
+        self._tracemalloc_started = mode == 'tracemalloc' and not tracemalloc.is_tracing()
+        if self._tracemalloc_started:
+            tracemalloc.start()
+
+    @contextmanager
+    def step(self, name: str, phase: str = 'transform', rows: int = 0):
+        profile = cProfile.Profile() if self.mode == 'cprofile' else None
+        if self.mode == 'tracemalloc':
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+        else:
+            memory_before = current_rss()
+        start = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            seconds = time.perf_counter() - start
+            memory_peak = None
+            if self.mode == 'tracemalloc':
+                memory_after, memory_peak = tracemalloc.get_traced_memory()
+                memory_peak -= memory_before
+            else:
+                memory_after = current_rss()
+            memory_delta = memory_after - memory_before if memory_before is not None else None
+            self._record(name, phase, rows, seconds, memory_delta, memory_peak, profile)
+
+    def _record(self, name, phase, rows, seconds, memory_delta, memory_peak, profile):
+        with self._lock:
+            stats = self._steps.setdefault((name, phase), {
+                'step': name, 'phase': phase, 'calls': 0, 'rows': 0, 'seconds': 0.0,
+                'memory_delta': 0 if memory_delta is not None else None, 'memory_peak': memory_peak,
+            })
+            stats['calls'] += 1
+            stats['rows'] += rows
+            stats['seconds'] += seconds
+            if memory_delta is not None:
+                stats['memory_delta'] += memory_delta
+            if memory_peak is not None:
+                stats['memory_peak'] = max(stats['memory_peak'] or 0, memory_peak)
+            if profile is not None:
+                if (name, phase) in self._pstats:
+                    self._pstats[(name, phase)].add(profile)
+                else:
+                    self._pstats[(name, phase)] = pstats.Stats(profile)
+
+    def report(self) -> list:
+        '''report returns the statistics of every (step, phase) in the order they were first
+        measured, with the rows per second of the step'''
+        with self._lock:
+            steps = [dict(stats) for stats in self._steps.values()]
+        for stats in steps:
+            stats['rows_per_second'] = stats['rows'] / stats['seconds'] if stats['seconds'] > 0 else None
+        return steps
+
+    def pstats(self, name: str, phase: str = 'transform') -> pstats.Stats:
+        '''pstats returns the cProfile statistics of a step (mode 'cprofile' only)'''
+        with self._lock:
+            return self._pstats[(name, phase)]
+
+    def reset(self):
+        with self._lock:
+            self._steps.clear()
+            self._pstats.clear()
+
+    def close(self):
+        # Tracing every allocation slows down the whole process, it is stopped if this profiler started it
+        if self._tracemalloc_started:
+            tracemalloc.stop()
+            self._tracemalloc_started = False
+
+    def prometheus(self, prefix: str = 'pipeline_step') -> str:
+        '''prometheus returns the report in the Prometheus text exposition format'''
+        metrics = [
+            ('calls_total', 'counter', 'Calls of the step', 'calls'),
+            ('rows_total', 'counter', 'Rows passed through the step', 'rows'),
+            ('seconds_total', 'counter', 'Wall time spent in the step', 'seconds'),
+            # Memory can be released by a step, the sum of the deltas goes down as well as up
+            ('memory_delta_bytes', 'gauge', 'Sum of the memory deltas of the calls of the step', 'memory_delta'),
+            ('memory_peak_bytes', 'gauge', 'Largest peak allocation of a call of the step', 'memory_peak'),
+        ]
+        report = self.report()
+        lines = []
+        for suffix, metric_type, description, key in metrics:
+            samples = [stats for stats in report if stats[key] is not None]
+            if not samples:
+                continue
+            lines += [f"# HELP {prefix}_{suffix} {description}", f"# TYPE {prefix}_{suffix} {metric_type}"]
+            lines += [f'{prefix}_{suffix}{{step="{stats["step"]}",phase="{stats["phase"]}"}} {stats[key]}'
+                      for stats in samples]
+        return "\n".join(lines) + "\n"
+
+
+def format_report(report: list) -> str:
+    df_report = pd.DataFrame(report, columns=['step', 'phase', 'calls', 'rows', 'seconds', 'rows_per_second',
+                                              'memory_delta', 'memory_peak'])
+    for column in ('memory_delta', 'memory_peak'):
+        df_report[column] = df_report[column] / 2 ** 20
+    return df_report.rename(columns={'memory_delta': 'memory_delta_mib', 'memory_peak': 'memory_peak_mib'}) \
+        .to_string(index=False, float_format=lambda value: f"{value:.3f}")
+
+
+def main():
+    from ingestion import read_houses
+    from preprocessing import PreprocessingSeattleHousing
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default="./data/King_County_House_prices_dataset.csv")
+    parser.add_argument("--mode", choices=StepProfiler.MODES, default='time')
+    parser.add_argument("--rows", type=int, default=20, help="functions listed per step in mode cprofile")
+    args = parser.parse_args()
+
+    df_dataset = read_houses(args.data)
+    profiler = StepProfiler(args.mode)
+    preprocessor = PreprocessingSeattleHousing()
+    preprocessor.preprocess_fit_transform(df_dataset, profiler=profiler)
+    preprocessor.preprocess_transform(df_dataset, profiler=profiler)
+    report = profiler.report()
+    print(format_report(report))
+    if args.mode == 'cprofile':
+        for stats in report:
+            print(f"\n{stats['step']} ({stats['phase']})")
+            profiler.pstats(stats['step'], stats['phase']).sort_stats('cumulative').print_stats(args.rows)
+
+
+if __name__ == "__main__":
+    main()
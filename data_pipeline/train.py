@@ -0,0 +1,242 @@
+'''Training of the house price model: a cross-validated hyperparameter search over polynomial
+ElasticNet models on the preprocessed King County dataset. The best model is refitted on the
+training split and written as an artifact (artifact.py), with the timing of every candidate.
+
+    python data_pipeline/train.py --output model/artifact --search halving --n-jobs -1
+'''
+import argparse
+import json
+import math
+import time
+from typing import List, NamedTuple
+
+import numpy as np
+import pandas as pd
+from artifact import save_artifact
+from ingestion import read_houses
+from joblib import Memory, Parallel, delayed
+from polynomial import OutOfCoreElasticNet
+from preprocessing import DROP_COLUMNS, PreprocessingSeattleHousing
+from sklearn.linear_model import ElasticNet
+from sklearn.model_selection import KFold, ParameterGrid, train_test_split
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import PolynomialFeatures, StandardScaler
+
+RAW_DATASET = "./data/King_County_House_prices_dataset.csv"
+SEARCH_FILE = "search.json"
+SEARCHES = ('grid', 'halving')
+# The grid of the ElasticNet search in notebooks/King-County-Modified.ipynb
+PARAM_GRID = {
+    'alpha': [0.1, 0.5, 1, 5, 10],
+    'l1_ratio': [1, 0.5, 0],
+}
+# Successive halving: the best 1/HALVING_FACTOR of the candidates go on to HALVING_FACTOR times the rows
+HALVING_FACTOR = 3
+HALVING_MIN_ROWS = 100
+
+
+class Fold(NamedTuple):
+    '''The expanded features of the training and validation rows of a cross-validation fold'''
+    X_train: np.ndarray
+    y_train: np.ndarray
+    X_val: np.ndarray
+    y_val: np.ndarray
+
+
+def feature_columns(X: pd.DataFrame):
+    # Every column of the preprocessed dataset except the ones not used as model features
+    return [column for column in X.columns if column not in DROP_COLUMNS + ['id']]
+
+
+def feature_pipeline(degree: int = 2) -> Pipeline:
+    # The polynomial features are standardised, without it the coordinate descent of ElasticNet
+    # does not converge for l1_ratio=0 within max_iter
+    return Pipeline(steps=[
+        ('poly', PolynomialFeatures(degree)),
+        ('scale', StandardScaler()),
+    ])
+
+
+def model_pipeline(degree: int = 2, **params) -> Pipeline:
+    '''model_pipeline is the model trained on the preprocessed features, params are passed to ElasticNet'''
+    return Pipeline(steps=feature_pipeline(degree).steps + [
+        ('model', ElasticNet(max_iter=50000, tol=0.2, **params)),
+    ])
+
+
+def prepare_fold(X: pd.DataFrame, train_idx: np.ndarray, val_idx: np.ndarray, degree: int = 2) -> Fold:
+    '''prepare_fold fits PreprocessingSeattleHousing and the feature expansion on the training rows
+    of a fold only, so the waterfront reference set of water_distance does not see the validation
+    rows. It is the part of a fit that does not depend on the hyperparameters: computed once per
+    fold, it is shared by every candidate.'''
+    preprocessor = PreprocessingSeattleHousing()
+    dataset = preprocessor.preprocess_fit_transform(X.iloc[train_idx])
+    dataset_val = preprocessor.preprocess_transform(X.iloc[val_idx])
+    features = feature_columns(dataset)
+    expand = feature_pipeline(degree)
+    return Fold(expand.fit_transform(dataset[features]), dataset['price'].to_numpy(),
+                expand.transform(dataset_val[features]), dataset_val['price'].to_numpy())
+
+
+def prepare_folds(X: pd.DataFrame, cv: int = 5, degree: int = 2, n_jobs: int = -1, memory=None,
+                  random_state: int = 42) -> List[Fold]:
+    '''prepare_folds prepares the cv folds of X in parallel. With a joblib memory the folds are
+    also kept on disk, a later search over the same rows starts from them.'''
+    prepare = memory.cache(prepare_fold) if memory is not None else prepare_fold
+    splits = KFold(cv, shuffle=True, random_state=random_state).split(X)
+    return Parallel(n_jobs=n_jobs)(delayed(prepare)(X, train_idx, val_idx, degree) for train_idx, val_idx in splits)
+
+
+def fit_candidate(params: dict, fold: Fold, n_rows=None, random_state: int = 42):
+    '''fit_candidate fits ElasticNet with params on n_rows training rows of fold (all rows with
+    n_rows=None) and returns its R^2 on the validation rows, the fit and the score time'''
+    X, y = fold.X_train, fold.y_train
+    if n_rows is not None and n_rows < len(y):
+        rows = np.random.default_rng(random_state).choice(len(y), n_rows, replace=False)
+        X, y = X[rows], y[rows]
+    start = time.perf_counter()
+    model = ElasticNet(max_iter=50000, tol=0.2, **params).fit(X, y)
+    fit_time = time.perf_counter() - start
+    start = time.perf_counter()
+    score = model.score(fold.X_val, fold.y_val)
+    return score, fit_time, time.perf_counter() - start
+
+
+def evaluate(candidates: List[dict], folds: List[Fold], n_jobs: int = -1, n_rows=None, iteration: int = 0,
+             random_state: int = 42) -> List[dict]:
+    '''evaluate cross-validates every candidate, the fits of all candidates and folds run in parallel'''
+    results = Parallel(n_jobs=n_jobs)(delayed(fit_candidate)(params, fold, n_rows, random_state)
+                                      for params in candidates for fold in folds)
+    scores, fit_times, score_times = np.array(results).reshape(len(candidates), len(folds), 3).transpose(2, 0, 1)
+    return [{
+        'params': params,
+        'mean_test_score': float(scores[i].mean()),
+        'std_test_score': float(scores[i].std()),
+        'mean_fit_time': float(fit_times[i].mean()),
+        'mean_score_time': float(score_times[i].mean()),
+        'iter': iteration,
+        'n_resources': n_rows or len(folds[0].y_train),
+    } for i, params in enumerate(candidates)]
+
+
+def grid_search(folds: List[Fold], n_jobs: int = -1, random_state: int = 42):
+    '''grid_search evaluates every candidate of PARAM_GRID on all training rows of the folds'''
+    results = evaluate(list(ParameterGrid(PARAM_GRID)), folds, n_jobs, random_state=random_state)
+    return max(results, key=lambda result: result['mean_test_score']), results
+
+
+def halving_search(folds: List[Fold], n_jobs: int = -1, factor: int = HALVING_FACTOR,
+                   min_rows: int = HALVING_MIN_ROWS, random_state: int = 42):
+    '''halving_search is a successive halving search: all candidates of PARAM_GRID start on a
+    fraction of the training rows of the folds, and the best 1/factor of them go on to factor times
+    as many rows, up to all rows. Candidates that score poorly on few rows are stopped early.'''
+    candidates = list(ParameterGrid(PARAM_GRID))
+    max_rows = len(folds[0].y_train)
+    n_iterations = math.ceil(math.log(len(candidates), factor)) if len(candidates) > 1 else 0
+    n_rows = min(max(max_rows // factor ** n_iterations, min_rows), max_rows)
+    results = []
+    for iteration in range(n_iterations + 1):
+        scores = sorted(evaluate(candidates, folds, n_jobs, n_rows, iteration, random_state),
+                        key=lambda result: result['mean_test_score'], reverse=True)
+        results += scores
+        if len(candidates) == 1 or n_rows == max_rows and iteration > 0:
+            break
+        candidates = [result['params'] for result in scores[:math.ceil(len(candidates) / factor)]]
+        n_rows = min(n_rows * factor, max_rows)
+    # Like HalvingGridSearchCV, the best candidate is the best one of the last iteration
+    return scores[0], results
+
+
+def adjusted_r2(r2: float, n_rows: int, n_features: int) -> float:
+    return 1 - (1 - r2) * (n_rows - 1) / (n_rows - n_features - 1)
+
+
+def train(df_dataset: pd.DataFrame, output, search: str = 'halving', cv: int = 5, n_jobs: int = -1,
+          degree: int = 2, test_size: float = 0.3, cache_dir=None, out_of_core: bool = False,
+          random_state: int = 42) -> dict:
+    '''train searches the hyperparameters on the training split of df_dataset, refits the best
+    model on the whole training split and writes it as an artifact to output. With out_of_core the
+    best model is refitted as an OutOfCoreElasticNet, without materialising the polynomial features
+    of the training split. The report of the search is returned and written next to the artifact.'''
+    if search not in SEARCHES:
+        raise ValueError(f"search must be one of {SEARCHES}, got {search!r}")
+    X_train, X_test = train_test_split(df_dataset, test_size=test_size, random_state=random_state)
+
+    start = time.perf_counter()
+    memory = Memory(cache_dir, verbose=0) if cache_dir is not None else None
+    folds = prepare_folds(X_train, cv, degree, n_jobs, memory, random_state)
+    prepare_time = time.perf_counter() - start
+    start = time.perf_counter()
+    if search == 'grid':
+        best, results = grid_search(folds, n_jobs, random_state)
+    else:
+        best, results = halving_search(folds, n_jobs, random_state=random_state)
+    search_time = time.perf_counter() - start
+    del folds
+
+    start = time.perf_counter()
+    preprocessor = PreprocessingSeattleHousing()
+    dataset = preprocessor.preprocess_fit_transform(X_train)
+    features = feature_columns(dataset)
+    if out_of_core:
+        model = OutOfCoreElasticNet(degree, **best['params'])
+    else:
+        model = model_pipeline(degree, **best['params'])
+    model.fit(dataset[features], dataset['price'])
+    coef = model.coef_ if out_of_core else model.named_steps['model'].coef_
+    refit_time = time.perf_counter() - start
+
+    dataset_test = preprocessor.preprocess_transform(X_test)
+    r2 = model.score(dataset_test[features], dataset_test['price'])
+    path = save_artifact(output, preprocessor, model, features)
+
+    report = {
+        'search': search,
+        'cv': cv,
+        'degree': degree,
+        'out_of_core': out_of_core,
+        'best_params': best['params'],
+        'best_cv_score': best['mean_test_score'],
+        'test_r2': r2,
+        'test_adjusted_r2': adjusted_r2(r2, len(X_test), int((coef != 0).sum())),
+        'prepare_time': prepare_time,
+        'search_time': search_time,
+        'refit_time': refit_time,
+        'candidates': sorted(results, key=lambda result: (-result['iter'], -result['mean_test_score'])),
+    }
+    with open(path / SEARCH_FILE, 'w') as f_out:
+        json.dump(report, f_out, indent=2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=RAW_DATASET, help="CSV, Parquet or Arrow file of the raw houses")
+    parser.add_argument("--output", default="model/artifact", help="directory the artifact is written to")
+    parser.add_argument("--search", choices=SEARCHES, default='halving')
+    parser.add_argument("--cv", type=int, default=5)
+    parser.add_argument("--n-jobs", type=int, default=-1, help="parallel cross-validation fits, -1 uses all cores")
+    parser.add_argument("--degree", type=int, default=2)
+    parser.add_argument("--test-size", type=float, default=0.3)
+    parser.add_argument("--cache-dir", default=None,
+                        help="keeps the parsed dataset and the preprocessed folds between runs")
+    parser.add_argument("--out-of-core", action="store_true",
+                        help="refit the best model without materialising its polynomial features")
+    args = parser.parse_args()
+
+    df_dataset = read_houses(args.data, cache_dir=args.cache_dir)
+    # The service only accepts up to 32 bedrooms, like the outlier dropped in preprocessing.main
+    df_dataset = df_dataset[df_dataset['bedrooms'] < 33]
+
+    report = train(df_dataset, args.output, args.search, args.cv, args.n_jobs, args.degree, args.test_size,
+                   args.cache_dir, args.out_of_core)
+    for candidate in report['candidates']:
+        print(f"iter {candidate['iter']} rows {candidate['n_resources']:>6}  {str(candidate['params']):<32} "
+              f"score {candidate['mean_test_score']:7.4f}  fit {candidate['mean_fit_time'] * 1000:8.1f} ms  "
+              f"score {candidate['mean_score_time'] * 1000:6.1f} ms")
+    print(f"best {report['best_params']}: test R^2 {report['test_r2']:.4f}, prepare {report['prepare_time']:.1f} s, "
+          f"search {report['search_time']:.1f} s, refit {report['refit_time']:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+# Read-through cache of serialized GET /houses/{house_id} responses, invalidated on every write.
+# A read takes the version of its key before it queries the database and only caches what it read
+# if no write invalidated the key meanwhile, with a shared backend whichever worker the write ran on.
+
+HOUSE_CACHE_SIZE = int(os.getenv("HOUSE_CACHE_SIZE", "10000"))
+HOUSE_CACHE_TTL = float(os.getenv("HOUSE_CACHE_TTL", "300"))
+HOUSE_CACHE_URL = os.getenv("HOUSE_CACHE_URL")
+
+
+class LRUBackend:
+    '''LRUBackend keeps up to maxsize values in process, evicting the least recently used one.
+    Values older than ttl seconds are treated as missing (ttl=None keeps them until evicted).'''
+
+    def __init__(self, maxsize: int = HOUSE_CACHE_SIZE, ttl: Optional[float] = HOUSE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self._values = OrderedDict()
+        # Bumped by every invalidation, one process sees all of them
+        self._generation = 0
+
+    async def size(self) -> int:
+        return len(self._values)
+
+    async def version(self, key):
+        return self._generation
+
+    async def get(self, key):
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires < time.monotonic():
+            del self._values[key]
+            self.evictions += 1
+            return None
+        self._values.move_to_end(key)
+        return value
+
+    async def set(self, key, value, version=None):
+        if self.maxsize <= 0 or (version is not None and version != self._generation):
+            return
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._values[key] = (value, expires)
+        self._values.move_to_end(key)
+        while len(self._values) > self.maxsize:
+            self._values.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, keys: Iterable):
+        self._generation += 1
+        for key in keys:
+            self._values.pop(key, None)
+
+    async def clear(self):
+        self._generation += 1
+        self._values.clear()
+
+
+# SET KEYS[1] ARGV[2] unless the version KEYS[2] moved on from ARGV[1], ARGV[3] is the ttl in ms
+SET_IF_VERSION = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+if ARGV[3] == '' then
+    redis.call('SET', KEYS[1], ARGV[2])
+else
+    redis.call('SET', KEYS[1], ARGV[2], 'PX', ARGV[3])
+end
+return 1
+"""
+# Versions outlive any read that took one before a write, a version that expired reads as 0 again
+VERSION_TTL_MS = 3600 * 1000
+
+
+class RedisBackend:
+    '''RedisBackend shares the cache between the workers of the service, so a write in one worker
+    invalidates the entry for all of them. Every key has a version in Redis, incremented with the
+    invalidation, and a value is only set if its version did not change since the read (a compare
+    and set run as a Lua script). Evictions are left to the maxmemory policy of Redis.'''
+
+    def __init__(self, url: str, ttl: Optional[float] = HOUSE_CACHE_TTL, prefix: str = "house:"):
+        # redis is only needed when a shared backend is configured
+        import redis.asyncio
+        self.client = redis.asyncio.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.version_prefix = f"{prefix.rstrip(':')}-version:"
+        self.evictions = 0
+        self._set_if_version = self.client.register_script(SET_IF_VERSION)
+
+    async def size(self) -> int:
+        # A scan of the keyspace, for /cache/stats only
+        size = 0
+        async for _ in self.client.scan_iter(f"{self.prefix}*", count=1000):
+            size += 1
+        return size
+
+    async def version(self, key):
+        return await self.client.get(f"{self.version_prefix}{key}") or b"0"
+
+    async def get(self, key):
+        return await self.client.get(f"{self.prefix}{key}")
+
+    async def set(self, key, value, version=None):
+        px = int(self.ttl * 1000) if self.ttl is not None else None
+        if version is None:
+            await self.client.set(f"{self.prefix}{key}", value, px=px)
+        else:
+            await self._set_if_version(keys=[f"{self.prefix}{key}", f"{self.version_prefix}{key}"],
+                                       args=[version, value, px if px is not None else ""])
+
+    async def delete(self, keys: Iterable):
+        keys = list(keys)
+        if not keys:
+            return
+        async with self.client.pipeline(transaction=True) as pipeline:
+            for key in keys:
+                pipeline.incr(f"{self.version_prefix}{key}")
+                pipeline.pexpire(f"{self.version_prefix}{key}", VERSION_TTL_MS)
+            pipeline.delete(*(f"{self.prefix}{key}" for key in keys))
+            await pipeline.execute()
+
+    async def clear(self):
+        # The versions are kept, a read racing with the clear still sees its key moved on
+        async for key in self.client.scan_iter(f"{self.prefix}*"):
+            await self.client.delete(key)
+
+
+class HouseCache:
+    '''HouseCache counts the hits and misses of a backend, the counters are meant for sizing
+    HOUSE_CACHE_SIZE and HOUSE_CACHE_TTL'''
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, house_id: int) -> Optional[bytes]:
+        value = await self.backend.get(house_id)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def version(self, house_id: int):
+        '''version is taken before a read of the database, see set'''
+        return await self.backend.version(house_id)
+
+    async def set(self, house_id: int, value: bytes, version=None):
+        '''set caches value unless house_id was invalidated since version was taken'''
+        await self.backend.set(house_id, value, version)
+
+    async def invalidate(self, house_ids: Iterable[int]):
+        # Writes only delete, the next read caches the committed house
+        await self.backend.delete(house_ids)
+
+    async def clear(self):
+        await self.backend.clear()
+
+    async def stats(self) -> dict:
+        return dict(hits=self.hits, misses=self.misses, evictions=self.backend.evictions,
+                    size=await self.backend.size(), maxsize=getattr(self.backend, "maxsize", None),
+                    ttl=self.backend.ttl)
+
+
+def house_cache() -> HouseCache:
+    if HOUSE_CACHE_URL:
+        return HouseCache(RedisBackend(HOUSE_CACHE_URL))
+    return HouseCache(LRUBackend())
@@ -0,0 +1,190 @@
+'''In-memory nearest-neighbour index of the houses, for the comparable sales of /houses/{house_id}/comps.
+
+A house is a point made of its location in km divided by COMPS_GEO_SCALE_KM and its COMPS_FEATURES
+standardized over the indexed houses, so by default 1 km counts as much as one standard deviation
+of sqft_living. The points are kept in a KD-tree built once from the database. Written houses go
+to a small buffer that is searched exhaustively, and their previous points are masked in the tree,
+until the buffer outgrows COMPS_REBUILD_FRACTION of the tree and the tree is rebuilt from memory.
+
+Every worker process keeps its own index, updated by the writes that worker serves.
+'''
+import threading
+from typing import Iterable, List, Optional, Set, Tuple
+
+import models
+import numpy as np
+from features import in_batches
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+# Similarity features besides the location, water_distance is read from the feature store
+COMPS_FEATURES = ['sqft_living', 'grade', 'bedrooms', 'bathrooms', 'water_distance']
+COMPS_GEO_SCALE_KM = 1.0
+COMPS_DEFAULT_K = 20
+COMPS_MAX_K = 100
+# Written houses kept out of the tree before it is rebuilt, relative to the indexed houses
+COMPS_REBUILD_FRACTION = 0.05
+COMPS_MIN_REBUILD_SIZE = 256
+COMPS_LOAD_BATCH_SIZE = 10000
+
+COLUMNS = ['lat', 'long'] + COMPS_FEATURES
+
+Comp = Tuple[int, float]
+
+
+def comps_statement():
+    House, HouseFeatures = models.House, models.HouseFeatures
+    return select(House.id, House.lat, House.long, House.sqft_living, House.grade, House.bedrooms,
+                  House.bathrooms, HouseFeatures.water_distance).outerjoin(
+        HouseFeatures, HouseFeatures.id == House.id)
+
+
+def to_arrays(rows: list) -> Tuple[np.ndarray, np.ndarray]:
+    # Missing values (None) become NaN and are filled with the mean of their feature
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    values = np.array([row[1:] for row in rows], dtype=np.float64).reshape(len(rows), len(COLUMNS))
+    return ids, values
+
+
+class CompsIndex:
+    '''CompsIndex finds the k houses nearest to a house. load builds it from the database, refresh
+    brings it up to date with a committed write. The index is shared by the request handlers, its
+    lock is only held for in-memory work, never while the database is queried.'''
+
+    def __init__(self, geo_scale_km: float = COMPS_GEO_SCALE_KM, rebuild_fraction: float = COMPS_REBUILD_FRACTION,
+                 min_rebuild_size: int = COMPS_MIN_REBUILD_SIZE):
+        self.geo_scale_km = geo_scale_km
+        self.rebuild_fraction = rebuild_fraction
+        self.min_rebuild_size = min_rebuild_size
+        self.loaded = False
+        self._lock = threading.Lock()
+        # Ids written while a load is running, re-read once it is done
+        self._pending: Optional[Set[int]] = None
+        self._build(np.empty(0, dtype=np.int64), np.empty((0, len(COLUMNS))))
+
+    def __len__(self):
+        return len(self._rows) - self._masked + len(self._buffer)
+
+    def load(self, session: Session, batch_size: int = COMPS_LOAD_BATCH_SIZE):
+        with self._lock:
+            self._pending = set()
+        ids, values = [], []
+        result = session.execute(comps_statement().execution_options(yield_per=batch_size))
+        for partition in result.partitions():
+            partition_ids, partition_values = to_arrays(partition)
+            ids.append(partition_ids)
+            values.append(partition_values)
+        with self._lock:
+            if ids:
+                self._build(np.concatenate(ids), np.concatenate(values))
+            pending, self._pending = self._pending, None
+            self.loaded = True
+        if pending:
+            self.refresh(session, pending)
+
+    def refresh(self, session: Session, house_ids: Iterable[int]):
+        '''refresh re-reads the houses house_ids after a committed write, houses that no longer
+        exist are removed from the index'''
+        with self._lock:
+            if self._pending is not None:
+                self._pending.update(house_ids)
+                return
+            if not self.loaded:
+                return
+        house_ids = list(house_ids)
+        rows = []
+        for batch in in_batches(house_ids):
+            rows += session.execute(comps_statement().where(models.House.id.in_(batch))).all()
+        ids, values = to_arrays(rows)
+        with self._lock:
+            self._remove(house_ids)
+            self._buffer.update(zip(ids.tolist(), values))
+            self._buffer_points = None
+            if len(self._buffer) + self._masked > max(self.min_rebuild_size, self.rebuild_fraction * len(self._rows)):
+                self._rebuild()
+
+    def query_house(self, house_id: int, k: int = COMPS_DEFAULT_K) -> Optional[List[Comp]]:
+        '''query_house returns the k houses nearest to the indexed house house_id as (id, distance)
+        pairs, nearest first, or None if the house is not indexed'''
+        with self._lock:
+            if house_id in self._buffer:
+                values = self._buffer[house_id]
+            elif house_id in self._rows and self._live[self._rows[house_id]]:
+                values = self._values[self._rows[house_id]]
+            else:
+                return None
+            return self._query(self._points(values[np.newaxis])[0], k, exclude=house_id)
+
+    def query(self, house: dict, k: int = COMPS_DEFAULT_K) -> List[Comp]:
+        '''query returns the k houses nearest to a house given by its COLUMNS, e.g. one that is not stored'''
+        values = np.array([[house.get(column) for column in COLUMNS]], dtype=np.float64)
+        with self._lock:
+            return self._query(self._points(values)[0], k)
+
+    def _build(self, ids: np.ndarray, values: np.ndarray):
+        self._ids = ids
+        self._values = values
+        self._rows = {house_id: row for row, house_id in enumerate(ids.tolist())}
+        self._live = np.ones(len(ids), dtype=bool)
+        self._masked = 0
+        self._buffer = {}
+        self._buffer_points = None
+        # The scaling is fixed until the next rebuild, the buffer is scaled like the tree
+        self._mean = np.nanmean(values, axis=0) if len(values) else np.zeros(len(COLUMNS))
+        self._mean = np.where(np.isnan(self._mean), 0.0, self._mean)
+        std = np.nanstd(values, axis=0) if len(values) else np.ones(len(COLUMNS))
+        self._std = np.where(np.isnan(std) | (std == 0), 1.0, std)
+        self._longitude_scale = np.cos(np.radians(self._mean[0])) if len(values) else 1.0
+        self._tree = None
+        if len(values):
+            # scipy is imported with the first houses to index, not with the service
+            from scipy.spatial import cKDTree
+            self._tree = cKDTree(self._points(values))
+
+    def _rebuild(self):
+        buffer_ids = np.fromiter(self._buffer.keys(), dtype=np.int64, count=len(self._buffer))
+        buffer_values = np.array(list(self._buffer.values())).reshape(len(self._buffer), len(COLUMNS))
+        self._build(np.concatenate([self._ids[self._live], buffer_ids]),
+                    np.concatenate([self._values[self._live], buffer_values]))
+
+    def _remove(self, house_ids: Iterable[int]):
+        for house_id in house_ids:
+            self._buffer.pop(house_id, None)
+            row = self._rows.get(house_id)
+            if row is not None and self._live[row]:
+                self._live[row] = False
+                self._masked += 1
+        self._buffer_points = None
+
+    def _points(self, values: np.ndarray) -> np.ndarray:
+        from feature_enginneering_tranformers import KM_PER_DEGREE
+
+        values = np.where(np.isnan(values), self._mean, values)
+        points = np.empty_like(values)
+        points[:, 0] = values[:, 0] * (KM_PER_DEGREE / self.geo_scale_km)
+        points[:, 1] = values[:, 1] * (self._longitude_scale * KM_PER_DEGREE / self.geo_scale_km)
+        points[:, 2:] = (values[:, 2:] - self._mean[2:]) / self._std[2:]
+        return points
+
+    def _query(self, point: np.ndarray, k: int, exclude: Optional[int] = None) -> List[Comp]:
+        # The masked points and the excluded house may be among the nearest points of the tree
+        n_tree = min(k + self._masked + (exclude is not None), len(self._ids))
+        distances, rows = np.empty(0), np.empty(0, dtype=np.int64)
+        if n_tree:
+            distances, rows = (np.atleast_1d(array) for array in self._tree.query(point, k=n_tree))
+            found = rows < len(self._ids)
+            distances, rows = distances[found], rows[found]
+            found = self._live[rows]
+            distances, rows = distances[found], rows[found]
+        ids = self._ids[rows]
+
+        if self._buffer:
+            if self._buffer_points is None:
+                self._buffer_ids = np.fromiter(self._buffer.keys(), dtype=np.int64, count=len(self._buffer))
+                self._buffer_points = self._points(np.array(list(self._buffer.values())))
+            ids = np.concatenate([ids, self._buffer_ids])
+            distances = np.concatenate([distances, np.linalg.norm(self._buffer_points - point, axis=1)])
+        if exclude is not None:
+            distances, ids = distances[ids != exclude], ids[ids != exclude]
+        nearest = np.argsort(distances, kind='stable')[:k]
+        return list(zip(ids[nearest].tolist(), distances[nearest].tolist()))
@@ -1,7 +1,9 @@
 import os
+from functools import lru_cache
 
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -9,7 +11,74 @@ load_dotenv()
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DB_CONN")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# With DB_ASYNC the endpoints use an AsyncSession on the async driver of the same database
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "yes")
+# With DB_CREATE_SCHEMA the service creates the missing tables on startup (see migrate.py), without it
+# it only checks that they exist
+DB_CREATE_SCHEMA = os.getenv("DB_CREATE_SCHEMA", "true").lower() in ("1", "true", "yes")
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+
+def pool_options(url):
+    '''pool_options returns the connection pool settings from the environment, the defaults are
+    the ones of SQLAlchemy. SQLite keeps its own single connection/file pools.'''
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return dict(pool_size=int(os.getenv("DB_POOL_SIZE", 5)),
+                max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 10)),
+                pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", 30)),
+                pool_recycle=int(os.getenv("DB_POOL_RECYCLE", -1)),
+                pool_pre_ping=os.getenv("DB_POOL_PRE_PING", "false").lower() in ("1", "true", "yes"))
+
+
+def async_url(url):
+    '''async_url swaps the driver of url for the async driver of its backend, e.g.
+    postgresql+psycopg2://... becomes postgresql+asyncpg://...'''
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend}")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+@lru_cache(maxsize=None)
+def get_engine():
+    return create_engine(SQLALCHEMY_DATABASE_URL, **pool_options(SQLALCHEMY_DATABASE_URL))
+
+
+@lru_cache(maxsize=None)
+def get_session_factory():
+    return sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
+
+
+@lru_cache(maxsize=None)
+def get_async_engine():
+    if not DB_ASYNC:
+        return None
+    from sqlalchemy.ext.asyncio import create_async_engine
+    return create_async_engine(async_url(SQLALCHEMY_DATABASE_URL), **pool_options(SQLALCHEMY_DATABASE_URL))
+
+
+@lru_cache(maxsize=None)
+def get_async_session_factory():
+    if not DB_ASYNC:
+        return None
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    # Rows are serialized after the session work is done, expiring them would need another round-trip
+    return async_sessionmaker(get_async_engine(), autoflush=False, expire_on_commit=False)
+
+
+LAZY_ATTRIBUTES = dict(engine=get_engine, SessionLocal=get_session_factory, async_engine=get_async_engine,
+                       AsyncSessionLocal=get_async_session_factory)
+
+
+def __getattr__(name):
+    # engine, SessionLocal, async_engine and AsyncSessionLocal are created on first use: importing
+    # the service neither loads the database drivers nor needs the database
+    if name in LAZY_ATTRIBUTES:
+        return LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 Base = declarative_base()
@@ -0,0 +1,288 @@
+'''Incremental feature store: the engineered features of every house, in the house_features table.
+
+Writes to houses recompute the features of the written houses only. When the waterfront houses
+change, only the water_distance of the houses they could affect is recomputed: the houses nearer
+to an added waterfront location than to their current nearest one, and the houses whose nearest
+waterfront location was removed. A full rebuild is an explicit operation:
+
+    PYTHONPATH=data_pipeline python service/features.py --batch-size 10000
+'''
+from __future__ import annotations
+
+import argparse
+import threading
+from functools import lru_cache
+from typing import TYPE_CHECKING, Iterable, List, Set, Tuple
+
+import models
+import numpy as np
+from sqlalchemy import Float, and_, delete, func, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+if TYPE_CHECKING:
+    # pandas is imported by the first write, not with the service
+    import pandas as pd
+
+FEATURE_COLUMNS = ['last_known_change', 'sqft_price', 'delta_lat', 'delta_long', 'center_distance',
+                   'water_distance', 'water_long', 'water_lat']
+# Ids per IN (...) clause, below the bound parameter limit of SQLite
+FEATURE_ID_BATCH_SIZE = 500
+FEATURE_REBUILD_BATCH_SIZE = 10000
+# Added waterfront locations that are filtered on exactly in SQL, more only use a bounding box
+FEATURE_MAX_DISTANCE_FILTERS = 16
+
+Location = Tuple[float, float]
+FLOAT_DTYPES = {column.name: np.float64 for column in models.House.__table__.columns
+                if isinstance(column.type, Float)}
+
+
+@lru_cache(maxsize=None)
+def row_pipeline():
+    # data_pipeline (and with it pandas and scikit-learn) is on the PYTHONPATH of the service
+    from data_cleaning_transformers import LastKnownChangeColumnTransformer, WaterFrontColumnTransformer
+    from feature_enginneering_tranformers import CentreOfWealthColumnsTransformer, SqFtPriceColumnTransformer
+    from sklearn.pipeline import Pipeline
+
+    # The row-local steps of PreprocessingSeattleHousing, water_distance needs every waterfront house
+    return Pipeline(steps=[
+        ('waterfront', WaterFrontColumnTransformer()),
+        ('last_known_change', LastKnownChangeColumnTransformer()),
+        ('sqft_price', SqFtPriceColumnTransformer()),
+        ('center_of_wealth', CentreOfWealthColumnsTransformer()),
+    ])
+
+
+def water_reference(locations: Iterable[Location]):
+    import pandas as pd
+    from feature_enginneering_tranformers import WaterDistanceColumnTransformer
+
+    waterfront = pd.DataFrame(list(locations), columns=['long', 'lat'], dtype=np.float64).assign(waterfront=1.0)
+    return WaterDistanceColumnTransformer().partial_fit(waterfront)
+
+
+def nearest_water(reference, long: np.ndarray, lat: np.ndarray):
+    '''nearest_water returns the water_distance, water_long and water_lat of every location'''
+    if len(reference.reference_cos_) == 0:
+        return np.full(len(long), np.nan), np.full(len(long), np.nan), np.full(len(long), np.nan)
+    water_distance, nearest_idx = reference.nearest(long, lat)
+    found = nearest_idx >= 0
+    return (water_distance, np.where(found, reference.reference_long_[nearest_idx], np.nan),
+            np.where(found, reference.reference_lat_[nearest_idx], np.nan))
+
+
+def records(df: pd.DataFrame) -> List[dict]:
+    return df.astype(object).where(df.notna(), None).to_dict(orient="records")
+
+
+def in_batches(ids: List[int]):
+    for start in range(0, len(ids), FEATURE_ID_BATCH_SIZE):
+        yield ids[start:start + FEATURE_ID_BATCH_SIZE]
+
+
+def waterfront_locations(session: Session, house_ids: List[int]) -> Set[Location]:
+    '''waterfront_locations returns the locations of the waterfront houses among house_ids, it is
+    called before a write to know which waterfront locations the write removes'''
+    locations = set()
+    for batch in in_batches(house_ids):
+        locations.update(session.execute(select(models.House.long, models.House.lat).where(
+            models.House.id.in_(batch), models.House.waterfront == 1)).all())
+    return locations
+
+
+def all_waterfront_locations(session: Session) -> List[Location]:
+    return session.execute(select(models.House.long, models.House.lat).where(models.House.waterfront == 1)).all()
+
+
+def waterfront_fingerprint(session: Session) -> tuple:
+    '''waterfront_fingerprint summarises the waterfront locations seen by session in one aggregate
+    over the waterfront index, it changes with any waterfront house that is added, moved or removed'''
+    long, lat = models.House.long, models.House.lat
+    return tuple(session.execute(select(func.count(), func.sum(long), func.sum(lat), func.sum(long * lat)).where(
+        models.House.waterfront == 1)).one())
+
+
+class WaterReferenceCache:
+    '''WaterReferenceCache keeps the waterfront locations and their water_reference between writes.
+    Writes to non waterfront houses, the most frequent ones, reuse them after one aggregate query
+    instead of loading every waterfront house and building the KD-tree again. The fingerprint is
+    checked in the session of every call, so the writes of other workers and the uncommitted
+    writes of the session itself are seen.'''
+
+    def __init__(self):
+        self._fingerprint = None
+        self._entry = None
+        self._lock = threading.Lock()
+
+    def get(self, session: Session) -> Tuple[Set[Location], object]:
+        fingerprint = waterfront_fingerprint(session)
+        with self._lock:
+            if fingerprint == self._fingerprint:
+                return self._entry
+        locations = set(map(tuple, all_waterfront_locations(session)))
+        entry = (locations, water_reference(locations))
+        with self._lock:
+            self._fingerprint, self._entry = fingerprint, entry
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._fingerprint, self._entry = None, None
+
+
+water_references = WaterReferenceCache()
+
+
+def house_water_distance(session: Session, long: float, lat: float) -> float:
+    '''house_water_distance returns the water_distance of a location that is not stored, NaN
+    without waterfront houses'''
+    _, reference = water_references.get(session)
+    return float(nearest_water(reference, np.array([long]), np.array([lat]))[0][0])
+
+
+def compute_features(df_houses: pd.DataFrame, reference) -> pd.DataFrame:
+    # A Float column of rows with NULLs only (e.g. a house without a price) would be of object dtype
+    df_houses = df_houses.astype(FLOAT_DTYPES)
+    df_features = row_pipeline().transform(df_houses)
+    df_features['water_distance'], df_features['water_long'], df_features['water_lat'] = nearest_water(
+        reference, df_features['long'].to_numpy(dtype=np.float64), df_features['lat'].to_numpy(dtype=np.float64))
+    return df_features[['id'] + FEATURE_COLUMNS]
+
+
+def update_features(session: Session, house_ids: List[int], previous_waterfront: Set[Location]) -> Set[int]:
+    '''update_features brings the feature store up to date with a write to the houses house_ids that
+    is flushed but not committed. previous_waterfront are the waterfront locations of these houses
+    before the write (see waterfront_locations). It returns the ids of the houses whose features
+    were written, house_ids and the houses whose water_distance changed.'''
+    import pandas as pd
+
+    current_waterfront, reference = water_references.get(session)
+
+    # The written houses: features of deleted houses are removed, the others recomputed
+    houses = []
+    for batch in in_batches(house_ids):
+        session.execute(delete(models.HouseFeatures).where(models.HouseFeatures.id.in_(batch)))
+        result = session.execute(select(models.House.__table__).where(models.House.id.in_(batch)))
+        houses.append(pd.DataFrame(result.all(), columns=list(result.keys())))
+    df_houses = pd.concat(houses, ignore_index=True) if houses else pd.DataFrame()
+    if len(df_houses):
+        session.execute(insert(models.HouseFeatures), records(compute_features(df_houses, reference)))
+
+    changed = set(house_ids)
+    removed = previous_waterfront - current_waterfront
+    if removed:
+        changed.update(recompute_nearest_to_removed(session, reference, removed, house_ids))
+
+    written_waterfront = set() if df_houses.empty else set(
+        df_houses.loc[df_houses['waterfront'] == 1, ['long', 'lat']].itertuples(index=False, name=None))
+    added = written_waterfront - previous_waterfront
+    if added:
+        changed.update(recompute_nearer_to_added(session, added, house_ids))
+    return changed
+
+
+def other_houses(house_ids: List[int]):
+    statement = select(models.HouseFeatures.id, models.House.long, models.House.lat,
+                       models.HouseFeatures.water_distance).join(
+        models.House, models.House.id == models.HouseFeatures.id)
+    if len(house_ids) <= FEATURE_ID_BATCH_SIZE:
+        statement = statement.where(models.HouseFeatures.id.not_in(house_ids))
+    return statement
+
+
+def recompute_nearest_to_removed(session: Session, reference, removed: Set[Location],
+                                 house_ids: List[int]) -> List[int]:
+    import pandas as pd
+
+    # Only the houses nearest to a removed waterfront location can change
+    statement = other_houses(house_ids).where(or_(*(
+        and_(models.HouseFeatures.water_long == long, models.HouseFeatures.water_lat == lat)
+        for long, lat in removed)))
+    df_affected = pd.DataFrame(session.execute(statement).all(), columns=['id', 'long', 'lat', 'water_distance'])
+    if df_affected.empty:
+        return []
+    df_affected['water_distance'], df_affected['water_long'], df_affected['water_lat'] = nearest_water(
+        reference, df_affected['long'].to_numpy(dtype=np.float64), df_affected['lat'].to_numpy(dtype=np.float64))
+    return write_water_features(session, df_affected)
+
+
+def nearer_than_water(long: float, lat: float):
+    # dist() to the waterfront location at (long, lat) below the current water_distance, with a
+    # tolerance for rounding so that the exact comparison in NumPy decides borderline houses
+    from feature_enginneering_tranformers import KM_PER_DEGREE
+
+    delta_long = (models.House.long - long) * float(np.cos(np.radians(lat)))
+    delta_lat = models.House.lat - lat
+    return ((delta_long * delta_long + delta_lat * delta_lat) * float(KM_PER_DEGREE ** 2 * (1 - 1e-9))
+            < models.HouseFeatures.water_distance * models.HouseFeatures.water_distance)
+
+
+def recompute_nearer_to_added(session: Session, added: Set[Location], house_ids: List[int]) -> List[int]:
+    import pandas as pd
+    from feature_enginneering_tranformers import KM_PER_DEGREE
+
+    # A house can only get nearer to the water than its current water_distance, which bounds the
+    # area around the added locations that has to be searched
+    radius = session.scalar(select(func.max(models.HouseFeatures.water_distance)))
+    statement = other_houses(house_ids)
+    if radius is not None:
+        added_long, added_lat = np.array(list(added)).T
+        delta_lat = radius / KM_PER_DEGREE
+        max_lat = np.abs(added_lat).max() + delta_lat
+        delta_long = delta_lat / max(np.cos(np.radians(min(max_lat, 89.0))), 1e-6)
+        nearer = and_(models.House.lat.between(added_lat.min() - delta_lat, added_lat.max() + delta_lat),
+                      models.House.long.between(added_long.min() - delta_long, added_long.max() + delta_long))
+        if len(added) <= FEATURE_MAX_DISTANCE_FILTERS:
+            # Only the houses that get nearer to the water are read back
+            nearer = and_(nearer, or_(*(nearer_than_water(long, lat) for long, lat in added)))
+        statement = statement.where(or_(models.HouseFeatures.water_distance.is_(None), nearer))
+    df_candidates = pd.DataFrame(session.execute(statement).all(), columns=['id', 'long', 'lat', 'water_distance'])
+    if df_candidates.empty:
+        return []
+    water_distance, water_long, water_lat = nearest_water(
+        water_reference(added), df_candidates['long'].to_numpy(dtype=np.float64),
+        df_candidates['lat'].to_numpy(dtype=np.float64))
+    current = df_candidates['water_distance'].to_numpy(dtype=np.float64)
+    nearer = np.isnan(current) | (water_distance < current)
+    df_candidates = df_candidates[nearer].assign(
+        water_distance=water_distance[nearer], water_long=water_long[nearer], water_lat=water_lat[nearer])
+    return write_water_features(session, df_candidates)
+
+
+def write_water_features(session: Session, df_features: pd.DataFrame) -> List[int]:
+    if len(df_features):
+        # Bulk UPDATE by primary key, one executemany
+        session.execute(update(models.HouseFeatures),
+                        records(df_features[['id', 'water_distance', 'water_long', 'water_lat']]))
+    return df_features['id'].tolist()
+
+
+def rebuild_features(session: Session, batch_size: int = FEATURE_REBUILD_BATCH_SIZE) -> int:
+    '''rebuild_features recomputes the feature store from scratch, batch_size houses at a time'''
+    import pandas as pd
+
+    _, reference = water_references.get(session)
+    session.execute(delete(models.HouseFeatures))
+    rows = 0
+    result = session.execute(select(models.House.__table__).execution_options(yield_per=batch_size))
+    columns = list(result.keys())
+    for partition in result.partitions():
+        df_features = compute_features(pd.DataFrame(partition, columns=columns), reference)
+        session.execute(insert(models.HouseFeatures), records(df_features))
+        rows += len(df_features)
+    session.commit()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=FEATURE_REBUILD_BATCH_SIZE)
+    args = parser.parse_args()
+
+    from database import SessionLocal, engine
+    models.Base.metadata.create_all(bind=engine)
+    with SessionLocal() as session:
+        print(f"Rebuilt the features of {rebuild_features(session, args.batch_size)} houses")
+
+
+if __name__ == "__main__":
+    main()
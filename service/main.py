@@ -1,119 +1,517 @@
-from typing import List
+import asyncio
+from typing import List, Optional, Tuple, Union
 
+import database
 import models
 import schemas
-from database import SessionLocal, engine
-from fastapi import Depends, FastAPI, HTTPException
+from cache import house_cache
+from comps import COMPS_DEFAULT_K, COMPS_MAX_K, CompsIndex
+from fastapi import Depends, FastAPI, HTTPException, Query, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from features import house_water_distance, row_pipeline, update_features, waterfront_locations
+from migrate import create_schema, missing_tables
 from models import House
+from prediction import MicroBatcher, get_artifact, get_profiler, predict_houses
 from rich import print
-from sqlalchemy.exc import SQLAlchemyError
+from search import house_filters
+from serialization import HOUSE_COLUMNS, HOUSES_FAST_JSON, dumps_house, dumps_houses, ndjson_rows
+from sqlalchemy import insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from stats import update_zipcode_stats, zipcode_rows, zipcode_summary
+from warmup import WarmUp
 
 app = FastAPI()
 
-models.Base.metadata.create_all(bind=engine)
+houses_cache = house_cache()
+
+comps_index = CompsIndex()
+# The task building comps_index, started by the warm-up or by the first comps request
+comps_loading: Optional[asyncio.Future] = None
+
+# Concurrent single predictions are scored together in one vectorized DataFrame transform
+predict_batcher = MicroBatcher(predict_houses)
+
+
+async def warm_up_database():
+    # Importing the service does not connect, this is the first time the database is used
+    if database.DB_CREATE_SCHEMA:
+        await run_in_threadpool(create_schema)
+        return
+    missing = await run_in_threadpool(missing_tables)
+    if missing:
+        raise RuntimeError(f"Missing tables {', '.join(missing)}, run service/migrate.py")
+
+
+async def warm_up_comps_index():
+    await get_comps_index()
+
+
+async def warm_up_feature_pipeline():
+    # Imports pandas and scikit-learn, which writes would otherwise do on the first request
+    await run_in_threadpool(row_pipeline)
+
+
+async def warm_up_model():
+    try:
+        await run_in_threadpool(get_artifact)
+    except (OSError, ValueError) as e:
+        print(e)
+        return "unavailable"
+
+
+# Ready once the database can be used, the other steps are done in the background afterwards
+warm_up = WarmUp([("database", warm_up_database), ("comps_index", warm_up_comps_index),
+                  ("feature_pipeline", warm_up_feature_pipeline), ("model", warm_up_model)],
+                 required=["database"])
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    warm_up.start()
+
+
+@app.on_event("shutdown")
+async def close_warm_up():
+    await warm_up.close()
+
+
+@app.on_event("shutdown")
+async def close_predict_batcher():
+    await predict_batcher.close()
+
+
+@app.on_event("shutdown")
+async def dispose_async_engine():
+    if database.DB_ASYNC:
+        await database.async_engine.dispose()
 
 
 # Dependency
-def get_db():
+async def get_db():
+    if database.DB_ASYNC:
+        async with database.AsyncSessionLocal() as session:
+            yield session
+    else:
+        # run_db closes sync sessions in the worker thread that used them
+        yield database.SessionLocal()
+
+
+DBSession = Union[Session, AsyncSession]
+
+
+def run_closing(work, session: Session, *args):
+    try:
+        return work(session, *args)
+    finally:
+        # Returns the connection to the pool before the worker thread is released, a handler
+        # waiting for a thread while holding a connection could otherwise starve the pool
+        session.close()
+
+
+async def run_db(session: DBSession, work, *args, cpu_bound: bool = False):
+    '''run_db runs work(session, *args) with a sync Session: through the async driver without
+    leaving the event loop in async mode, otherwise in the threadpool. Work that is cpu_bound, e.g.
+    the pandas updates of the features, runs in the threadpool on a sync Session in both modes.'''
+    if not isinstance(session, AsyncSession):
+        return await run_in_threadpool(run_closing, work, session, *args)
+    if cpu_bound:
+        # run_sync would block the event loop for the whole work, the sync engine is used instead
+        return await run_in_threadpool(run_closing, work, database.SessionLocal(), *args)
+    try:
+        return await session.run_sync(work, *args)
+    except SQLAlchemyError:
+        await session.rollback()
+        raise
+
+
+HOUSES_PAGE_LIMIT = 100
+HOUSES_MAX_PAGE_LIMIT = 1000
+HOUSES_STREAM_BATCH_SIZE = 1000
+
+
+def stream_statement(after_id: Optional[int]):
+    statement = select(*HOUSE_COLUMNS) if HOUSES_FAST_JSON else select(models.House)
+    statement = statement.order_by(models.House.id)
+    if after_id is not None:
+        statement = statement.where(models.House.id > after_id)
+    # yield_per fetches the rows from a server-side cursor in batches
+    return statement.execution_options(yield_per=HOUSES_STREAM_BATCH_SIZE)
+
+
+def ndjson(houses):
+    if HOUSES_FAST_JSON:
+        return ndjson_rows(houses)
+    return "".join(schemas.HouseModel.from_orm(house).json() + "\n" for house in houses)
+
+
+def stream_houses_ndjson(after_id: Optional[int]):
+    # The stream outlives the request handler, so it owns its session
+    session = database.SessionLocal()
     try:
-        db = SessionLocal()
-        yield db
+        result = session.execute(stream_statement(after_id))
+        for partition in (result if HOUSES_FAST_JSON else result.scalars()).partitions():
+            yield ndjson(partition)
     finally:
-        db.close()
+        session.close()
+
+
+async def stream_houses_ndjson_async(after_id: Optional[int]):
+    async with database.AsyncSessionLocal() as session:
+        result = await session.stream(stream_statement(after_id))
+        async for partition in (result if HOUSES_FAST_JSON else result.scalars()).partitions():
+            yield ndjson(partition)
+
+
+@app.get("/houses/stream")
+def stream_houses(after_id: Optional[int] = None):
+    stream = stream_houses_ndjson_async if database.DB_ASYNC else stream_houses_ndjson
+    return StreamingResponse(stream(after_id), media_type="application/x-ndjson")
+
+
+def house_page(session: Session, filters, limit: int, after_id: Optional[int]):
+    # Keyset pagination: the next page starts after the last id of this one
+    statement = select(*HOUSE_COLUMNS) if HOUSES_FAST_JSON else select(models.House)
+    statement = statement.where(*filters).order_by(models.House.id)
+    if after_id is not None:
+        statement = statement.where(models.House.id > after_id)
+    result = session.execute(statement.limit(limit))
+    return result.all() if HOUSES_FAST_JSON else result.scalars().all()
+
+
+def page_response(response: Response, houses: list, limit: int):
+    headers = {"X-Next-Cursor": str(houses[-1].id)} if len(houses) == limit else {}
+    if HOUSES_FAST_JSON:
+        # Returned as is, FastAPI neither validates the rows nor applies the headers of response
+        return Response(content=dumps_houses(houses), media_type="application/json", headers=headers)
+    response.headers.update(headers)
+    return houses
+
+
+@app.get("/houses/search", response_model=List[schemas.HouseModel])
+async def search_houses(response: Response, search: schemas.HouseSearch = Depends(),
+                        limit: int = Query(HOUSES_PAGE_LIMIT, gt=0, le=HOUSES_MAX_PAGE_LIMIT),
+                        after_id: Optional[int] = None, session: DBSession = Depends(get_db)):
+    if search.radius_km is not None and (search.lat is None or search.long is None):
+        raise HTTPException(status_code=422, detail="radius_km requires lat and long")
+    try:
+        houses = await run_db(session, house_page, house_filters(search), limit, after_id)
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=500, detail="Database error occurred")
+    return page_response(response, houses, limit)
+
+
+def read_house(session: Session, house_id: int):
+    if HOUSES_FAST_JSON:
+        return session.execute(select(*HOUSE_COLUMNS).where(models.House.id == house_id)).first()
+    return session.get(models.House, house_id)
 
 
 @app.get("/houses/{house_id}", response_model=schemas.HouseModel)
-def get_house(house_id: int, session: Session = Depends(get_db)):
+async def get_house(house_id: int, session: DBSession = Depends(get_db)):
+    cached = await houses_cache.get(house_id)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    version = await houses_cache.version(house_id)
     try:
-        house = session.query(models.House).get(house_id)
-        if house:
-            return house
-        else:
-            raise HTTPException(status_code=404, detail="House not found")
+        house = await run_db(session, read_house, house_id)
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=500, detail="Database error occurred")
+    if house:
+        content = dumps_house(house) if HOUSES_FAST_JSON else schemas.HouseModel.from_orm(house).json()
+        await houses_cache.set(house_id, content, version)
+        return Response(content=content, media_type="application/json")
+    else:
+        raise HTTPException(status_code=404, detail="House not found")
+
+
+@app.get("/houses/{house_id}/features", response_model=schemas.HouseFeaturesModel)
+async def get_house_features(house_id: int, session: DBSession = Depends(get_db)):
+    try:
+        features = await run_db(session, lambda session: session.get(models.HouseFeatures, house_id))
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=500, detail="Database error occurred")
+    if features:
+        return features
+    else:
+        raise HTTPException(status_code=404, detail="Features not found")
+
+
+async def load_comps_index():
+    async for session in get_db():
+        await run_db(session, comps_index.load, cpu_bound=True)
+
+
+async def get_comps_index() -> CompsIndex:
+    global comps_loading
+    if not comps_index.loaded:
+        # A single load runs at a time, a failed one is retried by the next request
+        if comps_loading is None or comps_loading.done():
+            comps_loading = asyncio.ensure_future(load_comps_index())
+        try:
+            await asyncio.shield(comps_loading)
+        except SQLAlchemyError as e:
+            raise HTTPException(status_code=500, detail="Database error occurred")
+    return comps_index
+
+
+def comp_houses(session: Session, comps: List[Tuple[int, float]]):
+    house_ids = [house_id for house_id, _ in comps]
+    houses = {house.id: house for house in session.query(models.House).filter(models.House.id.in_(house_ids))}
+    # Nearest first, a house deleted by another worker since it was indexed is skipped
+    return [schemas.CompModel(distance=distance, house=houses[house_id])
+            for house_id, distance in comps if house_id in houses]
+
+
+@app.get("/houses/{house_id}/comps", response_model=List[schemas.CompModel])
+async def get_house_comps(house_id: int, k: int = Query(COMPS_DEFAULT_K, gt=0, le=COMPS_MAX_K),
+                          session: DBSession = Depends(get_db)):
+    index = await get_comps_index()
+    comps = index.query_house(house_id, k)
+    if comps is None:
+        raise HTTPException(status_code=404, detail="House not found")
+    try:
+        return await run_db(session, comp_houses, comps)
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=500, detail="Database error occurred")
+
+
+@app.post("/houses/comps", response_model=List[schemas.CompModel])
+async def find_comps(request: schemas.HouseModel, k: int = Query(COMPS_DEFAULT_K, gt=0, le=COMPS_MAX_K),
+                     session: DBSession = Depends(get_db)):
+    index = await get_comps_index()
+
+    def comps(session: Session):
+        # The house is not stored, its water_distance is computed against the stored waterfront houses
+        water_distance = house_water_distance(session, request.long, request.lat)
+        return comp_houses(session, index.query(dict(request.dict(), water_distance=water_distance), k))
+
+    try:
+        return await run_db(session, comps, cpu_bound=True)
     except SQLAlchemyError as e:
-        session.rollback()
         raise HTTPException(status_code=500, detail="Database error occurred")
-    finally:
-        session.close()
 
 
 @app.get("/houses", response_model=List[schemas.HouseModel])
-def get_houses(session: Session = Depends(get_db)):
+async def get_houses(response: Response, limit: int = Query(HOUSES_PAGE_LIMIT, gt=0, le=HOUSES_MAX_PAGE_LIMIT),
+                     after_id: Optional[int] = None, session: DBSession = Depends(get_db)):
     try:
-        houses = session.query(models.House).all()
-        return houses
+        houses = await run_db(session, house_page, [], limit, after_id)
     except SQLAlchemyError as e:
-        session.rollback()
         raise HTTPException(status_code=500, detail="Database error occurred")
-    finally:
-        session.close()
+    return page_response(response, houses, limit)
+
+
+def add_house(session: Session, house: models.House):
+    session.add(house)
+    session.flush()
+    changed = update_features(session, [house.id], set())
+    update_zipcode_stats(session, [house.id])
+    session.commit()
+    session.refresh(house)
+    comps_index.refresh(session, changed)
+    return house
 
 
 @app.post("/house", response_model=schemas.HouseModel)
-def create_house(request: schemas.HouseModel, session: Session = Depends(get_db)):
+async def create_house(request: schemas.HouseModel, session: DBSession = Depends(get_db)):
     try:
-        house = models.House(**request.dict())
-        session.add(house)
-        session.commit()
-        session.refresh(house)
-        return house
+        house = await run_db(session, add_house, models.House(**request.dict()), cpu_bound=True)
     except SQLAlchemyError as e:
         print(e)
-        session.rollback()
         raise HTTPException(status_code=500, detail="Database error occurred")
-    finally:
-        session.close()
+    await houses_cache.invalidate([house.id])
+    return house
+
+
+def insert_statement(session: Session, upsert: bool):
+    statement = insert(models.House)
+    if not upsert:
+        return statement
+    # Re-imported ids overwrite the existing rows
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        statement = postgresql.insert(models.House)
+    elif dialect == "sqlite":
+        statement = sqlite.insert(models.House)
+    else:
+        raise HTTPException(status_code=400, detail=f"Upsert is not supported on {dialect}")
+    columns = [column.name for column in models.House.__table__.columns if not column.primary_key]
+    return statement.on_conflict_do_update(
+        index_elements=["id"], set_={column: statement.excluded[column] for column in columns})
+
+
+def is_duplicate_key(error: IntegrityError) -> bool:
+    '''is_duplicate_key tells a primary key (or unique) violation from the other integrity errors,
+    e.g. NOT NULL violations'''
+    # SQLSTATE unique_violation on PostgreSQL (psycopg2 and asyncpg), the message on SQLite
+    code = getattr(error.orig, "pgcode", None) or getattr(error.orig, "sqlstate", None)
+    if code is not None:
+        return code == "23505"
+    return "UNIQUE constraint failed" in str(error.orig)
 
 
-@app.post("/houses", response_model=list[schemas.HouseModel])
-def create_houses(houses: List[schemas.HouseModel], session: Session = Depends(get_db)):
+def insert_houses(session: Session, rows: List[dict], upsert: bool, batch_size: int):
+    statement = insert_statement(session, upsert)
+    house_ids = [row["id"] for row in rows]
+    previous_waterfront = waterfront_locations(session, house_ids) if upsert else set()
+    previous_stats = zipcode_rows(session, house_ids) if upsert else None
+    # All batches are sent as executemany in one transaction
+    for start in range(0, len(rows), batch_size):
+        session.execute(statement, rows[start:start + batch_size])
+    changed = update_features(session, house_ids, previous_waterfront)
+    update_zipcode_stats(session, house_ids, previous_stats)
+    session.commit()
+    comps_index.refresh(session, changed)
+
+
+@app.post("/houses", response_model=schemas.BulkInsertResult)
+async def create_houses(houses: List[schemas.HouseModel], upsert: bool = False,
+                        batch_size: int = Query(1000, gt=0), session: DBSession = Depends(get_db)):
+    rows = [house.dict() for house in houses]
+    if upsert:
+        # ON CONFLICT DO UPDATE cannot write a row twice in one statement (PostgreSQL raises a
+        # CardinalityViolation), the last house of an id wins as if they were written one by one
+        rows = list({row["id"]: row for row in rows}.values())
     try:
-        for house in houses:
-            house = models.House(**house.dict())
-            session.add(house)            
-            session.commit()
-            session.refresh(house)
-        return houses
+        await run_db(session, insert_houses, rows, upsert, batch_size, cpu_bound=True)
+    except IntegrityError as e:
+        print(e)
+        if is_duplicate_key(e):
+            raise HTTPException(status_code=409, detail="House already exists, use upsert=true to overwrite it")
+        raise HTTPException(status_code=422, detail="Houses violate a constraint of the database")
     except SQLAlchemyError as e:
         print(e)
-        session.rollback()
         raise HTTPException(status_code=500, detail="Database error occurred")
-    finally:
-        session.close()
+    # Upserts overwrite houses that may be cached
+    await houses_cache.invalidate([house.id for house in houses])
+    # The batches are written in one transaction, all of the houses or none of them
+    return schemas.BulkInsertResult(received=len(houses), batches=-(-len(rows) // batch_size), upsert=upsert)
 
 
 @app.put("/houses/{house_id}", response_model=schemas.HouseModelUpdate)
-def update_house(house_id: int, request: schemas.HouseModelUpdate, session: Session = Depends(get_db)):
-    try:
-        house = session.query(models.House).get(house_id)
+async def update_house(house_id: int, request: schemas.HouseModelUpdate, session: DBSession = Depends(get_db)):
+    def update(session: Session):
+        house = session.get(models.House, house_id)
         if house:
+            previous_waterfront = waterfront_locations(session, [house_id])
+            previous_stats = zipcode_rows(session, [house_id])
             for key, value in request.dict().items():
                 setattr(house, key, value)
+            session.flush()
+            changed = update_features(session, [house_id], previous_waterfront)
+            update_zipcode_stats(session, [house_id], previous_stats)
             session.commit()
             session.refresh(house)
-            return house
-        else:
-            raise HTTPException(status_code=404, detail="House not found")
+            comps_index.refresh(session, changed)
+        return house
+
+    try:
+        house = await run_db(session, update, cpu_bound=True)
     except SQLAlchemyError as e:
-        session.rollback()
         raise HTTPException(status_code=500, detail="Database error occurred")
-    finally:
-        session.close()
+    if house:
+        await houses_cache.invalidate([house_id])
+        return house
+    else:
+        raise HTTPException(status_code=404, detail="House not found")
 
 
 @app.delete("/houses/{house_id}", response_model=dict)
-def delete_house(house_id: int, session: Session = Depends(get_db)):
-    try:
-        house = session.query(models.House).get(house_id)
+async def delete_house(house_id: int, session: DBSession = Depends(get_db)):
+    def delete(session: Session):
+        house = session.get(models.House, house_id)
         if house:
+            previous_waterfront = waterfront_locations(session, [house_id])
+            previous_stats = zipcode_rows(session, [house_id])
             session.delete(house)
+            session.flush()
+            changed = update_features(session, [house_id], previous_waterfront)
+            update_zipcode_stats(session, [house_id], previous_stats)
             session.commit()
-            return {"message": "House deleted successfully"}
-        else:
-            raise HTTPException(status_code=404, detail="House not found")
+            comps_index.refresh(session, changed)
+        return house
+
+    try:
+        house = await run_db(session, delete, cpu_bound=True)
     except SQLAlchemyError as e:
-        session.rollback()
         raise HTTPException(status_code=500, detail="Database error occurred")
-    finally:
-        session.close()
+    if house:
+        await houses_cache.invalidate([house_id])
+        return {"message": "House deleted successfully"}
+    else:
+        raise HTTPException(status_code=404, detail="House not found")
+
+
+@app.get("/stats/zipcodes", response_model=List[schemas.ZipcodeStatsModel])
+async def get_zipcode_stats(session: DBSession = Depends(get_db)):
+    def read(session: Session):
+        return [zipcode_summary(row) for row in session.scalars(
+            select(models.ZipcodeStats).order_by(models.ZipcodeStats.zipcode))]
+
+    try:
+        return await run_db(session, read)
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=500, detail="Database error occurred")
+
+
+@app.get("/stats/zipcodes/{zipcode}", response_model=schemas.ZipcodeStatsModel)
+async def get_zipcode(zipcode: int, session: DBSession = Depends(get_db)):
+    def read(session: Session):
+        row = session.get(models.ZipcodeStats, zipcode)
+        return zipcode_summary(row) if row is not None else None
+
+    try:
+        stats = await run_db(session, read)
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=500, detail="Database error occurred")
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Zipcode not found")
+    return stats
+
+
+@app.get("/ready", response_model=schemas.ReadinessModel)
+async def get_ready(response: Response):
+    # A failed warm-up step is retried by the next readiness check
+    warm_up.start()
+    if not warm_up.ready:
+        response.status_code = 503
+    return warm_up.report()
+
+
+@app.get("/cache/stats", response_model=schemas.CacheStats)
+async def get_cache_stats():
+    return await houses_cache.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    # Prometheus text format, the pipeline step metrics are only recorded with PIPELINE_PROFILING set
+    profiler = get_profiler()
+    return PlainTextResponse(profiler.prometheus() if profiler is not None else "",
+                             media_type="text/plain; version=0.0.4")
+
+
+def get_model():
+    try:
+        return get_artifact()
+    except (OSError, ValueError) as e:
+        print(e)
+        raise HTTPException(status_code=503, detail="Model not available")
+
+
+@app.post("/predict", response_model=schemas.PredictionModel, dependencies=[Depends(get_model)])
+async def predict(request: schemas.HouseModel):
+    price = await predict_batcher.submit(request.dict())
+    return schemas.PredictionModel(id=request.id, price=price)
+
+
+@app.post("/predict/batch", response_model=List[schemas.PredictionModel], dependencies=[Depends(get_model)])
+async def predict_batch(houses: List[schemas.HouseModel]):
+    if not houses:
+        return []
+    prices = await run_in_threadpool(predict_houses, [house.dict() for house in houses])
+    return [schemas.PredictionModel(id=house.id, price=price) for house, price in zip(houses, prices)]
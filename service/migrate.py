@@ -0,0 +1,33 @@
+'''Schema migration of the service: creates the tables and indexes of models.py that do not exist
+yet, existing tables are left as they are. The service runs it on startup unless DB_CREATE_SCHEMA
+is off, deployments that start many replicas turn it off and run it once before rolling them out:
+
+    python service/migrate.py
+'''
+import argparse
+from typing import List
+
+import models
+from database import get_engine
+from sqlalchemy import inspect
+
+
+def create_schema(engine=None):
+    models.Base.metadata.create_all(bind=engine if engine is not None else get_engine())
+
+
+def missing_tables(engine=None) -> List[str]:
+    existing = set(inspect(engine if engine is not None else get_engine()).get_table_names())
+    return [table for table in models.Base.metadata.tables if table not in existing]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+
+    create_schema()
+    print(f"Created the missing tables of {', '.join(models.Base.metadata.tables)}")
+
+
+if __name__ == "__main__":
+    main()
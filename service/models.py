@@ -1,4 +1,4 @@
-from sqlalchemy import BigInteger, Column, Float, Integer, String
+from sqlalchemy import BigInteger, Column, Float, Index, Integer, String
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -6,18 +6,24 @@ Base = declarative_base()
 class House(Base):
     __tablename__ = 'houses'
 
+    __table_args__ = (
+        # /houses/search: zipcode with an optional price range, and bounding boxes on lat/long
+        Index('ix_houses_zipcode_price', 'zipcode', 'price'),
+        Index('ix_houses_lat_long', 'lat', 'long'),
+    )
+
     id = Column(BigInteger, primary_key=True)
     date = Column(String, nullable=True)
-    price = Column(Float)
-    bedrooms = Column(Integer)
+    price = Column(Float, index=True)
+    bedrooms = Column(Integer, index=True)
     bathrooms = Column(Float)
     sqft_living = Column(Integer)
     sqft_lot = Column(Integer)
     floors = Column(Float)
-    waterfront = Column(Float)
+    waterfront = Column(Float, index=True)
     view = Column(Float)
     condition = Column(Integer)
-    grade = Column(Integer)
+    grade = Column(Integer, index=True)
     sqft_above = Column(Integer)
     sqft_basement = Column(Float)
     yr_built = Column(Integer)
@@ -27,3 +33,40 @@ class House(Base):
     long = Column(Float)
     sqft_living15 = Column(Integer)
     sqft_lot15 = Column(Integer)
+
+
+class HouseFeatures(Base):
+    '''Engineered features of a house, kept up to date on every write (see features.py)'''
+    __tablename__ = 'house_features'
+
+    __table_args__ = (
+        Index('ix_house_features_water_long_lat', 'water_long', 'water_lat'),
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    last_known_change = Column(Integer)
+    sqft_price = Column(Float)
+    delta_lat = Column(Float)
+    delta_long = Column(Float)
+    center_distance = Column(Float)
+    # The nearest waterfront location, a house nearest to a removed one is all that is recomputed
+    water_distance = Column(Float, index=True)
+    water_long = Column(Float)
+    water_lat = Column(Float)
+
+
+class ZipcodeStats(Base):
+    '''Market aggregates of the houses of a zipcode, kept up to date on every write (see stats.py)'''
+    __tablename__ = 'zipcode_stats'
+
+    zipcode = Column(Integer, primary_key=True)
+    count = Column(Integer)
+    # Houses without a price are counted, but not in the mean price
+    price_count = Column(Integer)
+    price_sum = Column(Float)
+    sqft_price_sum = Column(Float)
+    sqft_price_count = Column(Integer)
+    waterfront_count = Column(Integer)
+    # Mergeable sketches as JSON {bin: count}: log-spaced price bins (stats.QuantileSketch), grades
+    price_sketch = Column(String)
+    grade_counts = Column(String)
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from functools import lru_cache
+from typing import TYPE_CHECKING, Callable, List
+
+from starlette.concurrency import run_in_threadpool
+
+if TYPE_CHECKING:
+    # pandas and scikit-learn are imported with the artifact, on first use or by the warm-up
+    import pandas as pd
+
+# Scoring of houses with the persisted preprocessing pipeline and model (data_pipeline/artifact.py)
+
+MODEL_PATH = os.getenv("MODEL_PATH", "model/artifact")
+PREDICT_MAX_BATCH_SIZE = int(os.getenv("PREDICT_MAX_BATCH_SIZE", "64"))
+PREDICT_MAX_WAIT_MS = float(os.getenv("PREDICT_MAX_WAIT_MS", "2"))
+# Per-step profiling of the scoring pipeline, exposed on /metrics: unset (off), time, tracemalloc or cprofile
+PIPELINE_PROFILING = os.getenv("PIPELINE_PROFILING")
+
+
+@lru_cache(maxsize=None)
+def get_artifact():
+    # data_pipeline (and with it pandas and scikit-learn) is on the PYTHONPATH of the service
+    import schemas
+    from artifact import load_artifact
+    return load_artifact(MODEL_PATH, schema=schemas.BaseHouseModel)
+
+
+@lru_cache(maxsize=None)
+def get_profiler():
+    if not PIPELINE_PROFILING:
+        return None
+    from profiling import StepProfiler
+    return StepProfiler(PIPELINE_PROFILING)
+
+
+def houses_to_frame(houses: List[dict]) -> pd.DataFrame:
+    import pandas as pd
+
+    df_houses = pd.DataFrame.from_records(houses)
+    # Optional fields that are None in every house of a batch would otherwise be object columns
+    for column in df_houses.columns.drop("date", errors="ignore"):
+        df_houses[column] = pd.to_numeric(df_houses[column])
+    return df_houses
+
+
+def predict_houses(houses: List[dict]) -> List[float]:
+    if not houses:
+        # An empty frame has none of the columns the pipeline reads
+        return []
+    return get_artifact().predict(houses_to_frame(houses), profiler=get_profiler()).tolist()
+
+
+class MicroBatcher:
+    '''MicroBatcher coalesces concurrent calls to submit into calls of predict_batch with up to
+    max_batch_size items. A batch is closed when it is full or max_wait_ms after its first item
+    arrived, and predict_batch runs in the threadpool so the event loop keeps accepting requests.
+    When a batch fails, its items are scored again one by one, so that only the calls whose item
+    fails get the exception.'''
+
+    def __init__(self, predict_batch: Callable[[list], list],
+                 max_batch_size: int = PREDICT_MAX_BATCH_SIZE, max_wait_ms: float = PREDICT_MAX_WAIT_MS):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue = None
+        self._worker = None
+
+    async def submit(self, item):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            items = [item for item, _ in batch]
+            try:
+                results = await run_in_threadpool(self.predict_batch, items)
+            except Exception as e:
+                if len(batch) == 1:
+                    self._set_exception(batch[0][1], e)
+                else:
+                    await self._run_one_by_one(batch)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def _run_one_by_one(self, batch):
+        for item, future in batch:
+            try:
+                result = (await run_in_threadpool(self.predict_batch, [item]))[0]
+            except Exception as e:
+                self._set_exception(future, e)
+                continue
+            if not future.done():
+                future.set_result(result)
+
+    @staticmethod
+    def _set_exception(future, e: Exception):
+        # The caller may have given up waiting (e.g. a cancelled request)
+        if not future.done():
+            future.set_exception(e)
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 
 from pydantic import BaseModel, Field
 
@@ -25,6 +25,10 @@ class BaseHouseModel(BaseModel):
     sqft_living15: int
     sqft_lot15: int
 
+    class Config:
+        # NaN and infinite values are rejected with 422, the model cannot score them
+        allow_inf_nan = False
+
 
 class HouseModel(BaseHouseModel):
     id: int
@@ -37,3 +41,85 @@ class HouseModelUpdate(BaseHouseModel):
 
     class Config:
         orm_mode = True
+
+
+class HouseFeaturesModel(BaseModel):
+    id: int
+    last_known_change: Optional[int]
+    sqft_price: Optional[float]
+    delta_lat: Optional[float]
+    delta_long: Optional[float]
+    center_distance: Optional[float]
+    water_distance: Optional[float]
+    water_long: Optional[float]
+    water_lat: Optional[float]
+
+    class Config:
+        orm_mode = True
+
+
+class CompModel(BaseModel):
+    # Distance in the similarity space of comps.CompsIndex, not in km
+    distance: float
+    house: HouseModel
+
+
+class ZipcodeStatsModel(BaseModel):
+    zipcode: int
+    count: int
+    mean_price: Optional[float]
+    # Within stats.STATS_PRICE_ACCURACY of the exact median
+    median_price: Optional[float]
+    mean_sqft_price: Optional[float]
+    waterfront_share: float
+    median_grade: Optional[float]
+
+
+class PredictionModel(BaseModel):
+    id: int
+    price: float
+
+
+class BulkInsertResult(BaseModel):
+    received: int
+    batches: int
+    upsert: bool
+
+
+class CacheStats(BaseModel):
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+    maxsize: Optional[int]
+    ttl: Optional[float]
+
+
+class WarmUpStepModel(BaseModel):
+    name: str
+    # pending, running, done, failed or unavailable
+    state: str
+    required: bool
+    seconds: Optional[float]
+    error: Optional[str]
+
+
+class ReadinessModel(BaseModel):
+    ready: bool
+    steps: List[WarmUpStepModel]
+
+
+class HouseSearch(BaseModel):
+    zipcode: Optional[int]
+    min_price: Optional[float]
+    max_price: Optional[float]
+    bedrooms: Optional[int]
+    min_grade: Optional[int]
+    waterfront: Optional[bool]
+    min_lat: Optional[float] = Field(None, ge=-90, le=90)
+    max_lat: Optional[float] = Field(None, ge=-90, le=90)
+    min_long: Optional[float] = Field(None, ge=-180, le=180)
+    max_long: Optional[float] = Field(None, ge=-180, le=180)
+    lat: Optional[float] = Field(None, ge=-90, le=90)
+    long: Optional[float] = Field(None, ge=-180, le=180)
+    radius_km: Optional[float] = Field(None, gt=0)
@@ -0,0 +1,52 @@
+import math
+from typing import List
+
+import models
+import schemas
+
+# Filters of /houses/search, each one can be served by an index of models.House
+
+
+def house_filters(search: schemas.HouseSearch) -> List:
+    House = models.House
+    filters = []
+    if search.zipcode is not None:
+        filters.append(House.zipcode == search.zipcode)
+    if search.min_price is not None:
+        filters.append(House.price >= search.min_price)
+    if search.max_price is not None:
+        filters.append(House.price <= search.max_price)
+    if search.bedrooms is not None:
+        filters.append(House.bedrooms == search.bedrooms)
+    if search.min_grade is not None:
+        filters.append(House.grade >= search.min_grade)
+    if search.waterfront is not None:
+        filters.append(House.waterfront == float(search.waterfront))
+
+    # Bounding box
+    if search.min_lat is not None:
+        filters.append(House.lat >= search.min_lat)
+    if search.max_lat is not None:
+        filters.append(House.lat <= search.max_lat)
+    if search.min_long is not None:
+        filters.append(House.long >= search.min_long)
+    if search.max_long is not None:
+        filters.append(House.long <= search.max_long)
+
+    # Radius around (lat, long): the enclosing bounding box uses the lat/long index, the
+    # distance itself is checked on the remaining rows
+    if search.radius_km is not None:
+        # Imported on first use, the data pipeline loads pandas and scikit-learn
+        from feature_enginneering_tranformers import KM_PER_DEGREE
+
+        delta_lat = float(search.radius_km / KM_PER_DEGREE)
+        # Bounded at the poles, where a radius covers every longitude
+        longitude_scale = max(math.cos(math.radians(search.lat)), 1e-6)
+        delta_long = delta_lat / longitude_scale
+        filters += [
+            House.lat.between(search.lat - delta_lat, search.lat + delta_lat),
+            House.long.between(search.long - delta_long, search.long + delta_long),
+            ((House.long - search.long) * longitude_scale) * ((House.long - search.long) * longitude_scale)
+            + (House.lat - search.lat) * (House.lat - search.lat) <= delta_lat * delta_lat,
+        ]
+    return filters
@@ -0,0 +1,39 @@
+'''Fast serialization path of the house read endpoints, enabled with HOUSES_FAST_JSON.
+
+By default the endpoints load House instances, which FastAPI validates against schemas.HouseModel
+one by one and encodes with the json module. With HOUSES_FAST_JSON the houses are fetched as plain
+row tuples of HOUSE_FIELDS and encoded by orjson in one call. The rows are not validated again,
+every write validated them against schemas.HouseModel already. The responses decode to the same
+houses, with the keys in the same order.
+'''
+import os
+from typing import Iterable
+
+import models
+import schemas
+
+HOUSES_FAST_JSON = os.getenv("HOUSES_FAST_JSON", "false").lower() in ("1", "true", "yes")
+
+HOUSE_FIELDS = list(schemas.HouseModel.__fields__)
+HOUSE_COLUMNS = [models.House.__table__.c[field] for field in HOUSE_FIELDS]
+
+if HOUSES_FAST_JSON:
+    # orjson is only needed when the fast path is enabled
+    import orjson
+
+
+def house_dicts(rows: Iterable[tuple]) -> list:
+    return [dict(zip(HOUSE_FIELDS, row)) for row in rows]
+
+
+def dumps_houses(rows: Iterable[tuple]) -> bytes:
+    '''dumps_houses encodes rows of HOUSE_COLUMNS as a JSON list of houses'''
+    return orjson.dumps(house_dicts(rows))
+
+
+def dumps_house(row: tuple) -> bytes:
+    return orjson.dumps(dict(zip(HOUSE_FIELDS, row)))
+
+
+def ndjson_rows(rows: Iterable[tuple]) -> bytes:
+    return b"".join(orjson.dumps(house) + b"\n" for house in house_dicts(rows))
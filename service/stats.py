@@ -0,0 +1,241 @@
+'''Zipcode market aggregates: count, mean and median price, mean sqft_price, share of waterfront
+houses and median grade of every zipcode, in the zipcode_stats table.
+
+Every write to houses applies its difference to the rows of the zipcodes it touches, in the same
+transaction: the previous values of the written houses are subtracted and the new ones added. The
+medians come from sketches that can be merged and subtracted, so they never need a rescan: a
+histogram of the grades and a QuantileSketch of the prices. Reading the stats of a zipcode is one
+primary key lookup. A rebuild from the houses, e.g. to backfill an existing database, is explicit:
+
+    PYTHONPATH=data_pipeline python service/stats.py --batch-size 10000
+'''
+import argparse
+import json
+import math
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+import models
+from features import in_batches
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+# Relative error of the price quantiles
+STATS_PRICE_ACCURACY = 0.01
+STATS_REBUILD_BATCH_SIZE = 10000
+
+STATS_COLUMNS = ['zipcode', 'price', 'sqft_price', 'waterfront', 'grade']
+
+
+def load_counts(value: Optional[str]) -> Counter:
+    return Counter({int(key): count for key, count in json.loads(value or "{}").items()})
+
+
+def dump_counts(counts: Dict[int, int]) -> str:
+    return json.dumps({str(key): count for key, count in sorted(counts.items()) if count > 0})
+
+
+class QuantileSketch:
+    '''QuantileSketch counts positive values in logarithmic bins, the bin i holding the values in
+    (gamma^(i-1), gamma^i] with gamma = (1 + accuracy) / (1 - accuracy). Any quantile is known
+    within a relative error of accuracy, and unlike sampling sketches the counts can be merged
+    and subtracted exactly, which is what keeps the medians correct when houses are updated or
+    deleted.'''
+
+    def __init__(self, accuracy: float = STATS_PRICE_ACCURACY, bins: Optional[Dict[int, int]] = None):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.bins = Counter(bins or {})
+
+    def __len__(self):
+        return sum(self.bins.values())
+
+    def bin_key(self, value: float) -> int:
+        # Values below 1 share the bin of 1
+        return math.ceil(math.log(max(value, 1.0)) / math.log(self.gamma))
+
+    def update(self, bins: Dict[int, int], sign: int = 1):
+        for key, count in bins.items():
+            self.bins[key] += sign * count
+        self.bins = Counter({key: count for key, count in self.bins.items() if count > 0})
+
+    def quantile(self, q: float) -> Optional[float]:
+        '''quantile interpolates between the values at the ranks around q * (len - 1), like pandas'''
+        total = len(self)
+        if total == 0:
+            return None
+        rank = q * (total - 1)
+        lower, upper = self._value_at(math.floor(rank)), self._value_at(math.ceil(rank))
+        return lower + (upper - lower) * (rank - math.floor(rank))
+
+    def _value_at(self, rank: int) -> float:
+        seen = 0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                # The value of the bin with the least relative error to all of the bin
+                return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def to_json(self) -> str:
+        return dump_counts(self.bins)
+
+    @classmethod
+    def from_json(cls, value: Optional[str], accuracy: float = STATS_PRICE_ACCURACY) -> 'QuantileSketch':
+        return cls(accuracy, load_counts(value))
+
+
+def median_of_counts(counts: Dict[int, int]) -> Optional[float]:
+    # The exact median of a histogram, the mean of the two middle values for an even count
+    total = sum(counts.values())
+    if total == 0:
+        return None
+    ranks, middle, seen = [(total - 1) // 2, total // 2], [], 0
+    for key in sorted(counts):
+        seen += counts[key]
+        while ranks and ranks[0] < seen:
+            middle.append(key)
+            ranks.pop(0)
+    return sum(middle) / 2
+
+
+def stats_statement():
+    House, HouseFeatures = models.House, models.HouseFeatures
+    return select(House.zipcode, House.price, HouseFeatures.sqft_price, House.waterfront, House.grade).outerjoin(
+        HouseFeatures, HouseFeatures.id == House.id)
+
+
+def zipcode_rows(session: Session, house_ids: List[int]) -> List[tuple]:
+    '''zipcode_rows returns the STATS_COLUMNS of the houses house_ids, it is called before a write to
+    know what the write removes from the aggregates, and after it to know what it adds'''
+    rows = []
+    for batch in in_batches(house_ids):
+        rows += session.execute(stats_statement().where(models.House.id.in_(batch))).all()
+    return rows
+
+
+def aggregate(rows: Iterable[tuple], sketch: QuantileSketch) -> Dict[int, dict]:
+    '''aggregate returns the partial aggregates of every zipcode of rows (see STATS_COLUMNS)'''
+    aggregates = {}
+    for zipcode, price, sqft_price, waterfront, grade in rows:
+        if zipcode is None:
+            continue
+        partial = aggregates.get(zipcode)
+        if partial is None:
+            partial = aggregates[zipcode] = dict(count=0, price_count=0, price_sum=0.0, sqft_price_sum=0.0,
+                                                 sqft_price_count=0, waterfront_count=0, price_bins=Counter(),
+                                                 grade_counts=Counter())
+        partial['count'] += 1
+        if price is not None:
+            partial['price_count'] += 1
+            partial['price_sum'] += price
+            partial['price_bins'][sketch.bin_key(price)] += 1
+        if sqft_price is not None:
+            partial['sqft_price_sum'] += sqft_price
+            partial['sqft_price_count'] += 1
+        partial['waterfront_count'] += waterfront == 1
+        if grade is not None:
+            partial['grade_counts'][grade] += 1
+    return aggregates
+
+
+def insert_missing_statement(session: Session):
+    '''insert_missing_statement returns an INSERT of zipcode_stats rows that leaves the existing rows
+    as they are, None on databases without ON CONFLICT'''
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        statement = postgresql.insert(models.ZipcodeStats)
+    elif dialect == "sqlite":
+        statement = sqlite.insert(models.ZipcodeStats)
+    else:
+        return None
+    return statement.on_conflict_do_nothing(index_elements=["zipcode"])
+
+
+def empty_stats(zipcode: int) -> dict:
+    return dict(zipcode=zipcode, count=0, price_count=0, price_sum=0.0, sqft_price_sum=0.0, sqft_price_count=0,
+                waterfront_count=0)
+
+
+def merge_aggregates(session: Session, aggregates: Dict[int, dict], sign: int, sketch_accuracy: float):
+    '''merge_aggregates adds (sign=1) or subtracts (sign=-1) partial aggregates from the
+    zipcode_stats rows, a zipcode without houses left is removed'''
+    if not aggregates:
+        return
+    statement = insert_missing_statement(session)
+    if statement is not None:
+        # Concurrent writes to the same new zipcode all end up updating one row instead of failing
+        # on its primary key, the row locks below then serialise them
+        session.execute(statement, [empty_stats(zipcode) for zipcode in aggregates])
+    stats = {row.zipcode: row for row in session.scalars(
+        select(models.ZipcodeStats).where(models.ZipcodeStats.zipcode.in_(list(aggregates))).with_for_update())}
+    for zipcode, partial in aggregates.items():
+        row = stats.get(zipcode)
+        if row is None:
+            row = models.ZipcodeStats(**empty_stats(zipcode))
+            session.add(row)
+        row.count += sign * partial['count']
+        row.price_count += sign * partial['price_count']
+        row.price_sum += sign * partial['price_sum']
+        row.sqft_price_sum += sign * partial['sqft_price_sum']
+        row.sqft_price_count += sign * partial['sqft_price_count']
+        row.waterfront_count += sign * partial['waterfront_count']
+        price_sketch = QuantileSketch.from_json(row.price_sketch, sketch_accuracy)
+        price_sketch.update(partial['price_bins'], sign)
+        row.price_sketch = price_sketch.to_json()
+        grade_counts = load_counts(row.grade_counts)
+        for grade, count in partial['grade_counts'].items():
+            grade_counts[grade] += sign * count
+        row.grade_counts = dump_counts(grade_counts)
+        if row.count <= 0:
+            session.delete(row)
+    session.flush()
+
+
+def update_zipcode_stats(session: Session, house_ids: List[int], previous: Optional[List[tuple]] = None,
+                         sketch_accuracy: float = STATS_PRICE_ACCURACY):
+    '''update_zipcode_stats brings zipcode_stats up to date with a write to the houses house_ids that
+    is flushed, with its features, but not committed. previous are the zipcode_rows of these
+    houses before the write, None for houses that did not exist.'''
+    sketch = QuantileSketch(sketch_accuracy)
+    if previous:
+        merge_aggregates(session, aggregate(previous, sketch), -1, sketch_accuracy)
+    merge_aggregates(session, aggregate(zipcode_rows(session, house_ids), sketch), 1, sketch_accuracy)
+
+
+def zipcode_summary(row: models.ZipcodeStats, sketch_accuracy: float = STATS_PRICE_ACCURACY) -> dict:
+    grade_counts = load_counts(row.grade_counts)
+    return dict(zipcode=row.zipcode, count=row.count,
+                mean_price=row.price_sum / row.price_count if row.price_count else None,
+                median_price=QuantileSketch.from_json(row.price_sketch, sketch_accuracy).quantile(0.5),
+                mean_sqft_price=row.sqft_price_sum / row.sqft_price_count if row.sqft_price_count else None,
+                waterfront_share=row.waterfront_count / row.count, median_grade=median_of_counts(grade_counts))
+
+
+def rebuild_zipcode_stats(session: Session, batch_size: int = STATS_REBUILD_BATCH_SIZE,
+                          sketch_accuracy: float = STATS_PRICE_ACCURACY) -> int:
+    '''rebuild_zipcode_stats recomputes zipcode_stats from the houses and their features, batch_size
+    houses at a time'''
+    session.execute(delete(models.ZipcodeStats))
+    sketch = QuantileSketch(sketch_accuracy)
+    rows = 0
+    for partition in session.execute(stats_statement().execution_options(yield_per=batch_size)).partitions():
+        merge_aggregates(session, aggregate(partition, sketch), 1, sketch_accuracy)
+        rows += len(partition)
+    session.commit()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=STATS_REBUILD_BATCH_SIZE)
+    args = parser.parse_args()
+
+    from database import SessionLocal, engine
+    models.Base.metadata.create_all(bind=engine)
+    with SessionLocal() as session:
+        print(f"Rebuilt the zipcode stats of {rebuild_zipcode_stats(session, args.batch_size)} houses")
+
+
+if __name__ == "__main__":
+    main()
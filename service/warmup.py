@@ -0,0 +1,60 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Iterable, List, Optional, Tuple
+
+# Background warm-up of the service, reported by /ready
+
+WarmUpStep = Callable[[], Awaitable[Optional[str]]]
+
+
+class WarmUp:
+    '''WarmUp runs named steps one after the other in a background task and records the state of
+    every step: pending, running, done, failed or the state a step returns instead of done (e.g.
+    unavailable). The service is ready once the required steps are done, the other steps only
+    spare their first request the wait. A failed required step ends the run, the steps after it may
+    depend on it, a failed optional one does not. The next start runs the failed steps again.'''
+
+    def __init__(self, steps: List[Tuple[str, WarmUpStep]], required: Iterable[str] = ()):
+        self.steps = dict(steps)
+        self.required = set(required)
+        self.states = {name: "pending" for name in self.steps}
+        self.errors = {}
+        self.seconds = {}
+        self._task = None
+
+    @property
+    def ready(self) -> bool:
+        return all(self.states[name] == "done" for name in self.required)
+
+    def start(self):
+        '''start runs the pending and failed steps in the background, unless they are already running'''
+        if self._task is not None and not self._task.done():
+            return
+        if any(state in ("pending", "failed") for state in self.states.values()):
+            self._task = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        for name, step in self.steps.items():
+            if self.states[name] not in ("pending", "failed"):
+                continue
+            self.states[name] = "running"
+            start = time.perf_counter()
+            try:
+                self.states[name] = await step() or "done"
+                self.errors.pop(name, None)
+            except Exception as e:
+                self.states[name] = "failed"
+                self.errors[name] = f"{type(e).__name__}: {e}"
+            self.seconds[name] = time.perf_counter() - start
+            if self.states[name] == "failed" and name in self.required:
+                return
+
+    def report(self) -> dict:
+        return dict(ready=self.ready, steps=[
+            dict(name=name, state=self.states[name], required=name in self.required, seconds=self.seconds.get(name),
+                 error=self.errors.get(name)) for name in self.steps])
@@ -1,6 +1,114 @@
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
 import pytest
 
+SERVICE_DIR = Path(__file__).resolve().parents[1] / "service"
+
+
+def use_service(db_conn="sqlite://"):
+    '''use_service makes the service modules importable, like benchmarks/common.py, connected to
+    db_conn (by default an in-memory SQLite database) unless DB_CONN is already set'''
+    os.environ.setdefault("DB_CONN", db_conn)
+    if str(SERVICE_DIR) not in sys.path:
+        sys.path.insert(0, str(SERVICE_DIR))
+
+
+@pytest.fixture
+def service_session():
+    '''A session on an empty in-memory SQLite database with the tables of the service'''
+    use_service()
+    import models
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from sqlalchemy.pool import StaticPool
+
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(bind=engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+def wait_for_warm_up(client, timeout=60):
+    '''wait_for_warm_up waits until the background warm-up of the service (see /ready) is over'''
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        steps = client.get("/ready").json()["steps"]
+        if all(step["state"] not in ("pending", "running") for step in steps):
+            return steps
+        time.sleep(0.01)
+    raise RuntimeError("The warm-up of the service did not finish")
+
+
+def reset_service(tmp_path, monkeypatch, db_async=False):
+    '''reset_service points the service at an empty SQLite file database in tmp_path, through the
+    async driver with db_async, without a model, and gives it fresh caches, comps index, micro-batcher
+    and warm-up'''
+    use_service()
+    import cache
+    import comps
+    import database
+    import features
+    import main
+    import prediction
+    import warmup
+
+    monkeypatch.setattr(database, "SQLALCHEMY_DATABASE_URL", f"sqlite:///{tmp_path / 'houses.db'}")
+    monkeypatch.setattr(database, "DB_ASYNC", db_async)
+    monkeypatch.setattr(prediction, "MODEL_PATH", str(tmp_path / "missing-artifact"))
+    monkeypatch.setattr(main, "houses_cache", cache.HouseCache(cache.LRUBackend()))
+    monkeypatch.setattr(main, "comps_index", comps.CompsIndex())
+    monkeypatch.setattr(main, "comps_loading", None)
+    monkeypatch.setattr(main, "predict_batcher", prediction.MicroBatcher(prediction.predict_houses))
+    monkeypatch.setattr(main, "warm_up", warmup.WarmUp(list(main.warm_up.steps.items()), main.warm_up.required))
+    features.water_references.clear()
+    clear_service_caches()
+    return main
+
+
+def clear_service_caches():
+    import database
+    import prediction
+
+    if database.get_engine.cache_info().currsize:
+        database.get_engine().dispose()
+    for factory in (database.get_engine, database.get_session_factory, database.get_async_engine,
+                    database.get_async_session_factory, prediction.get_artifact):
+        factory.cache_clear()
+
+
+@pytest.fixture(params=["sync", "async"])
+def service_client(request, tmp_path, monkeypatch):
+    '''A TestClient of the service on an empty SQLite file database, warmed up, with sync and
+    async sessions'''
+    from fastapi.testclient import TestClient
+
+    main = reset_service(tmp_path, monkeypatch, db_async=request.param == "async")
+    with TestClient(main.app) as client:
+        wait_for_warm_up(client)
+        yield client
+    clear_service_caches()
+
+
+def random_houses(n, seed=0, start_id=1) -> list:
+    '''random_houses returns n rows of the houses table around Seattle, one in five on the water'''
+    rng = np.random.default_rng(seed)
+    return [dict(
+        id=start_id + i, date=f"{rng.integers(1, 13)}/{rng.integers(1, 29)}/2015",
+        price=float(rng.integers(100, 3000) * 1000), bedrooms=int(rng.integers(1, 6)),
+        bathrooms=float(rng.integers(1, 4)), sqft_living=int(rng.integers(500, 5000)),
+        sqft_lot=int(rng.integers(1000, 20000)), floors=1.0, waterfront=float(rng.random() < 0.2),
+        view=0.0, condition=3, grade=int(rng.integers(5, 12)), sqft_above=1000, sqft_basement=0.0,
+        yr_built=int(rng.integers(1900, 2015)), yr_renovated=float(rng.choice([0, 2000])),
+        zipcode=int(rng.choice([98004, 98038, 98103])), lat=float(rng.uniform(47.2, 47.8)),
+        long=float(rng.uniform(-122.5, -121.8)), sqft_living15=1500, sqft_lot15=5000)
+        for i in range(n)]
+
 
 @pytest.fixture(scope="session")
 def house_input_file_path(tmp_path_factory):
@@ -0,0 +1,50 @@
+import json
+
+import numpy as np
+import pytest
+from artifact import (MANIFEST_FILE, HousePriceArtifact, load_artifact,
+                      save_artifact)
+from fixtures import house_input_file_path, use_service
+from preprocessing import DROP_COLUMNS, PreprocessingSeattleHousing, load_data
+from pydantic import BaseModel
+from sklearn.linear_model import LinearRegression
+
+use_service()
+# The schema the service loads its artifact with
+from schemas import BaseHouseModel  # noqa: E402
+
+
+class TestHousePriceArtifact:
+
+    @pytest.fixture
+    def artifact_path(self, house_input_file_path, tmp_path):
+        preprocessor = PreprocessingSeattleHousing()
+        dataset = preprocessor.preprocess_fit_transform(load_data(house_input_file_path))
+        features = [x for x in dataset.columns if x not in DROP_COLUMNS + ['id']]
+        model = LinearRegression().fit(dataset[features], dataset['price'])
+        return save_artifact(tmp_path / "artifact", preprocessor, model, features)
+
+    def test_load_artifact(self, artifact_path, house_input_file_path):
+        artifact = load_artifact(artifact_path, schema=BaseHouseModel)
+        input_data = load_data(house_input_file_path)
+
+        water_distance = artifact.preprocessor.feature_enginneering.named_steps['water_distance']
+
+        assert isinstance(artifact, HousePriceArtifact)
+        assert isinstance(water_distance.reference_lat_, np.memmap)
+        np.testing.assert_allclose(artifact.predict(input_data), input_data['price'])
+
+    def test_load_artifact_schema_mismatch(self, artifact_path):
+        class IncompleteSchema(BaseModel):
+            price: float
+
+        with pytest.raises(ValueError, match="missing"):
+            load_artifact(artifact_path, schema=IncompleteSchema)
+
+    def test_load_artifact_version_mismatch(self, artifact_path):
+        manifest = json.loads((artifact_path / MANIFEST_FILE).read_text())
+        manifest['version'] = 0
+        (artifact_path / MANIFEST_FILE).write_text(json.dumps(manifest))
+
+        with pytest.raises(ValueError, match="version"):
+            load_artifact(artifact_path)
@@ -0,0 +1,104 @@
+import asyncio
+import os
+import time
+
+import pytest
+from fixtures import use_service
+
+use_service()
+from cache import HouseCache, LRUBackend, RedisBackend  # noqa: E402
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture(params=["lru", "redis"])
+def backend(request):
+    if request.param == "lru":
+        return LRUBackend(maxsize=3, ttl=None)
+    # A Redis server to test against, its keys under the test prefix are removed
+    pytest.importorskip("redis")
+    url = os.getenv("HOUSE_CACHE_TEST_URL")
+    if not url:
+        pytest.skip("HOUSE_CACHE_TEST_URL is not set")
+    backend = RedisBackend(url, ttl=None, prefix=f"test-house-{os.getpid()}:")
+    run(backend.clear())
+    return backend
+
+
+class TestHouseCache:
+
+    def test_read_through(self, backend):
+        cache = HouseCache(backend)
+
+        async def read():
+            assert await cache.get(1) is None
+            await cache.set(1, b'{"id": 1}', await cache.version(1))
+            assert await cache.get(1) == b'{"id": 1}'
+            return await cache.stats()
+        stats = run(read())
+        assert (stats['hits'], stats['misses'], stats['size']) == (1, 1, 1)
+
+    def test_invalidate(self, backend):
+        cache = HouseCache(backend)
+
+        async def write():
+            await cache.set(1, b'old', await cache.version(1))
+            await cache.set(2, b'other', await cache.version(2))
+            await cache.invalidate([1])
+            return await cache.get(1), await cache.get(2)
+        assert run(write()) == (None, b'other')
+
+    def test_read_racing_with_a_write_is_not_cached(self, backend):
+        cache = HouseCache(backend)
+
+        async def race():
+            # The read takes the version, a write commits and invalidates, the read then caches
+            # the house it read before the write
+            version = await cache.version(1)
+            await cache.invalidate([1])
+            await cache.set(1, b'stale', version)
+            assert await cache.get(1) is None
+            await cache.set(1, b'fresh', await cache.version(1))
+            return await cache.get(1)
+        assert run(race()) == b'fresh'
+
+    def test_clear(self, backend):
+        cache = HouseCache(backend)
+
+        async def clear():
+            for house_id in (1, 2):
+                await cache.set(house_id, b'house', await cache.version(house_id))
+            await cache.clear()
+            return await cache.get(1), await cache.get(2), (await cache.stats())['size']
+        assert run(clear()) == (None, None, 0)
+
+
+class TestLRUBackend:
+
+    def test_eviction(self):
+        backend = LRUBackend(maxsize=2, ttl=None)
+
+        async def fill():
+            await backend.set(1, b'1')
+            await backend.set(2, b'2')
+            # 1 is used again, 2 is the least recently used house
+            await backend.get(1)
+            await backend.set(3, b'3')
+            return [await backend.get(key) for key in (1, 2, 3)]
+        assert run(fill()) == [b'1', None, b'3']
+        assert backend.evictions == 1
+
+    def test_ttl(self, monkeypatch):
+        backend = LRUBackend(maxsize=2, ttl=10)
+        run(backend.set(1, b'1'))
+        monotonic = time.monotonic()
+        monkeypatch.setattr(time, "monotonic", lambda: monotonic + 11)
+        assert run(backend.get(1)) is None
+        assert backend.evictions == 1
+
+    def test_disabled(self):
+        backend = LRUBackend(maxsize=0)
+        run(backend.set(1, b'1'))
+        assert run(backend.get(1)) is None
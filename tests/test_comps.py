@@ -0,0 +1,164 @@
+import numpy as np
+import pytest
+from fixtures import random_houses, service_session, use_service
+
+use_service()
+import comps  # noqa: E402
+import features  # noqa: E402
+import models  # noqa: E402
+from comps import COLUMNS, CompsIndex, comps_statement, to_arrays  # noqa: E402
+from sqlalchemy import insert, select  # noqa: E402
+
+
+def brute_force(index, session, values, k, exclude=None):
+    '''brute_force ranks every stored house by its distance to values, scaled like the index'''
+    ids, stored = to_arrays(session.execute(comps_statement()).all())
+    distances = np.linalg.norm(index._points(stored) - index._points(values[np.newaxis]), axis=1)
+    distances, ids = distances[ids != exclude], ids[ids != exclude]
+    nearest = np.argsort(distances, kind='stable')[:k]
+    return ids[nearest].tolist(), distances[nearest]
+
+
+def stored_values(session, house_id):
+    return to_arrays(session.execute(comps_statement().where(models.House.id == house_id)).all())[1][0]
+
+
+def assert_matches_brute_force(index, session, k=10):
+    house_ids = session.scalars(select(models.House.id)).all()
+    assert len(index) == len(house_ids)
+    for house_id in house_ids[::7]:
+        values = stored_values(session, house_id)
+        ids, distances = zip(*index.query_house(house_id, k))
+        expected_ids, expected_distances = brute_force(index, session, values, k, exclude=house_id)
+        assert list(ids) == expected_ids
+        np.testing.assert_allclose(distances, expected_distances)
+
+        ids, distances = zip(*index.query(dict(zip(COLUMNS, values)), k))
+        expected_ids, expected_distances = brute_force(index, session, values, k)
+        assert list(ids) == expected_ids
+        np.testing.assert_allclose(distances, expected_distances)
+
+
+def write(session, index, house_ids, change):
+    # Like the endpoints: the features are updated in the transaction, the index once it is committed
+    previous_waterfront = features.waterfront_locations(session, house_ids)
+    change()
+    session.flush()
+    changed = features.update_features(session, house_ids, previous_waterfront)
+    session.commit()
+    index.refresh(session, changed)
+
+
+def set_house(session, index, house_id, **values):
+    def change():
+        house = session.get(models.House, house_id)
+        for key, value in values.items():
+            setattr(house, key, value)
+    write(session, index, [house_id], change)
+
+
+def delete_house(session, index, house_id):
+    write(session, index, [house_id], lambda: session.delete(session.get(models.House, house_id)))
+
+
+@pytest.fixture
+def houses(service_session):
+    features.water_references.clear()
+    service_session.execute(insert(models.House), random_houses(200))
+    features.rebuild_features(service_session)
+    return service_session
+
+
+class TestCompsIndex:
+
+    def test_load(self, houses):
+        index = CompsIndex()
+        index.load(houses, batch_size=64)
+        assert index.loaded
+        assert_matches_brute_force(index, houses)
+
+    def test_random_writes(self, houses):
+        # A small rebuild size rebuilds the tree a few times along the way
+        index = CompsIndex(min_rebuild_size=8, rebuild_fraction=0.0)
+        index.load(houses)
+        rng = np.random.default_rng(3)
+        next_id = 201
+        rebuilds = 0
+        for step in range(60):
+            tree = index._tree
+            house_ids = houses.scalars(select(models.House.id)).all()
+            operation = rng.choice(["create", "update", "move", "delete"])
+            if operation == "create":
+                new_houses = random_houses(int(rng.integers(1, 4)), seed=step, start_id=next_id)
+                next_id += len(new_houses)
+                write(houses, index, [house['id'] for house in new_houses],
+                      lambda: houses.execute(insert(models.House), new_houses))
+            elif operation == "update":
+                set_house(houses, index, int(rng.choice(house_ids)), sqft_living=int(rng.integers(500, 5000)),
+                          grade=int(rng.integers(5, 12)))
+            elif operation == "move":
+                set_house(houses, index, int(rng.choice(house_ids)), lat=float(rng.uniform(47.2, 47.8)),
+                          long=float(rng.uniform(-122.5, -121.8)), waterfront=float(rng.random() < 0.5))
+            else:
+                deleted = int(rng.choice(house_ids))
+                delete_house(houses, index, deleted)
+                assert index.query_house(deleted) is None
+            rebuilds += index._tree is not tree
+            if step % 10 == 9:
+                assert_matches_brute_force(index, houses)
+        assert rebuilds > 0
+        assert_matches_brute_force(index, houses)
+
+    def test_exclude(self, houses):
+        index = CompsIndex()
+        index.load(houses)
+        house = houses.get(models.House, 1)
+        # A second house at the same place with the same features is at distance 0
+        twin = dict(random_houses(1)[0], id=1000)
+        write(houses, index, [1000], lambda: houses.execute(insert(models.House), [twin]))
+
+        comps_of_house = index.query_house(house.id, 5)
+        assert house.id not in [house_id for house_id, _ in comps_of_house]
+        assert comps_of_house[0] == (1000, 0.0)
+        # A house that is not stored is not excluded
+        assert sorted(house_id for house_id, _ in index.query(dict(zip(COLUMNS, stored_values(houses, 1))), 2)) == [
+            1, 1000]
+
+    def test_writes_during_load_are_applied(self, houses, monkeypatch):
+        index = CompsIndex()
+        house_ids = houses.scalars(select(models.House.id)).all()
+        updated, deleted = house_ids[0], house_ids[1]
+        calls = []
+
+        def to_arrays_during_write(rows):
+            # The first batch is read, a write is committed and refreshed before the load is done
+            if not calls:
+                calls.append(1)
+                set_house(houses, index, updated, sqft_living=9000, grade=13)
+                delete_house(houses, index, deleted)
+                assert index._pending == {updated, deleted}
+            return to_arrays(rows)
+
+        monkeypatch.setattr(comps, "to_arrays", to_arrays_during_write)
+        index.load(houses, batch_size=len(house_ids))
+
+        assert index._pending is None
+        assert index.query_house(deleted) is None
+        assert_matches_brute_force(index, houses)
+
+    def test_refresh_before_load_is_ignored(self, houses):
+        index = CompsIndex()
+        set_house(houses, index, 1, sqft_living=9000)
+        assert len(index) == 0
+        index.load(houses)
+        assert_matches_brute_force(index, houses)
+
+
+class TestHouseWaterDistance:
+
+    def test_reuses_the_water_reference(self, houses, monkeypatch):
+        features.house_water_distance(houses, -122.2, 47.5)
+        monkeypatch.setattr(features, "water_reference", None)
+        long, lat = houses.execute(select(models.House.long, models.House.lat).where(
+            models.House.waterfront == 1)).first()
+        assert features.house_water_distance(houses, long, lat) == 0.0
@@ -7,10 +7,29 @@ from data_cleaning_transformers import (DropExtraneousColumnsTransformer,
                                         LastKnownChangeColumnTransformer,
                                         SqftColumnTransformer,
                                         ViewColumnTransformer,
-                                        WaterFrontColumnTransformer)
+                                        WaterFrontColumnTransformer,
+                                        fill_missing)
 from pandas.testing import assert_frame_equal, assert_series_equal
 
 
+class TestFillMissing:
+
+    def test_fill_missing(self):
+        input_data = pd.DataFrame({'view': [1.0, np.nan, 3.0]})
+
+        transformed_X = fill_missing(input_data, 'view', 0)
+
+        assert_frame_equal(transformed_X, pd.DataFrame({'view': [1.0, 0.0, 3.0]}))
+
+    def test_fill_missing_keeps_clean_column(self):
+        input_data = pd.DataFrame({'view': [1.0, 2.0, 3.0]})
+        values = input_data['view'].to_numpy()
+
+        transformed_X = fill_missing(input_data, 'view', 0)
+
+        assert np.shares_memory(transformed_X['view'].to_numpy(), values)
+
+
 class TestViewColumnTransformer:
 
     @pytest.mark.parametrize("input_data, expected_output", [
@@ -47,6 +66,12 @@ class TestLastKnownChangeColumnTransformer:
         pd.DataFrame({'yr_renovated': [0, np.nan, 2000],
                       'yr_built': [1980, 1990, 2010],
                       'last_known_change': [1980, 1990, 2000]})
+    ), (
+        pd.DataFrame({'yr_renovated': [1991.7, 0.0, np.nan],
+                      'yr_built': [1950.0, 1960.0, 1970.0]}),
+        pd.DataFrame({'yr_renovated': [1991.7, 0.0, np.nan],
+                      'yr_built': [1950.0, 1960.0, 1970.0],
+                      'last_known_change': [1991.0, 1960.0, 1970.0]})
     )])
     def test_transform(self, input_data, expected_output):
         transformer = LastKnownChangeColumnTransformer()
@@ -97,3 +122,29 @@ class TestSqftColumnTransformer:
 
         for value in results['sqft_basement']:
             assert type(value == np.float64)
+
+
+class TestCopyContract:
+
+    @pytest.fixture
+    def input_data(self):
+        return pd.DataFrame({'view': [1, np.nan, 3],
+                             'waterfront': [np.nan, 1, 0],
+                             'sqft_living': [1000, 1500, 1200],
+                             'sqft_above': [800, 1000, 900],
+                             'sqft_basement': ['200', '?', '300'],
+                             'yr_renovated': [0, np.nan, 2000],
+                             'yr_built': [1980, 1990, 2010]})
+
+    @pytest.mark.parametrize("transformer_class", [ViewColumnTransformer,
+                                                   WaterFrontColumnTransformer,
+                                                   SqftColumnTransformer,
+                                                   LastKnownChangeColumnTransformer,
+                                                   DropExtraneousColumnsTransformer])
+    def test_transform_does_not_modify_input(self, transformer_class, input_data):
+        original = input_data.copy()
+
+        transformed_X = transformer_class().transform(input_data)
+
+        assert_frame_equal(input_data, original)
+        assert_frame_equal(transformer_class(copy=False).transform(input_data), transformed_X)
@@ -1,10 +1,16 @@
+import pickle
+
 import numpy as np
 import pandas as pd
 import pytest
+from data_cleaning_transformers import SqftColumnTransformer
 from feature_enginneering_tranformers import (CentreOfWealthColumnsTransformer,
+                                              FusedArithmeticTransformer,
+                                              GeoClusterColumnsTransformer,
                                               SqFtPriceColumnTransformer,
                                               WaterDistanceColumnTransformer)
 from pandas.testing import assert_frame_equal, assert_series_equal
+from sklearn.exceptions import NotFittedError
 
 
 class TestSqFtPriceColumnTransformer:
@@ -55,6 +61,80 @@ class TestWaterDistanceColumnTransformer:
 
         assert pytest.approx(distance, 0.001) == expected_distance
 
+    @pytest.mark.parametrize("algorithm", WaterDistanceColumnTransformer.ALGORITHMS)
+    def test_transform_matches_dist(self, algorithm):
+        rng = np.random.default_rng(42)
+        input_data = pd.DataFrame({
+            'lat': rng.uniform(47.15, 47.78, 500),
+            'long': rng.uniform(-122.52, -121.31, 500),
+            'waterfront': np.where(rng.random(500) < 0.05, 1.0, np.nan)
+        })
+        transformer = WaterDistanceColumnTransformer(algorithm=algorithm, chunk_size=64)
+        water_list = input_data.query('waterfront == 1')
+
+        transformed_X = transformer.fit_transform(input_data)
+
+        expected_distance = [min(transformer.dist(long, lat, ref_long, ref_lat)
+                                 for ref_long, ref_lat in zip(water_list.long, water_list.lat))
+                             for long, lat in zip(input_data.long, input_data.lat)]
+        np.testing.assert_allclose(transformed_X['water_distance'], expected_distance, rtol=1e-12)
+
+    @pytest.mark.parametrize("algorithm", WaterDistanceColumnTransformer.ALGORITHMS)
+    def test_nearest(self, algorithm):
+        rng = np.random.default_rng(42)
+        input_data = pd.DataFrame({
+            'lat': rng.uniform(47.15, 47.78, 500),
+            'long': rng.uniform(-122.52, -121.31, 500),
+            'waterfront': np.where(rng.random(500) < 0.05, 1.0, np.nan)
+        })
+        input_data.loc[0, 'lat'] = np.nan
+        transformer = WaterDistanceColumnTransformer(algorithm=algorithm, chunk_size=64).fit(input_data)
+
+        water_distance, nearest_idx = transformer.nearest(input_data['long'], input_data['lat'])
+
+        assert np.isnan(water_distance[0]) and nearest_idx[0] == -1
+        expected_distance = transformer.dist(input_data['long'][1:], input_data['lat'][1:],
+                                             transformer.reference_long_[nearest_idx[1:]],
+                                             transformer.reference_lat_[nearest_idx[1:]])
+        np.testing.assert_allclose(water_distance[1:], expected_distance, rtol=1e-12)
+        np.testing.assert_allclose(water_distance, transformer.transform(input_data)['water_distance'])
+
+    def test_transform_uses_fitted_reference_set(self, transformer):
+        reference = pd.DataFrame({'lat': [47.5], 'long': [-122.2], 'waterfront': [1.0]})
+        houses = pd.DataFrame({'lat': [47.5, 47.6], 'long': [-122.2, -122.2], 'waterfront': [0.0, 0.0]})
+
+        transformed_X = transformer.fit(reference).transform(houses)
+
+        assert transformed_X['water_distance'][0] == 0.0
+        assert pytest.approx(transformed_X['water_distance'][1]) == transformer.dist(-122.2, 47.6, -122.2, 47.5)
+
+    def test_partial_fit(self, transformer):
+        input_data = pd.DataFrame({'lat': [47.5, 47.6, 47.7, 47.5],
+                                   'long': [-122.2, -122.3, -122.1, -122.2],
+                                   'waterfront': [1.0, 0.0, 1.0, 1.0]})
+
+        for start in range(0, len(input_data), 2):
+            transformer.partial_fit(input_data[start:start + 2])
+        fitted = WaterDistanceColumnTransformer().fit(input_data)
+
+        np.testing.assert_array_equal(transformer.reference_lat_, fitted.reference_lat_)
+        np.testing.assert_array_equal(transformer.reference_long_, fitted.reference_long_)
+        assert_series_equal(transformer.transform(input_data.copy())['water_distance'],
+                            fitted.transform(input_data.copy())['water_distance'])
+
+    def test_fitted_state_is_persistable(self, transformer):
+        input_data = pd.DataFrame({'lat': [47.5, 47.6, 47.7], 'long': [-122.2, -122.3, -122.1],
+                                   'waterfront': [1.0, 0.0, 1.0]})
+        transformer.fit(input_data)
+
+        restored = pickle.loads(pickle.dumps(transformer))
+
+        assert_frame_equal(restored.transform(input_data), transformer.transform(input_data))
+
+    def test_fit_without_waterfront_houses(self, transformer):
+        with pytest.raises(ValueError):
+            transformer.fit(pd.DataFrame({'lat': [47.5], 'long': [-122.2], 'waterfront': [0.0]}))
+
 
 class TestCentreOfWealthColumnsTransformer:
 
@@ -78,3 +158,172 @@ class TestCentreOfWealthColumnsTransformer:
         transformed_X = transformer.transform(input_data)
 
         assert_frame_equal(transformed_X, expected_output)
+
+    def test_transform_does_not_modify_input(self):
+        input_data = pd.DataFrame({'lat': [47.62774, 47.61905], 'long': [-122.24194, -122.34568]})
+        original = input_data.copy()
+
+        transformed_X = CentreOfWealthColumnsTransformer().transform(input_data)
+        assert_frame_equal(input_data, original)
+
+        assert CentreOfWealthColumnsTransformer(copy=False).transform(input_data) is input_data
+        assert_frame_equal(input_data, transformed_X)
+
+    def test_fit_fixed_centre(self):
+        input_data = pd.DataFrame({'lat': [47.61905, 47.63232], 'long': [-122.34568, -122.23314]})
+
+        transformer = CentreOfWealthColumnsTransformer().fit(input_data)
+
+        assert transformer.centre_latitude_ == CentreOfWealthColumnsTransformer.CENTRE_LATITUDE
+        assert transformer.centre_longitude_ == CentreOfWealthColumnsTransformer.CENTRE_LONGITUDE
+        assert_frame_equal(transformer.transform(input_data),
+                           CentreOfWealthColumnsTransformer().transform(input_data))
+
+    def test_fit_price_weighted_centre(self):
+        input_data = pd.DataFrame({'lat': [47.6, 47.7, 47.5],
+                                   'long': [-122.2, -122.3, -122.0],
+                                   'price': [100000.0, 300000.0, np.nan]})
+
+        transformer = CentreOfWealthColumnsTransformer(centre='price_weighted').fit(input_data)
+        transformed_X = transformer.transform(input_data)
+
+        assert pytest.approx(transformer.centre_latitude_) == 47.675
+        assert pytest.approx(transformer.centre_longitude_) == -122.275
+        assert pytest.approx(transformed_X['center_distance'][1]) == WaterDistanceColumnTransformer().dist(
+            -122.3, 47.7, transformer.centre_longitude_, transformer.centre_latitude_)
+
+    def test_partial_fit_price_weighted_centre(self):
+        input_data = pd.DataFrame({'lat': [47.6, 47.7, 47.5, 47.4],
+                                   'long': [-122.2, -122.3, -122.0, -122.1],
+                                   'price': [100000.0, 300000.0, np.nan, 200000.0]})
+        expected = CentreOfWealthColumnsTransformer(centre='price_weighted').fit(input_data)
+
+        transformer = CentreOfWealthColumnsTransformer(centre='price_weighted')
+        for start in range(0, len(input_data), 2):
+            transformer.partial_fit(input_data[start:start + 2])
+
+        assert pytest.approx(transformer.centre_latitude_) == expected.centre_latitude_
+        assert pytest.approx(transformer.centre_longitude_) == expected.centre_longitude_
+        # fit starts over instead of adding to the centre learned so far
+        transformer.fit(input_data)
+        assert pytest.approx(transformer.centre_latitude_) == expected.centre_latitude_
+
+    def test_price_weighted_centre_requires_fit(self):
+        with pytest.raises(NotFittedError):
+            CentreOfWealthColumnsTransformer(centre='price_weighted').transform(
+                pd.DataFrame({'lat': [47.6], 'long': [-122.2]}))
+
+    def test_fitted_state_is_persistable(self):
+        input_data = pd.DataFrame({'lat': [47.6, 47.7], 'long': [-122.2, -122.3], 'price': [1.0, 3.0]})
+        transformer = CentreOfWealthColumnsTransformer(centre='price_weighted').fit(input_data)
+
+        restored = pickle.loads(pickle.dumps(transformer))
+
+        assert_frame_equal(restored.transform(input_data), transformer.transform(input_data))
+
+
+class TestFusedArithmeticTransformer:
+
+    @pytest.fixture
+    def input_data(self):
+        rng = np.random.default_rng(42)
+        return pd.DataFrame({'price': rng.uniform(1e5, 2e6, 1000).round(), 'sqft_living': rng.integers(400, 6000, 1000),
+                             'sqft_lot': rng.integers(0, 20000, 1000), 'sqft_above': rng.integers(400, 4000, 1000),
+                             'sqft_basement': '?', 'lat': rng.uniform(47.15, 47.78, 1000),
+                             'long': rng.uniform(-122.52, -121.31, 1000)})
+
+    @pytest.mark.parametrize("centre", ['fixed', 'price_weighted'])
+    @pytest.mark.parametrize("chunk_size", [1, 64, 4096])
+    def test_matches_unfused_transformers(self, input_data, centre, chunk_size):
+        expected = input_data
+        for transformer in (SqftColumnTransformer(), SqFtPriceColumnTransformer(),
+                            CentreOfWealthColumnsTransformer(centre=centre)):
+            expected = transformer.fit_transform(expected)
+
+        transformer = FusedArithmeticTransformer(CentreOfWealthColumnsTransformer(centre=centre),
+                                                 chunk_size=chunk_size)
+        transformed_X = transformer.fit(input_data).transform(input_data)
+
+        assert_frame_equal(transformed_X, expected, check_exact=True)
+
+    def test_float32_columns(self, input_data):
+        input_data = input_data.astype({'lat': 'float32', 'long': 'float32', 'sqft_living': 'int32'})
+        expected = CentreOfWealthColumnsTransformer().transform(
+            SqFtPriceColumnTransformer().transform(SqftColumnTransformer().transform(input_data)))
+
+        assert_frame_equal(FusedArithmeticTransformer(chunk_size=100).transform(input_data), expected,
+                           check_exact=True)
+
+    def test_transform_does_not_modify_input(self, input_data):
+        original = input_data.copy()
+
+        transformed_X = FusedArithmeticTransformer().transform(input_data)
+        assert_frame_equal(input_data, original)
+
+        assert FusedArithmeticTransformer(copy=False).transform(input_data) is input_data
+        assert_frame_equal(input_data, transformed_X)
+
+    def test_price_weighted_centre_requires_fit(self, input_data):
+        with pytest.raises(NotFittedError):
+            FusedArithmeticTransformer(CentreOfWealthColumnsTransformer(centre='price_weighted')).transform(input_data)
+
+
+class TestGeoClusterColumnsTransformer:
+
+    @pytest.fixture
+    def neighbourhood(self):
+        return np.random.default_rng(7).integers(0, 3, 600)
+
+    @pytest.fixture
+    def input_data(self, neighbourhood):
+        # Three neighbourhoods of different locations and prices
+        rng = np.random.default_rng(42)
+        centres = np.array([[47.3, -122.3, 2e5], [47.6, -122.3, 8e5], [47.6, -122.0, 4e5]])[neighbourhood]
+        return pd.DataFrame({'lat': centres[:, 0] + rng.normal(0, 0.01, 600),
+                             'long': centres[:, 1] + rng.normal(0, 0.01, 600),
+                             'price': centres[:, 2] * rng.lognormal(0, 0.1, 600)})
+
+    def test_transform(self, input_data, neighbourhood):
+        transformer = GeoClusterColumnsTransformer(n_clusters=3).fit(input_data)
+
+        transformed_X = transformer.transform(input_data)
+
+        assert list(transformed_X.columns) == ['lat', 'long', 'price', 'geo_cluster', 'cluster_distance']
+        clusters = transformed_X.groupby(neighbourhood)['geo_cluster']
+        assert (clusters.nunique() == 1).all() and clusters.first().nunique() == 3
+        centres = transformer.kmeans_.cluster_centers_[transformed_X['geo_cluster']]
+        km_per_degree = 2 * np.pi * 6378 / 360
+        expected = np.hypot(input_data['lat'] * km_per_degree - centres[:, 0],
+                            input_data['long'] * np.cos(np.radians(47.6219)) * km_per_degree - centres[:, 1])
+        np.testing.assert_allclose(transformed_X['cluster_distance'], expected)
+        assert transformed_X['cluster_distance'].max() < 5
+
+    def test_transform_in_chunks(self, input_data):
+        transformer = GeoClusterColumnsTransformer(n_clusters=3).fit(input_data)
+
+        assert_frame_equal(transformer.set_params(chunk_size=7).transform(input_data),
+                           transformer.set_params(chunk_size=65536).transform(input_data))
+
+    def test_fit_on_sample(self, input_data, neighbourhood):
+        transformer = GeoClusterColumnsTransformer(n_clusters=3, max_fit_rows=100).fit(input_data)
+
+        clusters = transformer.transform(input_data).groupby(neighbourhood)['geo_cluster']
+        assert (clusters.nunique() == 1).all() and clusters.first().nunique() == 3
+
+    def test_partial_fit(self, input_data, neighbourhood):
+        transformer = GeoClusterColumnsTransformer(n_clusters=3, batch_size=100)
+        for start in range(0, len(input_data), 100):
+            transformer.partial_fit(input_data[start:start + 100])
+
+        clusters = transformer.transform(input_data).groupby(neighbourhood)['geo_cluster']
+        assert (clusters.nunique() == 1).all() and clusters.first().nunique() == 3
+
+    def test_missing_price(self, input_data):
+        transformer = GeoClusterColumnsTransformer(n_clusters=3).fit(input_data)
+        input_data.loc[0, 'price'] = np.nan
+
+        assert transformer.transform(input_data)['geo_cluster'].notna().all()
+
+    def test_requires_fit(self, input_data):
+        with pytest.raises(NotFittedError):
+            GeoClusterColumnsTransformer().transform(input_data)
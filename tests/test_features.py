@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+import pytest
+from fixtures import random_houses, service_session, use_service
+
+use_service()
+import features  # noqa: E402
+import models  # noqa: E402
+from sqlalchemy import create_engine, insert, select  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+
+
+def stored_features(session) -> pd.DataFrame:
+    result = session.execute(select(models.HouseFeatures.__table__).order_by(models.HouseFeatures.id))
+    return pd.DataFrame(result.all(), columns=list(result.keys())).astype({'id': np.int64})
+
+
+def rebuilt_features(session) -> pd.DataFrame:
+    '''rebuilt_features returns the result of rebuild_features on a copy of the houses of session'''
+    result = session.execute(select(models.House.__table__))
+    houses = [row._asdict() for row in result]
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    models.Base.metadata.create_all(bind=engine)
+    with Session(engine) as copy:
+        if houses:
+            copy.execute(insert(models.House), houses)
+        features.rebuild_features(copy)
+        return stored_features(copy)
+
+
+def write(session, house_ids, change):
+    '''write applies change to the houses house_ids and updates the features like the endpoints'''
+    previous_waterfront = features.waterfront_locations(session, house_ids)
+    change()
+    session.flush()
+    changed = features.update_features(session, house_ids, previous_waterfront)
+    session.commit()
+    return changed
+
+
+def assert_matches_rebuild(session):
+    pd.testing.assert_frame_equal(stored_features(session), rebuilt_features(session), check_exact=False)
+
+
+def set_house(session, house_id, **values):
+    def change():
+        house = session.get(models.House, house_id)
+        for key, value in values.items():
+            setattr(house, key, value)
+    return write(session, [house_id], change)
+
+
+def delete_house(session, house_id):
+    return write(session, [house_id], lambda: session.delete(session.get(models.House, house_id)))
+
+
+def add_houses(session, houses):
+    return write(session, [house['id'] for house in houses],
+                 lambda: session.execute(insert(models.House), houses))
+
+
+@pytest.fixture
+def houses(service_session):
+    features.water_references.clear()
+    add_houses(service_session, random_houses(60))
+    return service_session
+
+
+class TestUpdateFeatures:
+
+    def test_create(self, houses):
+        assert len(stored_features(houses)) == 60
+        assert_matches_rebuild(houses)
+
+    def test_update_without_waterfront_change(self, houses):
+        house = houses.scalar(select(models.House).where(models.House.waterfront == 0))
+        assert set_house(houses, house.id, price=house.price * 2) == {house.id}
+        assert_matches_rebuild(houses)
+
+    def test_waterfront_toggle(self, houses):
+        house_id = houses.scalar(select(models.House.id).where(models.House.waterfront == 0))
+        set_house(houses, house_id, waterfront=1.0)
+        assert_matches_rebuild(houses)
+        set_house(houses, house_id, waterfront=0.0)
+        assert_matches_rebuild(houses)
+
+    def test_move_and_delete_waterfront_houses(self, houses):
+        waterfront_ids = houses.scalars(select(models.House.id).where(models.House.waterfront == 1)).all()
+        set_house(houses, waterfront_ids[0], lat=47.5, long=-122.2)
+        assert_matches_rebuild(houses)
+        for house_id in waterfront_ids[1:]:
+            delete_house(houses, house_id)
+            assert_matches_rebuild(houses)
+        delete_house(houses, waterfront_ids[0])
+        # Without waterfront houses every water_distance is unknown
+        assert stored_features(houses)['water_distance'].isna().all()
+        assert_matches_rebuild(houses)
+
+    def test_random_writes(self, houses):
+        rng = np.random.default_rng(1)
+        next_id = 61
+        for step in range(30):
+            house_ids = houses.scalars(select(models.House.id)).all()
+            operation = rng.choice(["create", "update", "toggle", "delete"])
+            if operation == "create":
+                add_houses(houses, random_houses(int(rng.integers(1, 4)), seed=step, start_id=next_id))
+                next_id += 3
+            elif operation == "update":
+                set_house(houses, int(rng.choice(house_ids)), lat=float(rng.uniform(47.2, 47.8)),
+                          long=float(rng.uniform(-122.5, -121.8)))
+            elif operation == "toggle":
+                house = houses.get(models.House, int(rng.choice(house_ids)))
+                set_house(houses, house.id, waterfront=1.0 - house.waterfront)
+            else:
+                delete_house(houses, int(rng.choice(house_ids)))
+        assert_matches_rebuild(houses)
+
+    def test_water_reference_is_reused(self, houses, monkeypatch):
+        built = []
+        water_reference = features.water_reference
+        monkeypatch.setattr(features, "water_reference", lambda locations: built.append(1) or water_reference(
+            locations))
+        house_id = houses.scalar(select(models.House.id).where(models.House.waterfront == 0))
+
+        set_house(houses, house_id, price=1.0)
+        assert built == []
+        # A new waterfront location builds the reference again
+        set_house(houses, house_id, waterfront=1.0)
+        assert built
+        assert_matches_rebuild(houses)
@@ -0,0 +1,104 @@
+import os
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+from fixtures import house_expected_output_file_path, house_input_file_path
+from ingestion import RAW_DTYPES, cache_path, read_houses, to_compact
+from pandas.testing import assert_frame_equal
+from preprocessing import PreprocessingSeattleHousing, load_data
+
+
+class TestReadHouses:
+
+    def test_compact_dtypes(self, house_input_file_path):
+        houses = read_houses(house_input_file_path)
+
+        for column, dtype in RAW_DTYPES.items():
+            assert houses[column].dtype == dtype, column
+        assert houses['date'].dtype == 'datetime64[ns]'
+        assert houses['date'][0] == pd.Timestamp(2015, 3, 17)
+
+    def test_unknown_basement_is_missing(self, tmp_path):
+        file_path = tmp_path / "houses.csv"
+        pd.DataFrame({'sqft_basement': ['?', '400.0'], 'sqft_living': [1000, 2000]}).to_csv(file_path, index=False)
+
+        houses = read_houses(file_path)
+
+        assert houses['sqft_basement'].dtype == 'float32'
+        assert np.isnan(houses['sqft_basement'][0]) and houses['sqft_basement'][1] == 400.0
+
+    def test_preprocessing_of_compact_dataset(self, house_input_file_path, house_expected_output_file_path):
+        expected_results_data = load_data(house_expected_output_file_path)
+
+        transformed_X = PreprocessingSeattleHousing().preprocess_fit_transform(read_houses(house_input_file_path))
+
+        expected_results_data['date'] = pd.to_datetime(expected_results_data['date'])
+        assert_frame_equal(transformed_X, expected_results_data, check_dtype=False)
+
+    def test_columnar_cache(self, house_input_file_path, tmp_path):
+        pytest.importorskip("pyarrow")
+        houses = read_houses(house_input_file_path, cache_dir=tmp_path)
+
+        assert cache_path(house_input_file_path, tmp_path).exists()
+        with patch("ingestion.pd.read_csv") as read_csv:
+            cached_houses = read_houses(house_input_file_path, cache_dir=tmp_path)
+            cached_columns = read_houses(house_input_file_path, cache_dir=tmp_path, columns=['lat', 'long'])
+        read_csv.assert_not_called()
+        assert_frame_equal(cached_houses, houses)
+        assert_frame_equal(cached_columns, houses[['lat', 'long']])
+
+    def test_modified_csv_invalidates_cache(self, tmp_path):
+        pytest.importorskip("pyarrow")
+        file_path = tmp_path / "houses.csv"
+        pd.DataFrame({'price': [1.0]}).to_csv(file_path, index=False)
+        read_houses(file_path, cache_dir=tmp_path)
+
+        pd.DataFrame({'price': [2.0]}).to_csv(file_path, index=False)
+        cached = cache_path(file_path, tmp_path)
+        os.utime(file_path, (cached.stat().st_mtime + 1, cached.stat().st_mtime + 1))
+
+        assert read_houses(file_path, cache_dir=tmp_path)['price'][0] == 2.0
+
+    def test_same_named_csv_files_have_their_own_cache(self, tmp_path):
+        pytest.importorskip("pyarrow")
+        file_paths = [tmp_path / "a" / "houses.csv", tmp_path / "b" / "houses.csv"]
+        for price, file_path in enumerate(file_paths):
+            file_path.parent.mkdir()
+            pd.DataFrame({'price': [float(price)]}).to_csv(file_path, index=False)
+        # The cache of b/houses.csv is newer than a/houses.csv
+        os.utime(file_paths[0], (0, 0))
+        cache_dir = tmp_path / "cache"
+
+        for _ in range(2):
+            assert [read_houses(file_path, cache_dir=cache_dir)['price'][0] for file_path in file_paths] == [0.0, 1.0]
+        assert cache_path(file_paths[0], cache_dir) != cache_path(file_paths[1], cache_dir)
+
+    def test_cache_of_restored_csv_is_not_read(self, tmp_path):
+        pytest.importorskip("pyarrow")
+        file_path = tmp_path / "houses.csv"
+        pd.DataFrame({'price': [1.0]}).to_csv(file_path, index=False)
+        read_houses(file_path, cache_dir=tmp_path)
+
+        # A file replaced by an older copy is older than its cache, but not the file that was cached
+        pd.DataFrame({'price': [22.0]}).to_csv(file_path, index=False)
+        os.utime(file_path, (0, 0))
+
+        assert read_houses(file_path, cache_dir=tmp_path)['price'][0] == 22.0
+
+    def test_parquet_input(self, house_input_file_path, tmp_path):
+        pytest.importorskip("pyarrow")
+        file_path = tmp_path / "houses.parquet"
+        load_data(house_input_file_path).to_parquet(file_path)
+
+        assert_frame_equal(read_houses(file_path), read_houses(house_input_file_path))
+
+    def test_to_compact(self):
+        houses = pd.DataFrame({'bedrooms': [3], 'date': ['10/13/2014'], 'other': [1.5]})
+
+        compact = to_compact(houses)
+
+        assert compact['bedrooms'].dtype == 'int8'
+        assert compact['date'][0] == pd.Timestamp(2014, 10, 13)
+        assert compact['other'].dtype == 'float64'
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import math
+
+import pytest
+from fixtures import random_houses, service_client, use_service
+
+use_service()
+import database  # noqa: E402
+import main  # noqa: E402
+from feature_enginneering_tranformers import KM_PER_DEGREE  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+
+def post_houses(client, houses, **params):
+    return client.post("/houses", json=houses, params=params)
+
+
+class TestCreateHouses:
+
+    def test_insert(self, service_client):
+        response = post_houses(service_client, random_houses(25), batch_size=10)
+
+        assert response.status_code == 200
+        assert response.json() == dict(received=25, batches=3, upsert=False)
+        assert len(service_client.get("/houses", params=dict(limit=100)).json()) == 25
+
+    def test_duplicate_key(self, service_client):
+        post_houses(service_client, random_houses(3))
+
+        response = post_houses(service_client, random_houses(2, seed=1, start_id=3))
+
+        assert response.status_code == 409
+        # The transaction is rolled back, house 4 is not written either
+        assert service_client.get("/houses/4").status_code == 404
+
+    def test_other_integrity_error(self, service_client):
+        with database.engine.begin() as connection:
+            connection.execute(text("CREATE TRIGGER no_negative_price BEFORE INSERT ON houses WHEN NEW.price < 0 "
+                                     "BEGIN SELECT RAISE(ABORT, 'CHECK constraint failed: price'); END"))
+
+        response = post_houses(service_client, [dict(random_houses(1)[0], price=-1.0)])
+
+        assert response.status_code == 422
+
+    def test_upsert_overwrites(self, service_client):
+        post_houses(service_client, random_houses(3))
+        service_client.get("/houses/2")
+        houses = [dict(house, price=1234.0) for house in random_houses(2, start_id=2)]
+
+        response = post_houses(service_client, houses, upsert=True)
+
+        assert response.json() == dict(received=2, batches=1, upsert=True)
+        # The cached house 2 is invalidated
+        assert service_client.get("/houses/2").json()['price'] == 1234.0
+        assert service_client.get("/houses/3").json() == houses[1]
+        assert service_client.get("/stats/zipcodes").status_code == 200
+
+    def test_upsert_with_duplicate_ids(self, service_client):
+        first, second = random_houses(2)
+        second = dict(second, id=first['id'])
+
+        response = post_houses(service_client, [first, second], upsert=True, batch_size=1)
+
+        assert response.status_code == 200
+        assert response.json() == dict(received=2, batches=1, upsert=True)
+        assert service_client.get(f"/houses/{first['id']}").json() == second
+        assert sum(stats['count'] for stats in service_client.get("/stats/zipcodes").json()) == 1
+
+    @pytest.mark.parametrize("batch_size", [1, 7, 1000])
+    def test_batches(self, service_client, batch_size):
+        response = post_houses(service_client, random_houses(14), batch_size=batch_size)
+        assert response.json()['batches'] == -(-14 // batch_size)
+
+
+def on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class TestWrites:
+
+    def test_features_are_updated_off_the_event_loop(self, service_client, monkeypatch):
+        calls = []
+        update_features = main.update_features
+        monkeypatch.setattr(main, "update_features", lambda *args: calls.append(on_event_loop()) or update_features(
+            *args))
+        house = random_houses(2)[1]
+
+        post_houses(service_client, random_houses(1))
+        service_client.post("/house", json=house)
+        service_client.put(f"/houses/{house['id']}", json=dict(house, price=1.0))
+        service_client.delete(f"/houses/{house['id']}")
+
+        assert calls == [False] * 4
+        assert service_client.get("/houses/1/features").status_code == 200
+        assert service_client.get(f"/houses/{house['id']}").status_code == 404
+
+
+def all_pages(client, url, limit, **params):
+    '''all_pages follows X-Next-Cursor from the first page to the last one'''
+    houses, pages, after_id = [], [], None
+    while True:
+        page_params = dict(params, limit=limit, **({} if after_id is None else dict(after_id=after_id)))
+        response = client.get(url, params=page_params)
+        assert response.status_code == 200
+        houses += response.json()
+        pages.append(response)
+        after_id = response.headers.get("X-Next-Cursor")
+        if after_id is None:
+            return houses, pages
+
+
+class TestPagination:
+
+    @pytest.fixture
+    def houses(self, service_client):
+        # Ids with gaps, in a different order than inserted
+        houses = sorted(random_houses(23), key=lambda house: -house['id'])
+        houses = [dict(house, id=house['id'] * 3) for house in houses]
+        post_houses(service_client, houses)
+        return sorted(houses, key=lambda house: house['id'])
+
+    def test_pages(self, service_client, houses):
+        paged, pages = all_pages(service_client, "/houses", limit=5)
+
+        assert paged == houses
+        assert [len(page.json()) for page in pages] == [5, 5, 5, 5, 3]
+        assert [page.headers.get("X-Next-Cursor") for page in pages[:-1]] == [
+            str(houses[i]['id']) for i in (4, 9, 14, 19)]
+        assert "X-Next-Cursor" not in pages[-1].headers
+
+    def test_full_last_page(self, service_client, houses):
+        # A last page that is full has a cursor, the page after it is empty and has none
+        paged, pages = all_pages(service_client, "/houses", limit=23)
+        assert paged == houses
+        assert [len(page.json()) for page in pages] == [23, 0]
+
+    def test_search_pages(self, service_client, houses):
+        paged, _ = all_pages(service_client, "/houses/search", limit=2, zipcode=98004)
+        assert paged == [house for house in houses if house['zipcode'] == 98004]
+
+    def test_stream(self, service_client, houses):
+        response = service_client.get("/houses/stream")
+
+        assert response.headers["content-type"] == "application/x-ndjson"
+        lines = response.text.splitlines()
+        assert [json.loads(line) for line in lines] == all_pages(service_client, "/houses", limit=4)[0]
+
+    def test_stream_after_id(self, service_client, houses):
+        response = service_client.get("/houses/stream", params=dict(after_id=houses[10]['id']))
+        assert [json.loads(line) for line in response.text.splitlines()] == houses[11:]
+
+
+def search(client, **params):
+    response = client.get("/houses/search", params=dict(params, limit=1000))
+    assert response.status_code == 200
+    return [house['id'] for house in response.json()]
+
+
+def distance_km(house, lat, long):
+    # Equirectangular distance, as the radius filter
+    delta_long = (house['long'] - long) * math.cos(math.radians(lat))
+    return math.hypot(delta_long, house['lat'] - lat) * KM_PER_DEGREE
+
+
+class TestSearch:
+
+    @pytest.fixture
+    def houses(self, service_client):
+        houses = random_houses(200)
+        post_houses(service_client, houses)
+        return houses
+
+    @pytest.mark.parametrize("radius_km", [3, 5, 20])
+    def test_radius(self, service_client, houses, radius_km):
+        lat, long = 47.5, -122.2
+        expected = [house['id'] for house in houses if distance_km(house, lat, long) <= radius_km]
+
+        assert search(service_client, lat=lat, long=long, radius_km=radius_km) == expected
+
+    def test_radius_with_other_filters(self, service_client, houses):
+        lat, long = 47.5, -122.2
+        expected = [house['id'] for house in houses
+                    if distance_km(house, lat, long) <= 20 and house['zipcode'] == 98038]
+        assert expected
+        assert search(service_client, lat=lat, long=long, radius_km=20, zipcode=98038) == expected
+
+    def test_bounding_box(self, service_client, houses):
+        box = dict(min_lat=47.4, max_lat=47.6, min_long=-122.3, max_long=-122.0)
+        expected = [house['id'] for house in houses
+                    if 47.4 <= house['lat'] <= 47.6 and -122.3 <= house['long'] <= -122.0]
+        assert expected
+
+        assert search(service_client, **box) == expected
+        assert search(service_client, min_lat=47.6) == [house['id'] for house in houses if house['lat'] >= 47.6]
+
+    @pytest.mark.parametrize("params", [
+        dict(radius_km=1), dict(lat=47.5, radius_km=1), dict(long=-122.2, radius_km=1),
+        dict(lat=47.5, long=-122.2, radius_km=0), dict(lat=91, long=-122.2, radius_km=1),
+        dict(lat=47.5, long=-181, radius_km=1), dict(min_lat=-90.5), dict(max_long=180.5),
+    ])
+    def test_invalid_search(self, service_client, params):
+        assert service_client.get("/houses/search", params=params).status_code == 422
+
+    def test_radius_at_the_pole(self, service_client, houses):
+        assert search(service_client, lat=90, long=0, radius_km=1) == []
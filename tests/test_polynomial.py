@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from polynomial import OutOfCoreElasticNet, PolynomialExpansion
+from sklearn.linear_model import ElasticNet
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import PolynomialFeatures, StandardScaler
+
+
+@pytest.fixture
+def dataset():
+    rng = np.random.default_rng(42)
+    X = np.column_stack([rng.uniform(1000, 5000, 500), rng.uniform(47.2, 47.8, 500),
+                         rng.uniform(-122.5, -121.3, 500), rng.integers(1, 6, 500)])
+    y = 100 * X[:, 0] + 2e4 * X[:, 3] + 0.01 * X[:, 0] ** 2 + rng.normal(0, 1e4, 500)
+    return X, y
+
+
+class TestPolynomialExpansion:
+
+    def test_transform_matches_polynomial_features(self, dataset):
+        X, _ = dataset
+        expected = PolynomialFeatures(2).fit_transform(X)
+
+        expansion = PolynomialExpansion(block_size=64).fit(X)
+        X_out = expansion.transform(X)
+
+        assert X_out.dtype == np.float32
+        np.testing.assert_allclose(X_out, expected, rtol=1e-6)
+        np.testing.assert_array_equal(expansion.get_feature_names_out(),
+                                      PolynomialFeatures(2).fit(X).get_feature_names_out())
+
+    def test_blocks(self, dataset):
+        X, _ = dataset
+        expansion = PolynomialExpansion(dtype=np.float64, block_size=64).fit(X)
+
+        blocks = list(expansion.blocks(X))
+
+        assert [start for start, _ in blocks] == list(range(0, 500, 64))
+        assert max(len(block) for _, block in blocks) == 64
+        np.testing.assert_array_equal(np.vstack([block for _, block in blocks]), expansion.transform(X))
+
+
+class TestOutOfCoreElasticNet:
+
+    @pytest.mark.parametrize("alpha, l1_ratio", [(0.5, 0.5), (100.0, 1.0), (1.0, 0.0)])
+    def test_fit_matches_elastic_net(self, dataset, alpha, l1_ratio):
+        X, y = dataset
+        expected = make_pipeline(PolynomialFeatures(2), StandardScaler(),
+                                 ElasticNet(alpha=alpha, l1_ratio=l1_ratio, max_iter=100000, tol=1e-10)).fit(X, y)
+
+        model = OutOfCoreElasticNet(alpha=alpha, l1_ratio=l1_ratio, tol=1e-10, block_size=64).fit(X, y)
+
+        np.testing.assert_allclose(model.predict(X), expected.predict(X), rtol=1e-4)
+
+    def test_partial_fit(self, dataset):
+        X, y = dataset
+        model = OutOfCoreElasticNet(alpha=0.5, tol=1e-10)
+        for start in range(0, len(X), 100):
+            model.partial_fit(X[start:start + 100], y[start:start + 100])
+
+        fitted = OutOfCoreElasticNet(alpha=0.5, tol=1e-10).fit(X, y)
+
+        assert model.n_samples_seen_ == len(X)
+        np.testing.assert_allclose(model.predict(X), fitted.predict(X), rtol=1e-6)
+
+    def test_refit_forgets_previous_rows(self, dataset):
+        X, y = dataset
+        model = OutOfCoreElasticNet().fit(X[:250], y[:250])
+
+        model.fit(X[250:], y[250:])
+
+        assert model.n_samples_seen_ == 250
+        np.testing.assert_allclose(model.predict(X), OutOfCoreElasticNet().fit(X[250:], y[250:]).predict(X))
@@ -0,0 +1,99 @@
+import asyncio
+import json
+
+import numpy as np
+import pytest
+from fixtures import house_input_file_path, random_houses, service_client, use_service
+
+use_service()
+import prediction  # noqa: E402
+from artifact import save_artifact  # noqa: E402
+from preprocessing import DROP_COLUMNS, PreprocessingSeattleHousing, load_data  # noqa: E402
+from prediction import MicroBatcher, predict_houses  # noqa: E402
+from sklearn.linear_model import LinearRegression  # noqa: E402
+
+
+@pytest.fixture
+def model_path(house_input_file_path, tmp_path, monkeypatch):
+    preprocessor = PreprocessingSeattleHousing()
+    dataset = preprocessor.preprocess_fit_transform(load_data(house_input_file_path))
+    features = [x for x in dataset.columns if x not in DROP_COLUMNS + ['id']]
+    model = LinearRegression().fit(dataset[features], dataset['price'])
+    path = save_artifact(tmp_path / "artifact", preprocessor, model, features)
+    monkeypatch.setattr(prediction, "MODEL_PATH", str(path))
+    prediction.get_artifact.cache_clear()
+    yield path
+    prediction.get_artifact.cache_clear()
+
+
+def submit_all(batcher, items):
+    async def submit():
+        results = await asyncio.gather(*(batcher.submit(item) for item in items), return_exceptions=True)
+        await batcher.close()
+        return results
+    return asyncio.run(submit())
+
+
+class TestMicroBatcher:
+
+    def test_batches_match_single_predictions(self, model_path):
+        houses = random_houses(10)
+        calls = []
+
+        def predict_batch(items):
+            calls.append(len(items))
+            return predict_houses(items)
+
+        results = submit_all(MicroBatcher(predict_batch, max_batch_size=4, max_wait_ms=50), houses)
+
+        np.testing.assert_allclose(results, [predict_houses([house])[0] for house in houses])
+        assert calls == [4, 4, 2]
+
+    def test_failed_item_does_not_fail_its_batch(self, model_path):
+        houses = random_houses(6)
+        houses[2] = dict(houses[2], lat=float('nan'))
+
+        results = submit_all(MicroBatcher(predict_houses, max_batch_size=6, max_wait_ms=50), houses)
+
+        assert isinstance(results[2], ValueError)
+        valid = [house for i, house in enumerate(houses) if i != 2]
+        np.testing.assert_allclose([result for i, result in enumerate(results) if i != 2], predict_houses(valid))
+
+    def test_failed_single_item(self):
+        def predict_batch(items):
+            raise RuntimeError("model failure")
+
+        results = submit_all(MicroBatcher(predict_batch), [{}])
+        assert isinstance(results[0], RuntimeError)
+
+    def test_empty_batch(self):
+        assert predict_houses([]) == []
+
+
+class TestPredictEndpoints:
+
+    def test_predict_matches_batch(self, service_client, model_path):
+        houses = random_houses(5)
+        batch = service_client.post("/predict/batch", json=houses)
+        assert batch.status_code == 200
+        single = [service_client.post("/predict", json=house).json() for house in houses]
+
+        assert [prediction['id'] for prediction in batch.json()] == [house['id'] for house in houses]
+        np.testing.assert_allclose([prediction['price'] for prediction in single],
+                                   [prediction['price'] for prediction in batch.json()])
+
+    def test_empty_batch(self, service_client, model_path):
+        response = service_client.post("/predict/batch", json=[])
+        assert response.status_code == 200
+        assert response.json() == []
+
+    def test_non_finite_values_are_rejected(self, service_client, model_path):
+        house = random_houses(1)[0]
+        for value in ("NaN", "Infinity"):
+            # NaN is not valid JSON, but the json module of FastAPI parses it
+            content = json.dumps(house).replace(str(house['lat']), value)
+            response = service_client.post("/predict", content=content, headers={"Content-Type": "application/json"})
+            assert response.status_code == 422
+
+    def test_model_not_available(self, service_client):
+        assert service_client.post("/predict", json=random_houses(1)[0]).status_code == 503
@@ -19,3 +19,74 @@ class TestPreprocessingSeattleHousing:
         transformed_X = preprocessor.preprocess_fit_transform(input_data)
 
         assert_frame_equal(transformed_X, expected_results_data)
+
+    @pytest.mark.parametrize("chunksize", [1, 3])
+    def test_preprocess_stream(self, house_input_file_path, house_expected_output_file_path, chunksize):
+        preprocessor = PreprocessingSeattleHousing()
+
+        expected_results_data = load_data(house_expected_output_file_path)
+
+        transformed_X = pd.concat(preprocessor.preprocess_stream(house_input_file_path, chunksize=chunksize))
+
+        assert_frame_equal(transformed_X, expected_results_data)
+
+    def test_preprocess_fit_transform_parallel(self, house_input_file_path, house_expected_output_file_path):
+        preprocessor = PreprocessingSeattleHousing(n_jobs=2)
+
+        input_data = load_data(house_input_file_path)
+        expected_results_data = load_data(house_expected_output_file_path)
+
+        transformed_X = preprocessor.preprocess_fit_transform(input_data)
+
+        assert_frame_equal(transformed_X, expected_results_data)
+        assert_frame_equal(preprocessor.preprocess_transform(load_data(house_input_file_path)),
+                           expected_results_data)
+
+    @pytest.mark.parametrize("n_jobs", [1, 2])
+    def test_preprocess_fit_transform_fused(self, house_input_file_path, house_expected_output_file_path, n_jobs):
+        preprocessor = PreprocessingSeattleHousing(n_jobs=n_jobs, fused=True)
+
+        input_data = load_data(house_input_file_path)
+        expected_results_data = load_data(house_expected_output_file_path)
+
+        assert_frame_equal(preprocessor.preprocess_fit_transform(input_data), expected_results_data)
+        assert_frame_equal(preprocessor.preprocess_transform(input_data), expected_results_data)
+
+    def test_preprocess_geo_clusters(self, house_input_file_path):
+        input_data = load_data(house_input_file_path)
+        expected = PreprocessingSeattleHousing().preprocess_fit_transform(input_data)
+
+        transformed_X = PreprocessingSeattleHousing(n_clusters=2).preprocess_fit_transform(input_data)
+
+        assert_frame_equal(transformed_X[expected.columns], expected)
+        assert list(transformed_X.columns[-2:]) == ['geo_cluster', 'cluster_distance']
+        assert_frame_equal(PreprocessingSeattleHousing(n_clusters=2, n_jobs=2).preprocess_fit_transform(input_data),
+                           transformed_X)
+        streamed = pd.concat(PreprocessingSeattleHousing(n_clusters=2).preprocess_stream(house_input_file_path,
+                                                                                          chunksize=1))
+        assert streamed['geo_cluster'].nunique() == 2
+
+    @pytest.mark.parametrize("fused", [False, True])
+    def test_preprocess_price_weighted_centre(self, house_input_file_path, fused):
+        def preprocessor(**kwargs):
+            preprocessor = PreprocessingSeattleHousing(fused=fused, **kwargs)
+            step = 'fused_arithmetic__centre_of_wealth' if fused else 'center_of_wealth'
+            preprocessor.preprocessor_pipe.set_params(**{f"feature_enginneering__{step}__centre": 'price_weighted'})
+            return preprocessor
+
+        input_data = load_data(house_input_file_path)
+        expected = preprocessor().preprocess_fit_transform(input_data)
+
+        fixed = PreprocessingSeattleHousing().preprocess_fit_transform(input_data)
+        assert not np.allclose(expected['center_distance'], fixed['center_distance'])
+        assert_frame_equal(preprocessor(n_jobs=2).preprocess_fit_transform(input_data), expected)
+        streamed = pd.concat(preprocessor().preprocess_stream(house_input_file_path, chunksize=1))
+        assert_frame_equal(streamed, expected)
+
+    def test_preprocess_fit_transform_does_not_modify_input(self, house_input_file_path):
+        input_data = load_data(house_input_file_path)
+        original = input_data.copy()
+
+        PreprocessingSeattleHousing().preprocess_fit_transform(input_data)
+
+        assert_frame_equal(input_data, original)
@@ -0,0 +1,61 @@
+import pytest
+from fixtures import house_input_file_path
+from pandas.testing import assert_frame_equal
+from preprocessing import PreprocessingSeattleHousing, load_data
+from profiling import StepProfiler
+
+STEPS = ['view', 'sqft_basement', 'waterfront', 'last_known_change', 'drop_extraneous_columns',
+         'sqft_price', 'center_of_wealth', 'water_distance']
+
+
+class TestStepProfiler:
+
+    @pytest.mark.parametrize("mode", StepProfiler.MODES)
+    def test_profiled_preprocessing(self, house_input_file_path, mode):
+        input_data = load_data(house_input_file_path)
+        expected = PreprocessingSeattleHousing().preprocess_fit_transform(input_data)
+        profiler = StepProfiler(mode)
+
+        preprocessor = PreprocessingSeattleHousing()
+        assert_frame_equal(preprocessor.preprocess_fit_transform(input_data, profiler=profiler), expected)
+        assert_frame_equal(preprocessor.preprocess_transform(input_data, profiler=profiler), expected)
+
+        report = profiler.report()
+        assert [(stats['step'], stats['phase']) for stats in report] == \
+            [(step, 'fit_transform') for step in STEPS] + [(step, 'transform') for step in STEPS]
+        assert all(stats['calls'] == 1 and stats['rows'] == len(input_data) and stats['seconds'] > 0
+                   for stats in report)
+        assert all((stats['memory_peak'] is not None) == (mode == 'tracemalloc') for stats in report)
+        if mode == 'cprofile':
+            assert profiler.pstats('water_distance').total_calls > 0
+        profiler.close()
+
+    def test_accumulates_calls(self, house_input_file_path):
+        input_data = load_data(house_input_file_path)
+        preprocessor = PreprocessingSeattleHousing()
+        preprocessor.preprocess_fit_transform(input_data)
+        profiler = StepProfiler()
+
+        for _ in range(3):
+            preprocessor.preprocess_transform(input_data, profiler=profiler)
+
+        view = profiler.report()[0]
+        assert view['calls'] == 3 and view['rows'] == 3 * len(input_data)
+        assert view['rows_per_second'] == pytest.approx(view['rows'] / view['seconds'])
+
+    def test_prometheus(self, house_input_file_path):
+        profiler = StepProfiler()
+        PreprocessingSeattleHousing().preprocess_fit_transform(load_data(house_input_file_path), profiler=profiler)
+
+        metrics = profiler.prometheus()
+
+        assert "# TYPE pipeline_step_seconds_total counter" in metrics
+        assert 'pipeline_step_rows_total{step="water_distance",phase="fit_transform"} 4' in metrics
+        assert "pipeline_step_memory_peak_bytes" not in metrics
+        # A step can release memory, the sum of its deltas is not a counter
+        assert "# TYPE pipeline_step_memory_delta_bytes gauge" in metrics
+        assert "memory_delta_bytes_total" not in metrics
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError):
+            StepProfiler('perf')
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+from fixtures import random_houses, service_client, use_service
+
+use_service()
+import cache  # noqa: E402
+import main  # noqa: E402
+import serialization  # noqa: E402
+
+orjson = pytest.importorskip("orjson")
+
+
+def canonical(text: str) -> str:
+    '''canonical re-encodes a JSON document, keeping the key order and telling floats from ints'''
+    return json.dumps(json.loads(text))
+
+
+def set_fast_json(monkeypatch, enabled: bool):
+    monkeypatch.setattr(main, "HOUSES_FAST_JSON", enabled)
+    monkeypatch.setattr(serialization, "HOUSES_FAST_JSON", enabled)
+    monkeypatch.setattr(serialization, "orjson", orjson, raising=False)
+    # The cached houses were encoded by the other path
+    monkeypatch.setattr(main, "houses_cache", cache.HouseCache(cache.LRUBackend()))
+
+
+@pytest.fixture
+def houses(service_client):
+    houses = random_houses(12)
+    # Floats that are not round, whole floats, a missing waterfront and dates of one or two digits
+    houses[0] = dict(houses[0], price=0.1 + 0.2, lat=47.123456789012345, bathrooms=2.0, sqft_basement=1e-7)
+    houses[1] = dict(houses[1], waterfront=None, price=1e20, date="12/31/2014")
+    houses[2] = dict(houses[2], waterfront=None, yr_renovated=0.0, date="1/1/2015")
+    assert service_client.post("/houses", json=houses).status_code == 200
+    return houses
+
+
+ENDPOINTS = [
+    ("/houses/1", {}), ("/houses/2", {}), ("/houses/3", {}),
+    ("/houses", dict(limit=5)), ("/houses", dict(limit=5, after_id=5)), ("/houses", dict(limit=100)),
+    ("/houses/search", dict(zipcode=98103, limit=2)), ("/houses/search", dict(min_lat=47.5)),
+    ("/houses/stream", {}), ("/houses/stream", dict(after_id=2)),
+]
+
+
+@pytest.mark.parametrize("url, params", ENDPOINTS)
+def test_fast_json_matches_default_encoding(service_client, houses, monkeypatch, url, params):
+    set_fast_json(monkeypatch, False)
+    default = service_client.get(url, params=params)
+    set_fast_json(monkeypatch, True)
+    # Twice, the second /houses/{id} is served from the cache
+    fast = [service_client.get(url, params=params) for _ in range(2)]
+
+    for response in fast:
+        assert response.status_code == default.status_code == 200
+        assert response.headers["content-type"] == default.headers["content-type"]
+        assert response.headers.get("X-Next-Cursor") == default.headers.get("X-Next-Cursor")
+        assert ([canonical(line) for line in response.text.splitlines()]
+                == [canonical(line) for line in default.text.splitlines()])
+
+
+def test_fast_json_decodes_to_the_posted_houses(service_client, houses, monkeypatch):
+    set_fast_json(monkeypatch, True)
+    response = service_client.get("/houses", params=dict(limit=100))
+    expected = [{field: house[field] for field in serialization.HOUSE_FIELDS} for house in houses]
+    assert canonical(response.text) == json.dumps(expected)
@@ -0,0 +1,154 @@
+import numpy as np
+import pytest
+from fixtures import random_houses, service_session, use_service
+
+use_service()
+import features  # noqa: E402
+import models  # noqa: E402
+from sqlalchemy import create_engine, insert, select  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+from stats import (STATS_PRICE_ACCURACY, QuantileSketch, median_of_counts, rebuild_zipcode_stats,  # noqa: E402
+                   update_zipcode_stats, zipcode_rows, zipcode_summary)
+
+
+def stored_stats(session) -> dict:
+    return {row.zipcode: zipcode_summary(row) | dict(price_sketch=row.price_sketch, grade_counts=row.grade_counts)
+            for row in session.scalars(select(models.ZipcodeStats))}
+
+
+def rebuilt_stats(session) -> dict:
+    '''rebuilt_stats returns the result of rebuild_zipcode_stats on a copy of the houses of session'''
+    houses = [row._asdict() for row in session.execute(select(models.House.__table__))]
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    models.Base.metadata.create_all(bind=engine)
+    with Session(engine) as copy:
+        if houses:
+            copy.execute(insert(models.House), houses)
+        features.rebuild_features(copy)
+        rebuild_zipcode_stats(copy)
+        return stored_stats(copy)
+
+
+def assert_matches_rebuild(session):
+    stats, expected = stored_stats(session), rebuilt_stats(session)
+    assert stats.keys() == expected.keys()
+    for zipcode, summary in stats.items():
+        assert summary == pytest.approx(expected[zipcode], nan_ok=True)
+
+
+def write(session, house_ids, change):
+    # Like the endpoints: features and stats are updated in the transaction of the write
+    previous_waterfront = features.waterfront_locations(session, house_ids)
+    previous_stats = zipcode_rows(session, house_ids)
+    change()
+    session.flush()
+    features.update_features(session, house_ids, previous_waterfront)
+    update_zipcode_stats(session, house_ids, previous_stats)
+    session.commit()
+
+
+def set_house(session, house_id, **values):
+    def change():
+        house = session.get(models.House, house_id)
+        for key, value in values.items():
+            setattr(house, key, value)
+    write(session, [house_id], change)
+
+
+@pytest.fixture
+def houses(service_session):
+    features.water_references.clear()
+    rows = random_houses(90)
+    write(service_session, [row['id'] for row in rows], lambda: service_session.execute(insert(models.House), rows))
+    return service_session
+
+
+class TestQuantileSketch:
+
+    @pytest.mark.parametrize("n", [1, 2, 101, 1000])
+    def test_median_within_accuracy(self, n):
+        prices = np.random.default_rng(n).lognormal(13, 0.5, n)
+        sketch = QuantileSketch()
+        for price in prices:
+            sketch.update({sketch.bin_key(price): 1})
+        assert len(sketch) == n
+        assert sketch.quantile(0.5) == pytest.approx(np.median(prices), rel=STATS_PRICE_ACCURACY)
+
+    def test_subtract(self):
+        sketch = QuantileSketch()
+        sketch.update({sketch.bin_key(price): 1 for price in [100_000.0, 200_000.0, 900_000.0]})
+        sketch.update({sketch.bin_key(900_000.0): 1}, sign=-1)
+        assert sketch.quantile(0.5) == pytest.approx(150_000.0, rel=STATS_PRICE_ACCURACY)
+        assert QuantileSketch.from_json(sketch.to_json()).bins == sketch.bins
+
+    def test_empty(self):
+        assert QuantileSketch().quantile(0.5) is None
+
+
+class TestMedianOfCounts:
+
+    @pytest.mark.parametrize("values", [[7], [3, 9], [1, 2, 2, 5, 8], [4, 4, 6, 8], [2, 3, 3, 3, 10, 11]])
+    def test_median(self, values):
+        counts = {value: values.count(value) for value in values}
+        assert median_of_counts(counts) == np.median(values)
+
+    def test_empty(self):
+        assert median_of_counts({}) is None
+        assert median_of_counts({5: 0}) is None
+
+
+class TestUpdateZipcodeStats:
+
+    def test_insert(self, houses):
+        assert sum(summary['count'] for summary in stored_stats(houses).values()) == 90
+        assert_matches_rebuild(houses)
+
+    def test_upsert(self, houses):
+        rows = [dict(row, price=row['price'] * 2, grade=12) for row in random_houses(5)]
+
+        def upsert():
+            for row in rows:
+                session_house = houses.get(models.House, row['id'])
+                for key, value in row.items():
+                    setattr(session_house, key, value)
+        write(houses, [row['id'] for row in rows], upsert)
+        assert_matches_rebuild(houses)
+
+    def test_zipcode_move(self, houses):
+        house = houses.get(models.House, 1)
+        zipcode = next(zipcode for zipcode in stored_stats(houses) if zipcode != house.zipcode)
+        count = stored_stats(houses)[zipcode]['count']
+        set_house(houses, 1, zipcode=zipcode)
+        assert stored_stats(houses)[zipcode]['count'] == count + 1
+        assert_matches_rebuild(houses)
+
+    def test_new_zipcode_and_delete(self, houses):
+        set_house(houses, 1, zipcode=98999)
+        assert stored_stats(houses)[98999]['count'] == 1
+        assert_matches_rebuild(houses)
+        write(houses, [1], lambda: houses.delete(houses.get(models.House, 1)))
+        # A zipcode without houses left is removed
+        assert 98999 not in stored_stats(houses)
+        assert_matches_rebuild(houses)
+
+    def test_missing_price_is_not_in_the_mean(self, houses):
+        rows = [dict(row, zipcode=98999) for row in random_houses(2, seed=5, start_id=100)]
+        write(houses, [100, 101], lambda: houses.execute(insert(models.House), rows))
+        set_house(houses, 101, price=None)
+        summary = stored_stats(houses)[98999]
+        assert summary['count'] == 2
+        assert summary['mean_price'] == rows[0]['price']
+        assert_matches_rebuild(houses)
+        set_house(houses, 100, price=None)
+        assert stored_stats(houses)[98999]['mean_price'] is None
+        assert_matches_rebuild(houses)
+
+    def test_existing_row_of_new_zipcode(self, houses):
+        # A row created meanwhile by another write is updated, not inserted again
+        houses.add(models.ZipcodeStats(zipcode=98999, count=0, price_count=0, price_sum=0.0, sqft_price_sum=0.0,
+                                       sqft_price_count=0, waterfront_count=0))
+        houses.commit()
+        set_house(houses, 1, zipcode=98999)
+        assert stored_stats(houses)[98999]['count'] == 1
+        assert_matches_rebuild(houses)
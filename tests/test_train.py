@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from sklearn.model_selection import ParameterGrid
+from train import PARAM_GRID, Fold, grid_search, halving_search
+
+
+@pytest.fixture
+def folds():
+    rng = np.random.default_rng(42)
+    folds = []
+    for _ in range(2):
+        X = rng.normal(size=(1000, 5))
+        y = X @ np.array([3.0, -2.0, 0.5, 0.0, 1.0]) + rng.normal(scale=0.1, size=1000)
+        folds.append(Fold(X[:800], y[:800], X[800:], y[800:]))
+    return folds
+
+
+def test_grid_search(folds):
+    best, results = grid_search(folds, n_jobs=1)
+
+    assert len(results) == len(ParameterGrid(PARAM_GRID))
+    assert best['mean_test_score'] == max(result['mean_test_score'] for result in results)
+    assert all(result['n_resources'] == 800 and result['mean_fit_time'] > 0 for result in results)
+
+
+def test_halving_search(folds):
+    best, results = halving_search(folds, n_jobs=1, factor=3, min_rows=10)
+
+    iterations = [[result for result in results if result['iter'] == i] for i in range(results[-1]['iter'] + 1)]
+    assert [len(iteration) for iteration in iterations] == [15, 5, 2, 1]
+    assert [iteration[0]['n_resources'] for iteration in iterations] == [29, 87, 261, 783]
+    # Only the best third of the candidates go on to the next iteration
+    for previous, current in zip(iterations, iterations[1:]):
+        assert sorted(str(result['params']) for result in current) == \
+            sorted(str(result['params']) for result in previous[:len(current)])
+    assert best is iterations[-1][0]
@@ -0,0 +1,151 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from fixtures import clear_service_caches, reset_service, use_service, wait_for_warm_up
+
+use_service()
+import database  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from warmup import WarmUp  # noqa: E402
+
+
+def gated_step(gate: asyncio.Event, result=None, error=None):
+    async def step():
+        await gate.wait()
+        if error is not None:
+            raise error
+        return result
+    return step
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+class TestWarmUp:
+
+    def test_steps(self):
+        async def run():
+            gates = [asyncio.Event() for _ in range(3)]
+            warm_up = WarmUp([("database", gated_step(gates[0])), ("index", gated_step(gates[1])),
+                              ("model", gated_step(gates[2], result="unavailable"))], required=["database"])
+            assert list(warm_up.states.values()) == ["pending"] * 3
+            warm_up.start()
+            await settle()
+            assert list(warm_up.states.values()) == ["running", "pending", "pending"]
+            assert not warm_up.ready
+            gates[0].set()
+            await settle()
+            # Ready once the required step is done, the others go on in the background
+            assert list(warm_up.states.values()) == ["done", "running", "pending"]
+            assert warm_up.ready
+            gates[1].set()
+            gates[2].set()
+            await settle()
+            assert list(warm_up.states.values()) == ["done", "done", "unavailable"]
+            report = warm_up.report()
+            assert report["ready"] and [step["required"] for step in report["steps"]] == [True, False, False]
+            assert all(step["seconds"] is not None and step["error"] is None for step in report["steps"])
+        asyncio.run(run())
+
+    def test_failed_required_step(self):
+        async def run():
+            gate = asyncio.Event()
+            gate.set()
+            attempts = []
+
+            async def database():
+                attempts.append(1)
+                if len(attempts) == 1:
+                    raise RuntimeError("connection refused")
+
+            warm_up = WarmUp([("database", database), ("index", gated_step(gate))], required=["database"])
+            warm_up.start()
+            await settle()
+            # The steps after a failed required step are not run
+            assert warm_up.states == dict(database="failed", index="pending")
+            assert warm_up.report()["steps"][0]["error"] == "RuntimeError: connection refused"
+            assert not warm_up.ready
+            # The next start runs it again
+            warm_up.start()
+            await settle()
+            assert warm_up.states == dict(database="done", index="done")
+            assert warm_up.ready and warm_up.errors == {}
+        asyncio.run(run())
+
+    def test_failed_optional_step(self):
+        async def run():
+            gate = asyncio.Event()
+            gate.set()
+            warm_up = WarmUp([("database", gated_step(gate)), ("index", gated_step(gate, error=ValueError("bad"))),
+                              ("model", gated_step(gate))], required=["database"])
+            warm_up.start()
+            await settle()
+            assert warm_up.states == dict(database="done", index="failed", model="done")
+            assert warm_up.ready
+        asyncio.run(run())
+
+
+def get_ready(client):
+    response = client.get("/ready")
+    return response.status_code, {step["name"]: step["state"] for step in response.json()["steps"]}
+
+
+def wait_for_state(client, name, state, timeout=60):
+    deadline = time.monotonic() + timeout
+    while get_ready(client)[1][name] != state:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class TestReady:
+
+    @pytest.fixture
+    def main(self, tmp_path, monkeypatch):
+        yield reset_service(tmp_path, monkeypatch)
+        clear_service_caches()
+
+    def test_ready_once_the_database_is_warmed_up(self, main, monkeypatch):
+        # A threading.Event, the test and the event loop of the TestClient run in different threads
+        gate = threading.Event()
+        warm_up_database = main.warm_up_database
+
+        async def gated_database():
+            while not gate.is_set():
+                await asyncio.sleep(0.01)
+            await warm_up_database()
+
+        monkeypatch.setattr(main, "warm_up", WarmUp(
+            [("database", gated_database)] + list(main.warm_up.steps.items())[1:], main.warm_up.required))
+
+        with TestClient(main.app) as client:
+            status, states = get_ready(client)
+            assert status == 503
+            assert states["database"] in ("pending", "running")
+            gate.set()
+            wait_for_state(client, "database", "done")
+            assert get_ready(client)[0] == 200
+            assert client.get("/houses").status_code == 200
+
+    def test_failed_database_step(self, main, monkeypatch):
+        # Without the tables and without creating them the database step fails
+        monkeypatch.setattr(database, "DB_CREATE_SCHEMA", False)
+
+        with TestClient(main.app) as client:
+            wait_for_state(client, "database", "failed")
+            response = client.get("/ready")
+            assert response.status_code == 503
+            assert response.json()["ready"] is False
+            steps = response.json()["steps"]
+            assert "Missing tables" in steps[0]["error"]
+            # The steps after it wait for the database
+            assert all(step["state"] == "pending" for step in steps[1:])
+            assert client.get("/houses").status_code == 500
+
+            # /ready runs the failed step again
+            monkeypatch.setattr(database, "DB_CREATE_SCHEMA", True)
+            wait_for_warm_up(client)
+            assert get_ready(client)[0] == 200